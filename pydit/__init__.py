@@ -1,9 +1,24 @@
 """Pydit - A toolkit for data wrangling, specifically designed for Internal Auditors"""
 
+from . import statistics, wrangling
 from .logger import setup_logging, start_logging_debug, start_logging_info
-from .statistics import *
-from .wrangling import *
 
 __version__ = "0.2.00"
 
 __all__ = ["setup_logging", "start_logging_debug", "start_logging_info"]
+
+
+def __getattr__(name):
+    # the functions of the sub-packages are available at the root, they are
+    # imported on first use so "import pydit" stays fast, see the lazy
+    # exports of each sub-package
+    for package in (statistics, wrangling):
+        if name in package.__all__:
+            value = getattr(package, name)
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(statistics.__all__) | set(wrangling.__all__))
@@ -1,28 +1,37 @@
 """__init__.py"""
 
+import importlib
+
 from ..logger import setup_logging, start_logging_debug, start_logging_info
-from .benford import (
-    benford_list_anomalies,
-    benford_mad,
-    benford_probability,
-    benford_to_dataframe,
-    benford_to_plot,
-)
-from .percentile import add_percentile
-from .profile_dataframe_statistics import profile_dataframe
-from .simulation import (
-    Simulation,
-    SimulationLognormal,
-    SimulationTriangular,
-    SimulationUniform,
-)
+
+# The functions are imported from their modules on first use, so importing
+# the package doesn't import all the modules and their dependencies
+_LAZY_EXPORTS = {
+    "benford_batch": ".benford",
+    "benford_by_group": ".benford",
+    "benford_list_anomalies": ".benford",
+    "benford_mad": ".benford",
+    "benford_probability": ".benford",
+    "benford_to_dataframe": ".benford",
+    "benford_to_plot": ".benford",
+    "BenfordAccumulator": ".benford",
+    "add_percentile": ".percentile",
+    "profile_dataframe": ".profile_dataframe_statistics",
+    "Simulation": ".simulation",
+    "SimulationLognormal": ".simulation",
+    "SimulationTriangular": ".simulation",
+    "SimulationUniform": ".simulation",
+}
 
 __all__ = [
+    "BenfordAccumulator",
     "Simulation",
     "SimulationLognormal",
     "SimulationTriangular",
     "SimulationUniform",
     "add_percentile",
+    "benford_batch",
+    "benford_by_group",
     "benford_list_anomalies",
     "benford_mad",
     "benford_probability",
@@ -33,3 +42,16 @@ __all__ = [
     "start_logging_debug",
     "start_logging_info",
 ]
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        module = importlib.import_module(_LAZY_EXPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -21,7 +21,6 @@ there is a tendency to see higher number of transactions with high first digits
 import logging
 import math
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
@@ -58,62 +57,144 @@ def benford_probability(first_n_digits=1):
     return math.log10(1.0 + 1.0 / first_n_digits)
 
 
-def _benford(rawdata, digit=1):
+_POW10 = 10 ** np.arange(20, dtype=np.uint64)
+# a couple of ulps, enough to undo the rounding of the float scaling
+_FLOAT_NUDGE = 2 * np.finfo(np.float64).eps
+
+
+def _first_digits_numeric(values, digit):
+    """First n significant digits of a numeric array, with log10/floor arithmetic
+
+    Returns an int64 array with 0 for zeros, nan and infinite values.
+    Integers are computed exactly, floats are nudged by a couple of ulps so
+    that e.g. 4.35 (stored as 4.3499999...) gives 435, like the digits of
+    its string representation do.
     """
-    Internal function to calculate the core Benford freq expectations vs actual count of values.
+    if np.issubdtype(values.dtype, np.integer):
+        # exact integer arithmetic, the float log10 just gives a first guess
+        # of the exponent, which is then corrected with the powers of ten
+        if np.issubdtype(values.dtype, np.unsignedinteger):
+            # through int64 the values above 2**63-1 would wrap around
+            a = values.astype(np.uint64)
+        else:
+            a = np.abs(values.astype(np.int64)).astype(np.uint64)
+            a[values.astype(np.int64) == np.iinfo(np.int64).min] = np.uint64(2**63)
+        valid = a > 0
+        e = np.zeros(len(a), dtype=np.int64)
+        e[valid] = np.floor(np.log10(a[valid].astype(np.float64))).astype(np.int64)
+        e = np.clip(e, 0, 19)
+        e -= valid & (a < _POW10[e])
+        e += (e < 19) & (a >= _POW10[np.minimum(e + 1, 19)])
+        shift = e - (digit - 1)
+        down = np.maximum(shift, 0)
+        up = np.maximum(-shift, 0)
+        d = (a // _POW10[down]) * _POW10[up]
+        return np.where(valid, d, 0).astype(np.int64)
+
+    x = np.abs(values.astype(np.float64))
+    valid = np.isfinite(x) & (x > 0)
+    x = np.where(valid, x, 1.0)
+    shift = np.floor(np.log10(x)) - (digit - 1)
+    # dividing by an exact power of ten is more precise than multiplying
+    # by a negative power
+    m = np.where(shift >= 0, x / 10.0 ** np.abs(shift), x * 10.0 ** np.abs(shift))
+    d = np.floor(m * (1 + _FLOAT_NUDGE))
+    # log10 can be off by one right at the powers of ten
+    d = np.where(d >= 10**digit, np.floor(d / 10), d)
+    d = np.where(d < 10 ** (digit - 1), np.floor(m * 10 * (1 + _FLOAT_NUDGE)), d)
+    return np.where(valid, d, 0).astype(np.int64)
+
+
+def _first_digits(rawdata, digit=1):
+    """
+    Internal function to extract the first n digits of each value.
+
+    Numeric data uses a fast arithmetic path, anything else (strings, mixed
+    objects) is cleaned as text: we drop anything that is not a digit and
+    the leading zeros, so negatives and decimals give their significant
+    digits, e.g. -0.0345 gives 3, 34 or 345.
 
     Parameters
     ----------
-    rawdata : list
+    rawdata : list or Series or array
         The data to be analyzed.
     digit : int, optional, default: 1
 
     Returns
     -------
-    tuple
-        A tuple with the counts, expected counts and Benford's Law expected frequencies.
+    numpy.ndarray
+        int64 array with the first n digits of each value, 0 for zeroes,
+        blanks and invalid values.
 
     """
     s = pd.Series(rawdata)
-    # we cleanup any string, any negative and also accept decimals up to 4 zeros, you could
-    # remove it and let the astype(int) drop those if this computation gets too slow and you dont
-    # care about small magnitudes.
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(
+        s.dtype
+    ):
+        if pd.api.types.is_unsigned_integer_dtype(s.dtype) and not s.hasnans:
+            values = s.to_numpy(dtype=np.uint64)
+        elif pd.api.types.is_integer_dtype(s.dtype) and not s.hasnans:
+            values = s.to_numpy(dtype=np.int64)
+        else:
+            values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        return _first_digits_numeric(values, digit)
 
+    # we cleanup any string, any negative and also accept decimals, the
+    # padding zeroes keep the zeroes and blanks as a valid integer and give
+    # the short values the same digits as the numeric path, e.g. 7 is 700
     data_clean = (
         s.apply(str)
         .str.replace(r"[^0-9]", "", regex=True)
         .replace(r"^0+", "", regex=True)
-        + "0"
+        + "0" * digit
     )
+    return data_clean.str[0:digit].astype("int64").to_numpy()
 
-    data = data_clean[data_clean != "0"].astype(str).str[0:digit].astype("int")
-    invalid_count = len(rawdata) - len(data)
+
+def _benford(rawdata, digit=1):
+    """
+    Internal function to calculate the core Benford freq expectations vs actual count of values.
+
+    Parameters
+    ----------
+    rawdata : list
+        The data to be analyzed.
+    digit : int, optional, default: 1
+
+    Returns
+    -------
+    tuple
+        A tuple with the counts, expected counts and Benford's Law expected frequencies.
+
+    """
+    digits = _first_digits(rawdata, digit)
+    data = digits[digits > 0]
+    invalid_count = len(digits) - len(data)
     if invalid_count > 0:
         logger.warning(
             "Of the %s records received, %s are zeroes, blank or invalid and will be ignored, processing %s records",
-            len(rawdata),
+            len(digits),
             invalid_count,
             len(data),
         )
+    # the digits are all in the range by construction, so the bincount gives
+    # the count of each of them, including the ones with no records
+    counts = np.bincount(data, minlength=10**digit)[10 ** (digit - 1) :]
+    return _benford_expected_counts(counts, digit)
+
+
+def _benford_expected_counts(counts, digit=1):
+    """Adds to the actual counts of the first digits their expected counts
+
+    Returns the same tuple as _benford(), for counts already computed.
+    """
     rng = range(
         10 ** (digit - 1), 10**digit
     )  # fancy way to calculate ranges for whatever first x digits
     BFD = [
         math.log10(1.0 + 1.0 / n) for n in rng
     ]  # this is the actual benford law probability
-    data_count = {}
-    bincounts = np.bincount(data)
-    data_count = {}
-    for i in rng:
-        try:
-            data_count[i] = bincounts[i]
-        except IndexError:  # no records start with that N digit(s)
-            data_count[i] = 0
-    # we could have used zip to create a dictionary but the rng can be very particular
-    # e.g. excludes zeros and 1-9 when digit=2. The safest way is to just pick the count
-    # for the integers range we defined in rng
-    counts = data_count.values()
-    total_count = sum(counts)
+    total_count = counts.sum()
     expected_count = [p * total_count for p in BFD]
     # We are not rounding/flooring here because it may be useful to have the
     # fractions even if it doesnt make sense in real life, just to reconcile totals
@@ -155,6 +236,11 @@ def benford_to_dataframe(obj, column_name="", first_n_digits=1):
         raise TypeError("obj must be a DataFrame or Series or list or tuple")
 
     act_count, exp_count, exp_freq = _benford(data, first_n_digits)
+    return _benford_frame(act_count, exp_count, exp_freq, first_n_digits)
+
+
+def _benford_frame(act_count, exp_count, exp_freq, first_n_digits):
+    """Builds the dataframe with the bf_* columns from the counts"""
     total_count = sum(act_count)
     dfres = pd.DataFrame(
         tuple(
@@ -225,6 +311,9 @@ def benford_to_plot(df, column_name, first_n_digits=1, filename=None, show=True)
 
     """
 
+    # pylint: disable=import-outside-toplevel
+    import matplotlib.pyplot as plt
+
     dfres = benford_to_dataframe(df, column_name, first_n_digits)
     y1 = dfres["bf_exp_count"]
     y2 = dfres["bf_act_count"]
@@ -287,34 +376,387 @@ def benford_list_anomalies(
         A copy of the dataframe with the expected and actual Benford's Law frequency.
         Also adds an extra "flag_bf_anomaly" boolean column that is True for those
         records where the first n digits match those identified as top N anomalies
+        The rows with zeroes, blanks or invalid values get bf_digit 0, nan in
+        the rest of the Benford's columns and False in flag_bf_anomaly.
 
     """
-    dfres = benford_to_dataframe(df, column_name, first_n_digits)
-    anomalies = list(
-        dfres.sort_values("bf_diff_perc", ascending=False).head(top_n_digits)[
-            "bf_digit"
-        ]
+    if not isinstance(first_n_digits, int):
+        raise TypeError("first_n_digits must be an integer")
+    if first_n_digits == 0 or first_n_digits > 4:
+        raise ValueError("first_n_digits must be between 1 and 4")
+    if column_name not in df.columns:
+        raise ValueError("column_name not found in dataframe")
+
+    # we extract the digits only once, to count them and to look up the
+    # benford columns of each row by position, digit 0 is blank or invalid
+    digits = _first_digits(df[column_name], first_n_digits)
+    low = 10 ** (first_n_digits - 1)
+    valid = digits > 0
+    if (invalid_count := len(digits) - valid.sum()) > 0:
+        logger.warning(
+            "Of the %s records received, %s are zeroes, blank or invalid and will not be flagged",
+            len(digits),
+            invalid_count,
+        )
+    counts = np.bincount(digits[valid], minlength=10**first_n_digits)[low:]
+    dfres = _benford_frame(
+        *_benford_expected_counts(counts, first_n_digits), first_n_digits
     )
-    dfres["flag_bf_anomaly"] = dfres.apply(lambda r: r["bf_digit"] in anomalies, axis=1)
+    top = np.argsort(-dfres["bf_diff_perc"].to_numpy(), kind="stable")
+    dfres["flag_bf_anomaly"] = False
+    dfres.loc[top[:top_n_digits], "flag_bf_anomaly"] = True
+
+    position = np.where(valid, digits - low, 0)
+    new_columns = {"bf_digit": digits}
+    for col in dfres.columns[1:]:
+        values = dfres[col].to_numpy()[position]
+        if col == "flag_bf_anomaly":
+            values = values & valid
+        else:
+            values = np.where(valid, values, np.nan)
+        # same names as the merge with suffixes we used to do
+        if col in df.columns:
+            col = col + "_bf" + str(first_n_digits)
+        new_columns[col] = values
+    # assign() doesn't modify the caller's dataframe and, with copy on
+    # write, doesn't copy its columns either
+    dfres = df.assign(**new_columns)
 
-    df["bf_digit"] = (
-        df[column_name]
-        .apply(str)
-        .str.replace(r"[^0-9]", "", regex=True)
-        .replace(r"^0+", "", regex=True)
-        + "0"
+    if return_anomalies_only:
+        return dfres[dfres["flag_bf_anomaly"]]
+
+    return dfres
+
+
+def _benford_expected(test):
+    """Digits and expected Benford's Law frequencies for a test
+
+    test is the number of first digits (1 to 4), "second" for the second
+    digit alone or "last2" for the last two digits, which are uniform.
+    """
+    if test == "second":
+        digits = np.arange(10)
+        first = np.arange(1, 10)[:, None]
+        freq = np.log10(1.0 + 1.0 / (10 * first + digits)).sum(axis=0)
+    elif test == "last2":
+        digits = np.arange(100)
+        freq = np.full(100, 0.01)
+    else:
+        digits = np.arange(10 ** (test - 1), 10**test)
+        freq = np.log10(1.0 + 1.0 / digits)
+    return digits, freq
+
+
+def _benford_last_two(rawdata):
+    """Last two digits of the integer part, -1 for values below 10 or invalid"""
+    s = pd.Series(rawdata)
+    if not pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(
+        s.dtype
+    ):
+        s = pd.to_numeric(s, errors="coerce")
+    if pd.api.types.is_unsigned_integer_dtype(s.dtype) and not s.hasnans:
+        a = s.to_numpy(dtype=np.uint64)
+    elif pd.api.types.is_integer_dtype(s.dtype) and not s.hasnans:
+        a = np.abs(s.to_numpy(dtype=np.int64))
+    else:
+        x = np.abs(s.to_numpy(dtype=np.float64, na_value=np.nan))
+        x = np.where(np.isfinite(x), x, 0)
+        a = np.floor(x).astype(np.int64)
+    return np.where(a >= 10, (a % 100).astype(np.int64), -1)
+
+
+def benford_batch(df, columns, tests=(1, 2, 3, "last2", "second")):
+    """Runs several Benford's Law tests on several columns in one pass.
+
+    The first digits of each column are extracted only once, for the
+    largest number of digits requested, and the rest of the tests are
+    derived from them, so this is much faster than calling
+    benford_to_dataframe() for each column and test.
+
+    Following Nigrini, the results include for each digit the Z statistic,
+    and for each test the Mean Absolute Deviation of the proportions and
+    the chi-square statistic with its p-value.
+    Note that this MAD is the mean of abs(actual - expected frequency), as
+    used in the conformity tables of the literature, and not the average of
+    the percentage deviations that benford_mad() returns.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The data to be analyzed.
+    columns : str or list
+        The column or columns to be analyzed.
+    tests : list, optional, default: (1, 2, 3, "last2", "second")
+        The tests to run: 1 to 4 for the first n digits, "second" for the
+        second digit and "last2" for the last two digits of the integer part.
+        The last two digits test ignores the values below 10, for the rest
+        the short values are padded with zeroes as in benford_to_dataframe().
+
+    Returns
+    -------
+    DataFrame
+        A tidy dataframe with one row per column, test and digit, with the
+        columns: column, test, bf_digit, bf_exp_count, bf_act_count,
+        bf_exp_freq, bf_act_freq, bf_z, and per test bf_n (the records
+        tested), bf_mad, bf_chi2 and bf_chi2_pvalue.
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from scipy.stats import chi2
+
+    if isinstance(columns, str):
+        columns = [columns]
+    for col in columns:
+        if col not in df.columns:
+            raise ValueError(f"column {col} not found in dataframe")
+    if isinstance(tests, (int, str)):
+        tests = [tests]
+    for test in tests:
+        if test not in ("second", "last2") and test not in (1, 2, 3, 4):
+            raise ValueError(f"tests must be 1 to 4, second or last2, got {test}")
+    n_first = max(
+        [t for t in tests if isinstance(t, int)] + [2 if "second" in tests else 1]
     )
-    df["bf_digit"] = df["bf_digit"].str[0:first_n_digits].astype(int)
 
-    dfmerged = pd.merge(
-        df,
-        dfres,
-        on="bf_digit",
-        how="left",
-        suffixes=(None, "_bf" + str(first_n_digits)),
-    ).fillna(False)
+    results = []
+    for col in columns:
+        first = _first_digits(df[col], n_first)
+        last_two = _benford_last_two(df[col]) if "last2" in tests else None
+        logger.info("Extracted the digits of %s", col)
+        for test in tests:
+            if test == "last2":
+                codes = last_two[last_two >= 0]
+            elif test == "second":
+                codes = first // 10 ** (n_first - 2)
+                codes = codes[codes > 0] % 10
+            else:
+                codes = first // 10 ** (n_first - test)
+                codes = codes[codes > 0]
+            digits, exp_freq = _benford_expected(test)
+            act_count = np.bincount(codes - digits[0], minlength=len(digits))
+            total = act_count.sum()
+            act_freq = act_count / total if total else np.zeros(len(digits))
+            exp_count = exp_freq * total
+            abs_diff = np.abs(act_freq - exp_freq)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Nigrini's Z with the continuity correction when it is
+                # smaller than the difference
+                correction = 1 / (2 * total) if total else 0
+                z = np.where(correction < abs_diff, abs_diff - correction, abs_diff)
+                z = z / np.sqrt(exp_freq * (1 - exp_freq) / total)
+                chi_square = ((act_count - exp_count) ** 2 / exp_count).sum()
+            results.append(
+                pd.DataFrame(
+                    {
+                        "column": col,
+                        "test": str(test),
+                        "bf_digit": digits,
+                        "bf_exp_count": exp_count,
+                        "bf_act_count": act_count,
+                        "bf_exp_freq": exp_freq,
+                        "bf_act_freq": act_freq,
+                        "bf_z": z,
+                        "bf_n": total,
+                        "bf_mad": abs_diff.mean(),
+                        "bf_chi2": chi_square,
+                        "bf_chi2_pvalue": chi2.sf(chi_square, len(digits) - 1),
+                    }
+                )
+            )
+    return pd.concat(results, ignore_index=True)
 
-    if return_anomalies_only:
-        return dfmerged[dfmerged["flag_bf_anomaly"] == True]
 
-    return dfmerged
+def benford_by_group(df, amount_col, group_cols, first_n_digits=1):
+    """Ranks the groups of a dataframe by their deviation from Benford's Law.
+
+    Useful to find the cost centres, approvers or vendors whose amounts
+    conform the least. It counts the first digits of all the groups at once,
+    with a single bincount of the combined group and digit codes, and
+    computes the statistics for all the groups as array operations, so it
+    scales to tens of thousands of groups.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The data to be analyzed.
+    amount_col : str
+        The column with the amounts.
+    group_cols : str or list
+        The column or columns that define the groups, rows with nulls in
+        them are ignored.
+    first_n_digits : int, optional, default: 1
+        The number of first digits to be considered.
+
+    Returns
+    -------
+    DataFrame
+        One row per group with the group columns and bf_n (the records
+        with valid digits), bf_mad (Mean Absolute Deviation of the
+        proportions), bf_chi2 and bf_chi2_pvalue (chi-square statistic and
+        p-value), bf_ks (Kolmogorov-Smirnov statistic, the largest
+        difference of the cumulative proportions) and bf_ks_critical (its
+        critical value at 5%, 1.36/sqrt(n)).
+        Sorted by bf_mad, the most anomalous groups first. Note that small
+        groups tend to have a large MAD just by chance, so check bf_n.
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from scipy.stats import chi2
+
+    if not isinstance(first_n_digits, int):
+        raise TypeError("first_n_digits must be an integer")
+    if first_n_digits == 0 or first_n_digits > 4:
+        raise ValueError("first_n_digits must be between 1 and 4")
+    if isinstance(group_cols, str):
+        group_cols = [group_cols]
+    for col in [amount_col, *group_cols]:
+        if col not in df.columns:
+            raise ValueError(f"column {col} not found in dataframe")
+
+    grouped = df.groupby(group_cols, sort=True, observed=True)
+    # the rows with nulls in the groups get nan, which we turn into -1
+    group_codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    groups = grouped.size().index
+    n_groups = len(groups)
+    digits, exp_freq = _benford_expected(first_n_digits)
+    n_digits = len(digits)
+
+    first = _first_digits(df[amount_col], first_n_digits)
+    valid = (first > 0) & (group_codes >= 0)
+    combined = group_codes[valid] * n_digits + (first[valid] - digits[0])
+    counts = np.bincount(combined, minlength=n_groups * n_digits).reshape(
+        n_groups, n_digits
+    )
+    logger.info("Counted the digits of %s groups", n_groups)
+
+    total = counts.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        act_freq = counts / total[:, None]
+        mad = np.abs(act_freq - exp_freq).mean(axis=1)
+        exp_count = exp_freq * total[:, None]
+        chi_square = ((counts - exp_count) ** 2 / exp_count).sum(axis=1)
+        ks = np.abs(np.cumsum(act_freq, axis=1) - np.cumsum(exp_freq)).max(axis=1)
+        ks_critical = 1.36 / np.sqrt(total)
+    empty = total == 0
+    chi_square[empty] = np.nan
+    ks_critical[empty] = np.nan
+
+    dfres = groups.to_frame(index=False)
+    dfres["bf_n"] = total
+    dfres["bf_mad"] = mad
+    dfres["bf_chi2"] = chi_square
+    dfres["bf_chi2_pvalue"] = chi2.sf(chi_square, n_digits - 1)
+    dfres["bf_ks"] = ks
+    dfres["bf_ks_critical"] = ks_critical
+    return dfres.sort_values(
+        "bf_mad", ascending=False, na_position="last", ignore_index=True
+    )
+
+
+class BenfordAccumulator:
+    """Accumulates the first digits counts of a data stream for Benford's Law
+
+    The Benford tests only need the count of each first digits, so we can
+    feed the data in chunks (e.g. from pd.read_csv(..., chunksize=...)) and
+    keep constant memory, or count separate parts in parallel processes and
+    merge the accumulators. finalize() returns the same dataframe as
+    benford_to_dataframe() would return for all the data at once.
+
+    Parameters
+    ----------
+    first_n_digits : int, optional, default: 1
+        The number of first digits to be considered.
+    column_name : str, optional, default: None
+        The column to be analyzed when the chunks are dataframes.
+
+    Examples
+    --------
+    >>> acc = BenfordAccumulator(first_n_digits=1)
+    >>> acc.update([1, 2, 3]).update(pd.Series([10, 0, 200]))
+    BenfordAccumulator(first_n_digits=1, n=5, invalid=1)
+    >>> acc.finalize()["bf_act_count"].tolist()
+    [2, 2, 1, 0, 0, 0, 0, 0, 0]
+
+    """
+
+    def __init__(self, first_n_digits=1, column_name=None):
+        if not isinstance(first_n_digits, int):
+            raise TypeError("first_n_digits must be an integer")
+        if first_n_digits == 0 or first_n_digits > 4:
+            raise ValueError("first_n_digits must be between 1 and 4")
+        self.first_n_digits = first_n_digits
+        self.column_name = column_name
+        self.counts = np.zeros(9 * 10 ** (first_n_digits - 1), dtype=np.int64)
+        self.invalid_count = 0
+
+    def __repr__(self):
+        return (
+            f"BenfordAccumulator(first_n_digits={self.first_n_digits}, "
+            f"n={self.counts.sum()}, invalid={self.invalid_count})"
+        )
+
+    def update(self, chunk):
+        """Adds the first digits of a chunk of data to the counts
+
+        Parameters
+        ----------
+        chunk : DataFrame or Series or list or numpy array
+            The data, for dataframes the column_name or the only column.
+
+        Returns
+        -------
+        BenfordAccumulator
+            self, to chain calls
+
+        """
+        if isinstance(chunk, pd.DataFrame):
+            if self.column_name in chunk.columns:
+                chunk = chunk[self.column_name]
+            elif self.column_name is None and chunk.shape[1] == 1:
+                chunk = chunk.iloc[:, 0]
+            else:
+                raise ValueError("column_name not found in dataframe")
+        digits = _first_digits(chunk, self.first_n_digits)
+        data = digits[digits > 0]
+        self.invalid_count += len(digits) - len(data)
+        self.counts += np.bincount(data, minlength=10**self.first_n_digits)[
+            10 ** (self.first_n_digits - 1) :
+        ]
+        return self
+
+    def merge(self, other):
+        """Adds the counts of another accumulator, e.g. from another process
+
+        Returns
+        -------
+        BenfordAccumulator
+            self, to chain calls
+
+        """
+        if not isinstance(other, BenfordAccumulator):
+            raise TypeError("other must be a BenfordAccumulator")
+        if other.first_n_digits != self.first_n_digits:
+            raise ValueError("Can't merge accumulators of different first_n_digits")
+        self.counts += other.counts
+        self.invalid_count += other.invalid_count
+        return self
+
+    def finalize(self):
+        """Returns the summary with the expected and actual frequencies
+
+        Returns
+        -------
+        DataFrame
+            The same dataframe as benford_to_dataframe(), with the bf_* columns
+
+        """
+        if self.invalid_count > 0:
+            logger.warning(
+                "Of the %s records received, %s are zeroes, blank or invalid and were ignored",
+                self.counts.sum() + self.invalid_count,
+                self.invalid_count,
+            )
+        act_count, exp_count, exp_freq = _benford_expected_counts(
+            self.counts.copy(), self.first_n_digits
+        )
+        return _benford_frame(act_count, exp_count, exp_freq, self.first_n_digits)
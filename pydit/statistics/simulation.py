@@ -4,14 +4,14 @@ parametrised distributions for simulation purposes
 It is still in experimental stage and may not be fully functional
 or tested. Use at your own risk.
 
+scipy and matplotlib are imported when first used, as they are slow to import.
+
 
 """
 
 import math
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import lognorm, norm, triang, uniform
 
 
 class Simulation:
@@ -50,6 +50,9 @@ class Simulation:
 
     def generate(self, size=1, random_series=None):
         """generate simulation, by default uses normal distribution"""
+        # pylint: disable=import-outside-toplevel
+        from scipy.stats import norm
+
         alpha = 1 - self.probability
         z = norm.ppf(1 - alpha / 2)
         if self.mean is None:
@@ -71,6 +74,9 @@ class Simulation:
 
     def plot_log_scale(self):
         """plot the histogram of the samples in log scale"""
+        # pylint: disable=import-outside-toplevel
+        import matplotlib.pyplot as plt
+
         plt.hist(self.samples, bins=100, edgecolor="k", alpha=0.7)
         plt.title("Monte Carlo Simulation")
         plt.xlabel("Values")
@@ -81,6 +87,9 @@ class Simulation:
 
     def plot(self, bins=100):
         """plot the histogram of the samples"""
+        # pylint: disable=import-outside-toplevel
+        import matplotlib.pyplot as plt
+
         _, _, _ = plt.hist(self.samples, bins=bins, edgecolor="k", alpha=0.7)
         plt.title("Monte Carlo Simulation")
         plt.xlabel("Values")
@@ -158,6 +167,9 @@ class SimulationLognormal(Simulation):
     def generate(
         self, size=1, random_series=None
     ):  # generate the lognormal distribution
+        # pylint: disable=import-outside-toplevel
+        from scipy.stats import lognorm, norm
+
         assert size > 0, "size must be greater than 0"
         if (random_series is not None) and (len(random_series) >= size):
             self.random_series = random_series[:size]
@@ -214,6 +226,9 @@ class SimulationUniform(Simulation):
         )
 
     def generate(self, size=1, random_series=None):  # generate the uniform distribution
+        # pylint: disable=import-outside-toplevel
+        from scipy.stats import uniform
+
         assert size > 0, "size must be greater than 0"
         if (random_series is not None) and (len(random_series) >= size):
             self.random_series = random_series[:size]
@@ -273,6 +288,9 @@ class SimulationTriangular(Simulation):
     def generate(
         self, size=1, random_series=None
     ):  # generate the triangular distribution
+        # pylint: disable=import-outside-toplevel
+        from scipy.stats import triang
+
         assert size > 0, "size must be greater than 0"
         if (random_series is not None) and (len(random_series) >= size):
             self.random_series = random_series[:size]
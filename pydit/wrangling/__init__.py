@@ -9,65 +9,86 @@ you should be able to create your own logger object and run with it.
 
 """
 
+import importlib
+import sys
+import types
+
 from ..logger import setup_logging, start_logging_debug, start_logging_info
-from .anonymise import anonymise_key
-from .blanks import check_blanks
-from .calendar_table import create_calendar
-from .cleanup_dataframe_columns_names import cleanup_column_names
-from .coalesce_dataframe_columns import coalesce_columns
-from .coalesce_dataframe_values import coalesce_values
-from .collapse_dataframe_levels import collapse_levels
-from .counts import (
-    count_cumulative_unique,
-    count_isna,
-    count_notna,
-    count_related_key,
-    count_values_in_col,
-    has_different_values,
-)
-from .date_time_calculations import (
-    business_calendar,
-    calculate_business_hours,
-    calculate_business_hours_fast,
-    date_relative_in_words,
-    first_and_end_of_month,
-)
-from .duplicates import check_duplicates
-from .file_utils import get_latest_modif_file_from_dir
-from .fillna import fillna_smart
-from .fuzzy_matching import clean_string, create_fuzzy_key
-from .groupby_text_concatenate import groupby_text
-from .keyword_search_batch import keyword_search
-from .lookup_values import lookup_values
-from .map_common_values import map_values
-from .merge import merge_outer_and_split, merge_smart
-from .referential_integrity_check import check_referential_integrity
-from .sequence import check_sequence, group_gaps
-from .split_transactions import check_for_split_transactions
-from .truncate_datetime import truncate_datetime_dataframe
-from .various import (
-    create_test_dataframe,
-    dataframe_to_code,
-    deduplicate_list,
-    print_green,
-    print_red,
-)
-
-# Here we import each of the functions in the functions/ directory to have them
-# available in the functions namespace.
-# In turn functions gets imported with * at root
+
+# The functions are imported from their modules on first use, so importing
+# the package doesn't import all the modules and their dependencies
+_LAZY_EXPORTS = {
+    "anonymise_key": ".anonymise",
+    "check_blanks": ".blanks",
+    "create_calendar": ".calendar_table",
+    "cleanup_column_names": ".cleanup_dataframe_columns_names",
+    "coalesce_columns": ".coalesce_dataframe_columns",
+    "coalesce_values": ".coalesce_dataframe_values",
+    "collapse_levels": ".collapse_dataframe_levels",
+    "count_cumulative_unique": ".counts",
+    "count_isna": ".counts",
+    "count_notna": ".counts",
+    "count_related_key": ".counts",
+    "count_values_in_col": ".counts",
+    "has_different_values": ".counts",
+    "business_calendar": ".date_time_calculations",
+    "calculate_business_hours": ".date_time_calculations",
+    "calculate_business_hours_fast": ".date_time_calculations",
+    "date_relative_in_words": ".date_time_calculations",
+    "first_and_end_of_month": ".date_time_calculations",
+    "check_duplicates": ".duplicates",
+    "check_duplicates_batch": ".duplicates",
+    "check_duplicates_file": ".duplicates",
+    "check_near_duplicates": ".duplicates",
+    "get_latest_modif_file_from_dir": ".file_utils",
+    "fillna_smart": ".fillna",
+    "clean_string": ".fuzzy_matching",
+    "clean_string_series": ".fuzzy_matching",
+    "create_fuzzy_key": ".fuzzy_matching",
+    "create_phonetic_key": ".fuzzy_matching",
+    "fuzzy_merge": ".fuzzy_matching",
+    "FuzzyIndex": ".fuzzy_matching",
+    "jaro_winkler_similarity": ".fuzzy_matching",
+    "levenshtein_similarity": ".fuzzy_matching",
+    "token_set_ratio": ".fuzzy_matching",
+    "groupby_text": ".groupby_text_concatenate",
+    "keyword_search": ".keyword_search_batch",
+    "keyword_search_file": ".keyword_search_batch",
+    "keyword_search_incremental": ".keyword_search_batch",
+    "KeywordSearcher": ".keyword_search_batch",
+    "lookup_values": ".lookup_values",
+    "map_values": ".map_common_values",
+    "merge_outer_and_split": ".merge",
+    "merge_smart": ".merge",
+    "check_referential_integrity": ".referential_integrity_check",
+    "check_sequence": ".sequence",
+    "group_gaps": ".sequence",
+    "check_for_split_transactions": ".split_transactions",
+    "truncate_datetime_dataframe": ".truncate_datetime",
+    "create_test_dataframe": ".various",
+    "dataframe_to_code": ".various",
+    "deduplicate_list": ".various",
+    "print_green": ".various",
+    "print_red": ".various",
+}
 
 __all__ = [
+    "FuzzyIndex",
+    "KeywordSearcher",
     "anonymise_key",
     "business_calendar",
     "calculate_business_hours",
     "calculate_business_hours_fast",
     "check_blanks",
     "check_duplicates",
+    "check_duplicates_batch",
+    "check_duplicates_file",
     "check_for_split_transactions",
+    "check_near_duplicates",
     "check_referential_integrity",
     "check_sequence",
     "clean_string",
+    "clean_string_series",
     "cleanup_column_names",
     "coalesce_columns",
     "coalesce_values",
@@ -79,17 +100,23 @@ __all__ = [
     "count_values_in_col",
     "create_calendar",
     "create_fuzzy_key",
+    "create_phonetic_key",
     "create_test_dataframe",
     "dataframe_to_code",
     "date_relative_in_words",
     "deduplicate_list",
     "fillna_smart",
     "first_and_end_of_month",
+    "fuzzy_merge",
     "get_latest_modif_file_from_dir",
     "group_gaps",
     "groupby_text",
     "has_different_values",
+    "jaro_winkler_similarity",
     "keyword_search",
+    "keyword_search_file",
+    "keyword_search_incremental",
+    "levenshtein_similarity",
     "lookup_values",
     "map_values",
     "merge_outer_and_split",
@@ -99,5 +126,38 @@ __all__ = [
     "setup_logging",
     "start_logging_debug",
     "start_logging_info",
+    "token_set_ratio",
     "truncate_datetime_dataframe",
 ]
+
+
+class _LazyPackage(types.ModuleType):
+    """The package module, so importing a submodule doesn't hide a function.
+
+    Importing a submodule binds it as an attribute of the package, which for
+    a function with the same name as its module (lookup_values) would hide
+    the lazy export, as __getattr__ only runs for missing attributes.
+    """
+
+    def __setattr__(self, name, value):
+        if isinstance(value, types.ModuleType) and _LAZY_EXPORTS.get(name) == (
+            "." + name
+        ):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        module = importlib.import_module(_LAZY_EXPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,16 +1,26 @@
 """Module for checking for duplicates in a dataframe.
 
-It wraps the pandas.DataFrame.duplicated() to perform a more "end to end" check
+It does what pandas.DataFrame.duplicated() does, but as a more "end to end" check
 with logging and informational messages. This can be useful in an audit scenario
 as we tend to have to do a lot of duplicate checks in intermediate files.
+There is also a version for CSV/Parquet files that don't fit in memory.
 
 """
 
 import logging
+import os
+import pickle
+import tempfile
 
 import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype, is_string_dtype
+from pandas.api.types import (
+    is_datetime64_any_dtype,
+    is_numeric_dtype,
+    is_string_dtype,
+)
+
+from .file_utils import close_output, read_batches, write_batch
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +28,159 @@ logger = logging.getLogger(__name__)
 # pylint: disable=logging-fstring-interpolation
 
 
+def _group_codes(df, cols):
+    """Factorizes the key columns into one integer code per row.
+
+    Rows with the same values in all the columns get the same code, NaN
+    being equal to NaN like in DataFrame.duplicated(). Codes are numbered in
+    order of first appearance, which we rely on to find first occurrences.
+    """
+    column_codes = []
+    for c in cols:
+        col_codes, col_uniques = pd.factorize(df[c], use_na_sentinel=False)
+        column_codes.append((col_codes, len(col_uniques)))
+    return _combine_codes(column_codes)
+
+
+def _combine_codes(column_codes):
+    """Combines a list of (codes, number of uniques) per column into one code"""
+    codes = None
+    for col_codes, n_uniques in column_codes:
+        if codes is None:
+            codes = col_codes
+        else:
+            # combine with the previous columns and compress the codes again
+            codes, _ = pd.factorize(codes * n_uniques + col_codes)
+    return codes.astype(np.int64)
+
+
+def _first_occurrence(codes):
+    """True for the first row of each code, codes must be in order of appearance"""
+    previous_max = np.maximum.accumulate(np.concatenate([[-1], codes[:-1]]))
+    return codes > previous_max
+
+
+def _duplicate_masks(codes, keep):
+    """Derives the duplicate masks from the group codes with one count pass.
+
+    Returns a tuple of boolean arrays (all, first, last, unique) equivalent to
+    duplicated(keep=False), duplicated(keep="first"), duplicated(keep="last")
+    and the first occurrence of each duplicated group. The last one is only
+    computed if keep="last", otherwise it is None.
+    """
+    counts = np.bincount(codes)
+    is_first = _first_occurrence(codes)
+    dup_all = counts[codes] > 1
+    dup_first = ~is_first
+    dup_last = None
+    if keep == "last":
+        reversed_codes, _ = pd.factorize(codes[::-1])
+        dup_last = ~_first_occurrence(reversed_codes)[::-1]
+    dup_unique = dup_all & is_first
+    return dup_all, dup_first, dup_last, dup_unique
+
+
+def _select_rows(dup_all, dup_first, dup_last, keep, also_return_non_duplicates):
+    """Boolean array of the rows to return given the keep argument"""
+    if also_return_non_duplicates:
+        # we return the non duplicates and follow the keep argument
+        # for which duplicates to keep
+        if keep == "first":
+            return (~dup_all) | ~dup_first
+        if keep == "last":
+            return (~dup_all) | ~dup_last
+        return np.ones(len(dup_all), dtype=bool)
+    # we just return the duplicates
+    if keep == "first":
+        return dup_first
+    if keep == "last":
+        return dup_last
+    return dup_all
+
+
+def _group_columns(codes, dfkeys, aggregates):
+    """Group id, size, rank and the optional aggregates from the group codes.
+
+    Duplicate groups are numbered from 0 in order of first appearance and rows
+    without duplicates get -1. The rank is 1 for the first row of the group,
+    in the order of the rows in the dataframe (i.e. before any sorting), so it
+    is consistent with keep="first".
+    aggregates is a dict of column: function with function being one of
+    "sum", "mean", "min", "max" and "count", applied skipping nan.
+    Returns a dict of column name: array aligned to codes.
+    """
+    counts = np.bincount(codes, minlength=1)
+    is_dup_group = counts > 1
+    group_ids = np.cumsum(is_dup_group) - 1
+    group_ids[~is_dup_group] = -1
+    order = np.argsort(codes, kind="stable")
+    starts = np.cumsum(counts) - counts
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[order] = np.arange(len(codes)) - starts[codes[order]] + 1
+    res = {
+        "dup_group_id": group_ids[codes],
+        "dup_group_size": counts[codes],
+        "dup_rank_in_group": rank,
+    }
+    for c, func in aggregates.items():
+        values = dfkeys[c].to_numpy(dtype=float, na_value=np.nan)
+        notna = ~np.isnan(values)
+        n_values = np.bincount(codes[notna], minlength=len(counts))
+        if func in ("sum", "mean"):
+            agg = np.bincount(
+                codes[notna], weights=values[notna], minlength=len(counts)
+            )
+            if func == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    agg = agg / n_values
+        elif func in ("min", "max"):
+            ufunc = np.fmin if func == "min" else np.fmax
+            agg = np.full(len(counts), np.nan)
+            ufunc.at(agg, codes, values)
+        elif func == "count":
+            agg = n_values
+        else:
+            raise ValueError(f"Unknown aggregation {func} for column {c}")
+        res[f"dup_group_{c}_{func}"] = agg[codes]
+    return res
+
+
+def _blank_counts(col):
+    """Returns a tuple (kind, blanks, zeroes) for a key column
+
+    kind is "numeric", "string" or "other", strings with just spaces count as
+    blanks and zeroes are only counted for numeric columns.
+    """
+    if is_numeric_dtype(col):
+        return "numeric", pd.isna(col).sum(), (col == 0).sum()
+    if is_string_dtype(col):
+        return "string", ((pd.isna(col)) | (col.str.strip() == "")).sum(), 0
+    return "other", pd.isna(col).sum(), 0
+
+
+def _log_blanks(blank_stats):
+    """Logs the warnings for blanks in the key columns
+
+    blank_stats is a dict of column: (kind, blanks, zeroes) as per _blank_counts()
+    """
+    blanks_acum = 0
+    for c, (kind, blanks, zeroes) in blank_stats.items():
+        if kind == "numeric":
+            if blanks > 0:
+                logger.warning(f"{blanks} rows with nan in {c}")
+            if zeroes > 0:
+                logger.warning(f"{zeroes} rows with zeroes in {c}")
+        elif kind == "string":
+            if blanks > 0:
+                logger.warning(f"{blanks} rows with blanks or nan in {c}")
+        else:
+            if blanks > 0:
+                logger.warning(f"{blanks} rows with nans in {c}")
+        blanks_acum += blanks
+    if blanks_acum == 0:
+        logger.info("No blanks found in the key column(s) provided")
+
+
 def check_duplicates(
     obj,
     columns=None,
@@ -27,6 +190,8 @@ def check_duplicates(
     also_return_non_duplicates=False,
     dropna=True,
     silent=False,
+    add_group_columns=False,
+    group_aggregates=None,
 ):
     """Check for duplicates in a dataframe.
 
@@ -56,6 +221,16 @@ def check_duplicates(
     silent: bool
         Minimises outputs
         Defaults to False.
+    add_group_columns: bool, optional
+        If True, adds "dup_group_id" (from 0 for each group of duplicates,
+        -1 for rows without duplicates), "dup_group_size" and
+        "dup_rank_in_group" (1 for the first occurrence in the original order).
+        Defaults to False.
+    group_aggregates: list or dict, optional
+        Numeric column(s) to aggregate per group, added as columns named
+        "dup_group_<column>_<function>". A list sums the columns, a dict
+        maps each column to "sum", "mean", "min", "max" or "count".
+        Implies add_group_columns. Defaults to None.
 
 
     Returns
@@ -75,14 +250,14 @@ def check_duplicates(
     if isinstance(obj, pd.Series):
         # If it is Series we convert it to DataFrame
         if obj.name is None and isinstance(columns, str):
-            obj.name = columns
+            df = obj.rename(columns).to_frame()
         else:
-            obj.name = "data"
             columns = "data"
-        df = obj.to_frame()
+            df = obj.rename("data").to_frame()
 
     else:
-        df = obj.copy()
+        # we only select rows at the end, so no need to copy the input here
+        df = obj
 
     if isinstance(columns, str):
         if columns in df.columns:
@@ -97,23 +272,40 @@ def check_duplicates(
             else:
                 raise ValueError("at least one column provided not in dataframe")
         else:
-            cols = df.columns
+            cols = list(df.columns)
 
-    fields = ",".join(cols)
+    fields = ",".join(str(c) for c in cols)
 
-    has_all_nans = df[cols].isnull().apply(all, axis=1)
-    has_any_nans = df[cols].isnull().apply(any, axis=1)
-    all_nans_count = sum(has_all_nans)
-    not_all_nans_count = sum(has_any_nans) - all_nans_count
+    if group_aggregates is None:
+        group_aggregates = {}
+    elif isinstance(group_aggregates, str):
+        group_aggregates = {group_aggregates: "sum"}
+    elif not isinstance(group_aggregates, dict):
+        group_aggregates = {c: "sum" for c in group_aggregates}
+    for c in group_aggregates:
+        if c not in df.columns:
+            raise ValueError(f"column {c} not in dataframe")
+        if not is_numeric_dtype(df[c]):
+            raise TypeError(f"column {c} must be numeric to be aggregated")
+    if group_aggregates:
+        add_group_columns = True
 
+    dfnans = df[cols].isna()
+    has_all_nans = dfnans.all(axis=1).to_numpy()
+    has_any_nans = dfnans.any(axis=1).to_numpy()
+    all_nans_count = has_all_nans.sum()
+    not_all_nans_count = has_any_nans.sum() - all_nans_count
+
+    # positions of the rows we work with, the frame is only sliced at the end
+    rows = np.arange(len(df))
     if dropna:
         if all_nans_count > 0:
-            df = df.dropna(subset=cols, how="all")
+            rows = np.flatnonzero(~has_all_nans)
             logger.info("Dropping %s records with all nan:", all_nans_count)
             if not_all_nans_count > 0:
                 logger.info(
                     "Of the remaining %s records, %s has nans",
-                    df.shape[0],
+                    len(rows),
                     not_all_nans_count,
                 )
     else:
@@ -122,84 +314,580 @@ def check_duplicates(
         if not_all_nans_count > 0:
             logger.info("and %s records with some nan:", not_all_nans_count)
 
-    # Boolean series with the results of all duplicated() method
-    ser_duplicates = df.duplicated(cols, keep=False)
-    ser_duplicates_first = df.duplicated(cols, keep="first")
-    if keep == "last":
-        ser_duplicates_last = df.duplicated(
-            cols,
-            keep="last",
-        )
-    ser_duplicates_unique = np.logical_and(ser_duplicates, ~ser_duplicates_first)
+    # Boolean arrays, aligned to rows, from a single factorization of the keys
+    keycols = cols + [c for c in group_aggregates if c not in cols]
+    dfkeys = df[keycols].iloc[rows] if len(rows) < len(df) else df[keycols]
+    codes = _group_codes(dfkeys, cols)
+    dup_all, dup_first, dup_last, dup_unique = _duplicate_masks(codes, keep)
+    group_columns = {}
+    if add_group_columns:
+        group_columns = _group_columns(codes, dfkeys, group_aggregates)
     logger.info("Duplicates in fields: %s", fields)
 
-    if ser_duplicates.any():
+    if dup_all.any():
         logger.info("(using keep=%s)", keep)
-        logger.info("Found %s unique duplicates instances", ser_duplicates_unique.sum())
-        logger.info("Totalling %s rows", ser_duplicates.sum())
-        logger.info("of a population of %s", len(df))
+        logger.info("Found %s unique duplicates instances", dup_unique.sum())
+        logger.info("Totalling %s rows", dup_all.sum())
+        logger.info("of a population of %s", len(rows))
         if not dropna:
             if all_nans_count > 0:
                 logger.info("Remember, duplicates count include 1 for the nan rows")
 
-        blanks_acum = 0
-        for c in cols:
-            if is_numeric_dtype(df[c]):
-                blanks = (pd.isna(df[c])).sum()
-                if blanks > 0:
-                    logger.warning(f"{blanks} rows with nan in {c}")
-                zeroes = (df[c] == 0).sum()
-                if zeroes > 0:
-                    logger.warning(f"{zeroes} rows with zeroes in {c}")
-            elif is_string_dtype(df[c]):
-                blanks = ((pd.isna(df[c])) | (df[c].str.strip() == "")).sum()
-                if blanks > 0:
-                    logger.warning(f"{blanks} rows with blanks or nan in {c}")
-            else:
-                blanks = (pd.isna(df[c])).sum()
-                if blanks > 0:
-                    logger.warning(f"{blanks} rows with nans in {c}")
-            blanks_acum += blanks
-        if blanks_acum == 0:
-            logger.info("No blanks found in the key column(s) provided")
+        _log_blanks({c: _blank_counts(dfkeys[c]) for c in cols})
 
+        # order of the rows to return, as positions in rows
+        order = np.arange(len(rows))
         if ascending is not None:
             # Ascending
-            df = df.sort_values(cols, ascending=ascending)
+            order = (
+                dfkeys.reset_index(drop=True)
+                .sort_values(cols, ascending=ascending, kind="stable")
+                .index.to_numpy()
+            )
             logger.info("Sorting by %s with params: %s ", cols, ascending)
 
         if also_return_non_duplicates:
-            # we return the non duplicates and follow the keep argument
-            # for which duplicates to keep
             logger.info("Returning non-duplicates plus keep=%s", keep)
-            if add_indicator_column:
-                df["_duplicates"] = ser_duplicates
-            if keep == "first":
-                dfres = df.loc[(~ser_duplicates) | ~ser_duplicates_first].copy()
-            elif keep == "last":
-                dfres = df.loc[(~ser_duplicates) | ~ser_duplicates_last].copy()
-            else:
-                dfres = df.copy()
-
         else:
-            # we just return the duplicates
             logger.info("Returning duplicates applying pandas keep=%s", keep)
-            if add_indicator_column:
-                df["_duplicates"] = ser_duplicates
-            if keep == "first":
-                dfres = df.loc[ser_duplicates_first].copy()
-            elif keep == "last":
-                dfres = df.loc[ser_duplicates_last].copy()
-            else:
-                dfres = df.loc[ser_duplicates].copy()
+        selected = _select_rows(
+            dup_all, dup_first, dup_last, keep, also_return_non_duplicates
+        )
 
+        order = order[selected[order]]
+        dfres = df.iloc[rows[order]]
+        if add_indicator_column:
+            dfres["_duplicates"] = dup_all[order]
+        for c, values in group_columns.items():
+            dfres[c] = values[order]
         return dfres
 
     else:
         logger.info("No duplicates found")
-        if add_indicator_column:
-            df["_duplicates"] = False
         if also_return_non_duplicates:
-            return df
+            dfres = df.iloc[rows]
+            if add_indicator_column:
+                dfres["_duplicates"] = False
+            for c, values in group_columns.items():
+                dfres[c] = values
+            return dfres
         # return an empty dataframe
         return None
+
+
+def check_duplicates_batch(
+    obj,
+    key_sets,
+    keep=False,
+    add_indicator_column=False,
+    also_return_non_duplicates=False,
+    dropna=True,
+):
+    """Run several duplicate checks on the same dataframe in one go.
+
+    Typical of a duplicate payments test, where we check e.g.
+    [vendor, amount], [vendor, invoice_no] and [amount, date]. Each distinct
+    column is profiled for blanks and factorized only once, and the codes
+    are reused for all the key sets that include it, which is much faster
+    than calling check_duplicates() for each key set.
+    Note that the blanks are reported for the whole column, before dropping
+    the rows with all nan in each key set.
+
+    Parameters
+    ----------
+    obj : DataFrame
+        The dataframe to check for duplicates
+    key_sets : list
+        List of column(s) to check, each one a column name or a list of
+        columns to check for combined duplicates.
+    keep : 'first','last' or False, optional, default False
+        As per check_duplicates(), applied to all the key sets.
+    add_indicator_column : bool, optional, default False
+        If True, a boolean "_duplicates" column is added to each result.
+    also_return_non_duplicates : bool, optional, default False
+        If True, each result includes the non-duplicate rows too.
+    dropna : bool, optional, default True
+        If True, rows with nan in all the columns of a key set are ignored
+        for that key set.
+
+    Returns
+    -------
+    tuple
+        A tuple (results, indicators):
+        results : dict of key set name (columns joined with ",") to the
+        DataFrame returned by the check, or None if no duplicates found.
+        indicators : DataFrame with the same index as obj and one boolean
+        column per key set, True for the rows that are duplicated.
+
+    """
+    if not isinstance(obj, pd.DataFrame):
+        raise TypeError("obj must be a pandas DataFrame")
+    if not isinstance(key_sets, (list, tuple)) or not key_sets:
+        raise ValueError("key_sets must be a non empty list of columns or lists")
+    key_sets = [[k] if isinstance(k, str) else list(k) for k in key_sets]
+    for cols in key_sets:
+        if not cols or any(c not in obj.columns for c in cols):
+            raise ValueError(f"at least one column in {cols} not in dataframe")
+
+    # the one pass over each distinct column
+    column_codes = {}
+    column_nans = {}
+    blank_stats = {}
+    for c in dict.fromkeys(c for cols in key_sets for c in cols):
+        col_codes, col_uniques = pd.factorize(obj[c], use_na_sentinel=False)
+        column_codes[c] = (col_codes, len(col_uniques))
+        column_nans[c] = obj[c].isna().to_numpy()
+        blank_stats[c] = _blank_counts(obj[c])
+
+    results = {}
+    indicators = {}
+    for cols in key_sets:
+        fields = ",".join(str(c) for c in cols)
+        logger.info("Duplicates in fields: %s", fields)
+        rows = np.arange(len(obj))
+        if dropna:
+            has_all_nans = np.logical_and.reduce([column_nans[c] for c in cols])
+            if has_all_nans.any():
+                rows = np.flatnonzero(~has_all_nans)
+                logger.info("Dropping %s records with all nan:", has_all_nans.sum())
+        codes = _combine_codes([column_codes[c] for c in cols])
+        # compress again so codes are in order of appearance in the rows kept
+        codes, _ = pd.factorize(codes[rows])
+        dup_all, dup_first, dup_last, dup_unique = _duplicate_masks(codes, keep)
+        indicator = np.zeros(len(obj), dtype=bool)
+        indicator[rows] = dup_all
+        indicators[fields] = indicator
+
+        if not dup_all.any():
+            logger.info("No duplicates found")
+            if also_return_non_duplicates:
+                dfres = obj.iloc[rows]
+                if add_indicator_column:
+                    dfres["_duplicates"] = False
+                results[fields] = dfres
+            else:
+                results[fields] = None
+            continue
+
+        logger.info("(using keep=%s)", keep)
+        logger.info("Found %s unique duplicates instances", dup_unique.sum())
+        logger.info("Totalling %s rows", dup_all.sum())
+        logger.info("of a population of %s", len(rows))
+        _log_blanks({c: blank_stats[c] for c in cols})
+        selected = _select_rows(
+            dup_all, dup_first, dup_last, keep, also_return_non_duplicates
+        )
+        dfres = obj.iloc[rows[selected]]
+        if add_indicator_column:
+            dfres["_duplicates"] = dup_all[selected]
+        results[fields] = dfres
+
+    return results, pd.DataFrame(indicators, index=obj.index)
+
+
+# a few ulps of the values compared, so floating point noise like
+# 0.1 + 0.2 - 0.2 > 0.1 doesn't break the tolerance
+_FLOAT_MARGIN = 4 * np.finfo(np.float64).eps
+
+
+def _within(a, b, tol):
+    """Whether the differences of a and b are within tol, with a margin
+    relative to the two values for floating point noise
+    """
+    return np.abs(b - a) <= tol + _FLOAT_MARGIN * np.maximum(np.abs(a), np.abs(b))
+
+
+def _near_duplicate_pairs(block_codes, values, tolerances, window):
+    """Finds the pairs of rows within tolerance with a sorted neighbourhood.
+
+    Rows are sorted by block and by the first fuzzy column, then each row is
+    compared with the next one, the one after, etc. A row stops being compared
+    as soon as the next row is in another block or too far on the first fuzzy
+    column, as all the following ones will be too. So the work done is about
+    the number of candidate pairs, not n squared.
+    Returns two arrays with the row positions of the left and right of each pair.
+    """
+    order = np.lexsort((values[0], block_codes))
+    blocks = block_codes[order]
+    sorted_values = [v[order] for v in values]
+    n = len(order)
+    lefts = []
+    rights = []
+    active = np.arange(n - 1)
+    k = 1
+    while active.size and (window is None or k <= window):
+        active = active[active + k < n]
+        nxt = active + k
+        close = (blocks[nxt] == blocks[active]) & _within(
+            sorted_values[0][active], sorted_values[0][nxt], tolerances[0]
+        )
+        active = active[close]
+        nxt = nxt[close]
+        match = np.ones(len(active), dtype=bool)
+        for v, tol in zip(sorted_values[1:], tolerances[1:]):
+            match &= _within(v[active], v[nxt], tol)
+        lefts.append(order[active[match]])
+        rights.append(order[nxt[match]])
+        k += 1
+    if not lefts:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+
+def check_near_duplicates(
+    obj,
+    exact_cols,
+    fuzzy_cols,
+    tolerances,
+    window=None,
+    return_pairs=False,
+    also_return_non_duplicates=False,
+):
+    """Check for near duplicates, e.g. same supplier, similar amount and date.
+
+    Rows are near duplicates if they have the same values in the exact
+    columns and the differences in each of the fuzzy columns are within the
+    tolerance. Near duplicates are chained in groups (if A is close to B and B
+    close to C, all three are in the same group) and a group id is returned.
+
+    The exact columns are used for blocking, so rows are only compared within
+    the same block, and rows are sorted by the first fuzzy column so each row
+    is only compared with its close neighbours (sorted neighbourhood method).
+    Put first the fuzzy column with the tightest tolerance for best speed.
+    Rows with nan in a fuzzy column are ignored, nan in the exact columns is
+    treated as one more value.
+    For fuzzy text matching, build a fuzzy key first (see create_fuzzy_key())
+    and use it as an exact column.
+
+    Parameters
+    ----------
+    obj : DataFrame
+        The dataframe to check for near duplicates
+    exact_cols : str or list
+        Column(s) that must be equal, e.g. the supplier id. Can be empty.
+    fuzzy_cols : str or list
+        Numeric or datetime column(s) compared with a tolerance.
+    tolerances : number, list or dict
+        Maximum absolute difference for each fuzzy column, as a list aligned
+        to fuzzy_cols or a dict column: tolerance. For datetime columns use a
+        pandas.Timedelta or a number of days.
+    window : int, optional, default None
+        Maximum number of neighbours to compare each row with, after sorting.
+        By default there is no limit and all the pairs within tolerance are
+        found. Set it to cap the work on blocks with many similar values.
+    return_pairs : bool, optional, default False
+        If True, returns a dataframe with one row per pair of near duplicates,
+        with the index of both rows, the group and the differences.
+    also_return_non_duplicates : bool, optional, default False
+        If True, the rows without near duplicates are returned too.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The rows with near duplicates, plus a "_near_duplicates" boolean column
+        and "_near_dup_group" with the group id. None if none were found.
+        Or the dataframe of pairs if return_pairs is True.
+
+    """
+    if not isinstance(obj, pd.DataFrame):
+        raise TypeError("obj must be a pandas DataFrame")
+    if isinstance(exact_cols, str):
+        exact_cols = [exact_cols]
+    exact_cols = list(exact_cols or [])
+    if isinstance(fuzzy_cols, str):
+        fuzzy_cols = [fuzzy_cols]
+    fuzzy_cols = list(fuzzy_cols or [])
+    if not fuzzy_cols:
+        raise ValueError("Provide at least one fuzzy column, or use check_duplicates")
+    if any(c not in obj.columns for c in exact_cols + fuzzy_cols):
+        raise ValueError("at least one column provided not in dataframe")
+    if isinstance(tolerances, dict):
+        tolerances = [tolerances.get(c) for c in fuzzy_cols]
+    elif not isinstance(tolerances, (list, tuple)):
+        tolerances = [tolerances]
+    if len(tolerances) != len(fuzzy_cols) or any(t is None for t in tolerances):
+        raise ValueError("Provide one tolerance per fuzzy column")
+    if window is not None and (not isinstance(window, int) or window < 1):
+        raise ValueError("window must be a positive integer or None")
+
+    values = []
+    tols = []
+    for c, tol in zip(fuzzy_cols, tolerances):
+        col = obj[c]
+        if is_datetime64_any_dtype(col):
+            v = col.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(float)
+            v[col.isna().to_numpy()] = np.nan
+            if not isinstance(tol, pd.Timedelta):
+                tol = pd.Timedelta(days=tol)
+            tol = tol.value
+        elif is_numeric_dtype(col):
+            v = col.to_numpy(dtype=float, na_value=np.nan)
+        else:
+            raise TypeError(f"fuzzy column {c} must be numeric or datetime")
+        tol = abs(tol)
+        values.append(v)
+        tols.append(tol)
+
+    valid = ~np.isnan(np.column_stack(values)).any(axis=1)
+    if (~valid).sum() > 0:
+        logger.info("Ignoring %s records with nan in the fuzzy columns", (~valid).sum())
+    rows = np.flatnonzero(valid)
+    if exact_cols:
+        block_codes = _group_codes(obj[exact_cols].iloc[rows], exact_cols)
+    else:
+        block_codes = np.zeros(len(rows), dtype=np.int64)
+    left, right = _near_duplicate_pairs(
+        block_codes, [v[rows] for v in values], tols, window
+    )
+    left = rows[left]
+    right = rows[right]
+
+    logger.info(
+        "Near duplicates in fields: exact %s, fuzzy %s with tolerances %s",
+        ",".join(str(c) for c in exact_cols),
+        ",".join(str(c) for c in fuzzy_cols),
+        tolerances,
+    )
+    if len(left) == 0:
+        logger.info("No near duplicates found")
+        if also_return_non_duplicates and not return_pairs:
+            return obj.assign(
+                _near_duplicates=False,
+                _near_dup_group=pd.array([pd.NA] * len(obj), dtype="Int64"),
+            )
+        return None
+
+    from scipy.sparse import coo_matrix  # pylint: disable=import-outside-toplevel
+    from scipy.sparse.csgraph import (  # pylint: disable=import-outside-toplevel
+        connected_components,
+    )
+
+    graph = coo_matrix(
+        (np.ones(len(left), dtype=np.int8), (left, right)), shape=(len(obj), len(obj))
+    )
+    _, components = connected_components(graph, directed=False)
+    is_near_dup = np.zeros(len(obj), dtype=bool)
+    is_near_dup[left] = True
+    is_near_dup[right] = True
+    # group ids numbered from 0 in order of appearance of the rows
+    group = np.full(len(obj), -1, dtype=np.int64)
+    group[is_near_dup], _ = pd.factorize(components[is_near_dup])
+    logger.info("Found %s pairs of near duplicates", len(left))
+    logger.info("in %s groups", group.max() + 1)
+    logger.info("Totalling %s rows", is_near_dup.sum())
+    logger.info("of a population of %s", len(obj))
+
+    if return_pairs:
+        dfpairs = pd.DataFrame(
+            {
+                "index_left": obj.index[left],
+                "index_right": obj.index[right],
+                "_near_dup_group": group[left],
+            }
+        )
+        for c in fuzzy_cols:
+            dfpairs[f"{c}_diff"] = (
+                (obj[c].to_numpy()[right]) - (obj[c].to_numpy()[left])
+            )
+        return dfpairs.sort_values(
+            ["_near_dup_group", "index_left", "index_right"], ignore_index=True
+        )
+
+    selected = np.ones(len(obj), dtype=bool)
+    if not also_return_non_duplicates:
+        selected = is_near_dup
+    dfres = obj.iloc[np.flatnonzero(selected)]
+    group_ids = pd.array(group[selected], dtype="Int64")
+    group_ids[~is_near_dup[selected]] = pd.NA
+    return dfres.assign(
+        _near_duplicates=is_near_dup[selected], _near_dup_group=group_ids
+    )
+
+
+def _read_bucket(bucket_path):
+    """Reads back all the dataframes appended to a spill bucket file"""
+    frames = []
+    with open(bucket_path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(frames)
+
+
+def check_duplicates_file(
+    path,
+    columns,
+    output_path,
+    keep=False,
+    add_indicator_column=False,
+    also_return_non_duplicates=False,
+    dropna=True,
+    n_buckets=64,
+    batch_size=100000,
+    tmp_dir=None,
+    **read_kwargs,
+):
+    """Check for duplicates in a CSV or Parquet file too large to fit in memory.
+
+    Same check as check_duplicates() but out of core:
+    - The file is read in batches and each row is sent to one of n_buckets
+      temporary files on disk (spill buckets) based on the hash of its key
+      columns, so all the rows with the same key end up in the same bucket.
+    - Each bucket is then loaded and checked for duplicates on its own, and
+      the rows requested are appended to the output file.
+
+    Peak memory is about the size of the largest bucket, increase n_buckets
+    if they don't fit in memory. The output is grouped by bucket, not in the
+    order of the source file, use the "source_row" column (row number in the
+    source file) to sort it back if needed.
+
+    Parameters
+    ----------
+    path : str
+        The CSV or Parquet (.parquet or .pq) file to check.
+        Parquet files need pyarrow installed.
+    columns: str or list
+        Column or list of column(s) to check even if it is one column only.
+        If multiple columns provided the check is combined duplicates.
+    output_path : str
+        The CSV or Parquet file to write the results to, it will be overwritten.
+    keep: 'first','last' or False, optional
+        Same as check_duplicates(), first and last follow the order in the file.
+    add_indicator_column: bool, optional
+        If True, a boolean column is added to flag duplicate rows.
+    also_return_non_duplicates: bool, optional
+        If True, the non-duplicate rows are written too.
+    dropna: bool, optional
+        If True, the check will ignore rows with all the key columns NaN.
+    n_buckets : int, optional, default 64
+        Number of spill buckets to partition the rows into.
+    batch_size : int, optional, default 100000
+        Number of rows to read at a time.
+    tmp_dir : str, optional, default None
+        Folder where to create the spill buckets, by default the system temp
+        folder. It needs free space for about the size of the file.
+    **read_kwargs :
+        Other arguments passed to pandas.read_csv() e.g. sep or encoding.
+        By default CSV columns are read as strings (dtype=str).
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row summary with the population, rows with all nan keys,
+        duplicate rows, unique duplicate instances and rows written.
+
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    if not columns:
+        raise ValueError("Must provide the key column(s) to check")
+    cols = list(columns)
+    if keep not in [False, "first", "last"]:
+        raise ValueError("keep must be 'first', 'last' or False")
+    if not isinstance(n_buckets, int) or n_buckets < 1:
+        raise ValueError("n_buckets must be a positive integer")
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+
+    fields = ",".join(str(c) for c in cols)
+    population = 0
+    all_nans_count = 0
+    not_all_nans_count = 0
+    blank_stats = {}
+    dup_total = 0
+    unique_total = 0
+    rows_written = 0
+    state = {}
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as spill_dir:
+        # First pass, partition the rows by hash of the key into the buckets
+        for df in read_batches(path, batch_size, read_kwargs):
+            if any(c not in df.columns for c in cols):
+                raise ValueError("at least one column provided not in file")
+            df.index = pd.RangeIndex(population, population + len(df))
+            population += len(df)
+            dfnans = df[cols].isna()
+            has_all_nans = dfnans.all(axis=1).to_numpy()
+            all_nans_count += has_all_nans.sum()
+            not_all_nans_count += dfnans.any(axis=1).sum() - has_all_nans.sum()
+            if dropna:
+                df = df[~has_all_nans]
+            for c in cols:
+                kind, blanks, zeroes = _blank_counts(df[c])
+                _, prev_blanks, prev_zeroes = blank_stats.get(c, (kind, 0, 0))
+                blank_stats[c] = (kind, prev_blanks + blanks, prev_zeroes + zeroes)
+            buckets = (
+                pd.util.hash_pandas_object(df[cols], index=False).to_numpy() % n_buckets
+            )
+            for b in np.unique(buckets):
+                bucket_path = os.path.join(spill_dir, f"bucket_{b}.pkl")
+                with open(bucket_path, "ab") as f:
+                    pickle.dump(df[buckets == b], f)
+        logger.info("Read %s rows into %s buckets", population, n_buckets)
+        if dropna:
+            if all_nans_count > 0:
+                logger.info("Dropping %s records with all nan:", all_nans_count)
+                if not_all_nans_count > 0:
+                    logger.info(
+                        "Of the remaining %s records, %s has nans",
+                        population - all_nans_count,
+                        not_all_nans_count,
+                    )
+        else:
+            if all_nans_count > 0:
+                logger.info(
+                    "Dataframe includes %s records with all nan:", all_nans_count
+                )
+            if not_all_nans_count > 0:
+                logger.info("and %s records with some nan:", not_all_nans_count)
+
+        # Second pass, find the duplicates bucket by bucket
+        try:
+            for b in range(n_buckets):
+                bucket_path = os.path.join(spill_dir, f"bucket_{b}.pkl")
+                if not os.path.exists(bucket_path):
+                    continue
+                dfb = _read_bucket(bucket_path)
+                codes = _group_codes(dfb, cols)
+                dup_all, dup_first, dup_last, dup_unique = _duplicate_masks(codes, keep)
+                dup_total += dup_all.sum()
+                unique_total += dup_unique.sum()
+                selected = _select_rows(
+                    dup_all, dup_first, dup_last, keep, also_return_non_duplicates
+                )
+                dfout = dfb[selected]
+                if add_indicator_column:
+                    dfout = dfout.assign(_duplicates=dup_all[selected])
+                write_batch(dfout, output_path, state)
+                rows_written += len(dfout)
+                os.remove(bucket_path)
+        finally:
+            close_output(output_path, state)
+
+    logger.info("Duplicates in fields: %s", fields)
+    if dup_total > 0:
+        logger.info("(using keep=%s)", keep)
+        logger.info("Found %s unique duplicates instances", unique_total)
+        logger.info("Totalling %s rows", dup_total)
+        logger.info(
+            "of a population of %s",
+            population - all_nans_count if dropna else population,
+        )
+        if not dropna:
+            if all_nans_count > 0:
+                logger.info("Remember, duplicates count include 1 for the nan rows")
+        _log_blanks(blank_stats)
+    else:
+        logger.info("No duplicates found")
+    logger.info("Written %s rows to %s", rows_written, output_path)
+
+    return pd.DataFrame(
+        {
+            "population": [population],
+            "all_nan_rows": [all_nans_count],
+            "duplicate_rows": [dup_total],
+            "unique_duplicate_instances": [unique_total],
+            "rows_written": [rows_written],
+        }
+    )
@@ -1,9 +1,12 @@
 """File utilities for saving and loading files"""
 
 import logging
+import os
 from datetime import datetime
 from pathlib import Path
 
+import pandas as pd
+
 # pylint: disable=logging-fstring-interpolation
 # pylint: disable=logging-not-lazy
 
@@ -47,3 +50,93 @@ def get_latest_modif_file_from_dir(folder_path, pattern="*"):
             latest_file_md = f.stat().st_mtime
             latest_file = f
     return latest_file, datetime.fromtimestamp(latest_file_md)
+
+
+def read_batches(path, batch_size, read_kwargs=None, columns=None):
+    """Yields dataframes of up to batch_size rows from a CSV or Parquet file.
+
+    The index keeps counting across batches so it is the row number in the file.
+    Used by the functions that process files larger than memory, together
+    with write_batch() and close_output().
+
+    Parameters
+    ----------
+    path : str
+        The file, Parquet if it ends with .parquet or .pq, otherwise CSV
+    batch_size : int
+        The number of rows of each batch
+    read_kwargs : dict, optional
+        Extra arguments for pandas.read_csv(), by default text is read as is
+    columns : list, optional
+        The columns to read, by default all
+    """
+    if str(path).lower().endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError("Reading parquet files in batches needs pyarrow") from e
+        offset = 0
+        for batch in pq.ParquetFile(path).iter_batches(
+            batch_size=batch_size, columns=columns
+        ):
+            df = batch.to_pandas()
+            df.index = pd.RangeIndex(offset, offset + len(df))
+            offset += len(df)
+            yield df
+    else:
+        # By default we read text as is, otherwise the same column could be
+        # parsed differently from one batch to the next, e.g. 1 or 1.0
+        read_kwargs = {"dtype": str, **(read_kwargs or {})}
+        yield from pd.read_csv(
+            path, usecols=columns, chunksize=batch_size, **read_kwargs
+        )
+
+
+def write_batch(df, output_path, state):
+    """Appends a batch of rows to a CSV or Parquet output file
+
+    The index is written as the "source_row" column. state is a dict, empty
+    for the first batch, that keeps the open writer between calls, and the
+    output must be finished with close_output(output_path, state).
+    """
+    df = df.rename_axis("source_row").reset_index()
+    if str(output_path).lower().endswith((".parquet", ".pq")):
+        try:
+            import pyarrow as pa  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError("Writing parquet files in batches needs pyarrow") from e
+        if df.empty:
+            # kept in case nothing is written, to write an empty file with
+            # the columns, see close_output()
+            state.setdefault("empty", df)
+            return
+        if state.get("writer") is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            state["writer"] = pq.ParquetWriter(output_path, table.schema)
+        else:
+            # later batches are casted to the schema of the first one written
+            table = pa.Table.from_pandas(
+                df, schema=state["writer"].schema, preserve_index=False
+            )
+        state["writer"].write_table(table)
+    else:
+        started = state.get("csv_started", False)
+        df.to_csv(
+            output_path, mode="a" if started else "w", header=not started, index=False
+        )
+        state["csv_started"] = True
+
+
+def close_output(output_path, state):
+    """Closes the output file, so it always replaces any previous one
+
+    If no rows were written to a Parquet file we write an empty one with the
+    columns, and if no batch was read at all, we remove the previous output.
+    """
+    if state.get("writer") is not None:
+        state["writer"].close()
+    elif "empty" in state:
+        state["empty"].to_parquet(output_path, index=False)
+    elif not state.get("csv_started") and os.path.exists(output_path):
+        os.remove(output_path)
@@ -1,10 +1,17 @@
 """Module with utility functions for fuzzy matching"""
 
+import hashlib
+import json
 import logging
 import math
+import os
 import re
 import string
 import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
 
 # pylint disable=unused-variable
 
@@ -32,9 +39,8 @@ def clean_string(
     - Optional to lowercase
 
     This is a naive/slow implementation, useful for sanitising things like
-    a filename or column headers or small datasets. If you need to cleanup
-    large datasets, you need to look into pandas/numpy tools, and vectorised
-    functions.
+    a filename or column headers or small datasets. To cleanup large
+    datasets use clean_string_series(), which returns the same results.
 
 
     Parameters
@@ -112,9 +118,193 @@ def clean_string(
     return r
 
 
-# we enable the caching in this small piece, maxsize can be set to None=unlimited,
-# but we could add a limit , apparently having an actual limit makes it
-# marginally faster in some conditions.
+def clean_string_series(
+    s,
+    keep_dot=False,
+    keep_dash=False,
+    keep_apostrophe=False,
+    keep_ampersand=False,
+    keep_spaces=True,
+    space_to_underscore=True,
+    to_case="lower",
+):
+    """Sanitising a series of strings, vectorised version of clean_string()
+
+    Applies the same rules and returns the same results as clean_string()
+    applied to each value, but it cleans each unique value only once, in a
+    single translation pass, and maps the results back to the rows. Unicode
+    normalisation is only done for the values that are not plain ASCII.
+
+    Parameters
+    ----------
+    s : pandas.Series or list-like
+        Values to clean, None and nan become ""
+    keep_dot, keep_dash, keep_apostrophe, keep_ampersand, keep_spaces,
+    space_to_underscore, to_case :
+        Same as in clean_string()
+
+    Returns
+    -------
+    pandas.Series
+        Cleaned strings, with the same index as the input
+
+    Examples
+    --------
+    >>> clean_string_series(pd.Series(["Café  Déjà-vu", None, "A & B"])).tolist()
+    ['cafe_deja_vu', '', 'a_b']
+
+    """
+    if not isinstance(s, pd.Series):
+        s = pd.Series(s, dtype=object)
+    table = _clean_string_table(
+        keep_dot, keep_dash, keep_apostrophe, keep_ampersand, to_case
+    )
+    if keep_spaces:
+        separator = "_" if space_to_underscore else " "
+    else:
+        separator = ""
+
+    values = s
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) != "string":
+        # factorize would take 1, 1.0 and True as the same value, while
+        # their strings are different, so we convert them first
+        values = s.where(s.isna(), s.astype(str))
+    codes, uniques = pd.factorize(values)
+    cleaned = np.array(
+        [_clean_string_fast(v, table, separator) for v in uniques] + [""],
+        dtype=object,
+    )
+    res = cleaned[codes]
+    # nan and None give "" but other missing values, like NaT, follow
+    # clean_string() and give their string
+    missing = np.flatnonzero(codes == -1)
+    if len(missing):
+        res[missing] = [
+            _clean_string_fast(v, table, separator) for v in s.iloc[missing]
+        ]
+    logger.info("Cleaned %s unique values of %s", len(uniques), len(s))
+    return pd.Series(res, index=s.index, name=s.name)
+
+
+@lru_cache(maxsize=32)
+def _clean_string_table(keep_dot, keep_dash, keep_apostrophe, keep_ampersand, to_case):
+    """Translation table doing in one pass the character rules of clean_string()
+
+    It works on the ASCII string after the unicode normalisation, so it only
+    needs the 128 ASCII characters: letters change case, digits stay, the
+    optional symbols are kept or expanded, and everything else becomes a space.
+    """
+    table = {}
+    for i in range(128):
+        c = chr(i)
+        if c in string.ascii_letters:
+            if to_case == "lower":
+                c = c.lower()
+            elif to_case == "upper":
+                c = c.upper()
+            table[i] = c
+        elif c in string.digits:
+            table[i] = c
+        elif c == ".":
+            table[i] = c if keep_dot else " "
+        elif c == "-":
+            table[i] = c if keep_dash else " "
+        elif c == "'":
+            table[i] = c if keep_apostrophe else " "
+        elif c == "&":
+            if keep_ampersand == "expand":
+                table[i] = "and"
+            else:
+                table[i] = c if keep_ampersand else " "
+        else:
+            table[i] = " "
+    return table
+
+
+def _clean_string_fast(t, table, separator):
+    """Same as clean_string() with a prebuilt translation table
+
+    separator joins the words: "_" or " " to keep spaces, "" to remove them.
+    """
+    if t is None:
+        return ""
+    if isinstance(t, float) and math.isnan(t):
+        return ""
+    try:
+        t = str(t)
+    except (TypeError, ValueError):
+        return ""
+    if not t.isascii():
+        t = unicodedata.normalize("NFKD", t).encode("ascii", errors="ignore").decode()
+    # after the translation only spaces are left as separators, so split()
+    # does the strip and the collapse of multiple spaces in one go
+    return separator.join(t.translate(table).split())
+
+
+def _translit_table():
+    """Letters that the NFKD normalisation doesn't reduce to ASCII
+
+    Latin letters without decomposition plus basic Greek and Cyrillic, which
+    would otherwise be dropped by clean_string(). Accents are separated by
+    NFKD before applying it, so only the base letters are needed.
+    """
+    lower = {
+        # latin
+        "ß": "ss", "æ": "ae", "œ": "oe", "ø": "o", "ł": "l", "đ": "d", "ð": "d",
+        "þ": "th", "ı": "i", "ħ": "h", "ŋ": "ng", "ĸ": "k", "ſ": "s", "ŧ": "t",
+        # greek
+        "α": "a", "β": "v", "γ": "g", "δ": "d", "ε": "e", "ζ": "z", "η": "i",
+        "θ": "th", "ι": "i", "κ": "k", "λ": "l", "μ": "m", "ν": "n", "ξ": "x",
+        "ο": "o", "π": "p", "ρ": "r", "σ": "s", "ς": "s", "τ": "t", "υ": "y",
+        "φ": "f", "χ": "ch", "ψ": "ps", "ω": "o",
+        # cyrillic
+        "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh",
+        "з": "z", "и": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+        "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh",
+        "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "",
+        "э": "e", "ю": "yu", "я": "ya", "і": "i", "є": "ye", "ґ": "g", "ђ": "dj",
+        "ј": "j", "љ": "lj", "њ": "nj", "ћ": "c", "џ": "dz",
+    }  # fmt: skip
+    table = {ord(k): v for k, v in lower.items()}
+    for k, v in lower.items():
+        if k.upper() != k and len(k.upper()) == 1:
+            table[ord(k.upper())] = v.capitalize()
+    return table
+
+
+_TRANSLIT_TABLE = _translit_table()
+
+
+def _transliterate(t):
+    """Transliterates to ASCII the letters of a string where possible"""
+    if not isinstance(t, str) or t.isascii():
+        return t
+    return unicodedata.normalize("NFKD", t).translate(_TRANSLIT_TABLE)
+
+
+def _fuzzy_keys_of(values, token_sort, transliterate=False):
+    """List of fuzzy keys of an array of unique values, see create_fuzzy_key()"""
+    prepared = pd.Series(values)
+    if transliterate:
+        prepared = prepared.map(_transliterate)
+    prepared = (
+        prepared.str.lower()
+        .replace(" (ltd|plc|inc|llp|limited)", " ", regex=True)
+        .replace(r"(mr\.?|mrs\.?|miss\.?) ", " ", regex=True)
+        .replace("o'", "o", regex=True)
+        .replace(" +", " ", regex=True)
+        .str.strip()
+    )
+    table = _clean_string_table(False, False, False, "expand", "lower")
+    keys = [_clean_string_fast(v, table, " ") for v in prepared.tolist()]
+
+    # clean_string leaves just letters, digits and spaces so we only need to
+    # split the words to sort them
+    if token_sort == "token_set_sort":
+        keys = [" ".join(sorted(set(k.split()))) for k in keys]
+    elif token_sort == "token_sort":
+        keys = [" ".join(sorted(k.split())) for k in keys]
+    return keys
 
 
 def create_fuzzy_key(
@@ -122,6 +312,7 @@ def create_fuzzy_key(
     input_col,
     output_col="fuzzy_key",
     token_sort=None,
+    transliterate=False,
 ):
     """
     Create a fuzzy key for a dataframe, note that this key preserves the spaces
@@ -129,6 +320,9 @@ def create_fuzzy_key(
     distance. If you want a more compact string you need to tweak the
     code to set the clean_string function to remove spaces.
 
+    The key is computed once per unique value and mapped back to the rows,
+    so columns with many repeated names (e.g. a supplier master) are fast.
+
 
     Parameters
     ----------
@@ -141,6 +335,10 @@ def create_fuzzy_key(
     token_sort : str, optional
         Whether to use a token sorting algorithm or not and rely on other libraries.
         Can be "token_set_sort", "token_sort" or None
+    transliterate : bool, optional, default False
+        If True, letters without an ASCII decomposition are transliterated
+        (e.g. ß to ss, ø to o, Greek and Cyrillic letters) instead of removed,
+        useful for international names.
 
     Returns
     -------
@@ -153,45 +351,1368 @@ def create_fuzzy_key(
             f"token_sort must be None, token_set_sort or token_sort, got {token_sort}"
         )
 
-    def _token_set_sort(s):
-        s = str(s)
-        s = s.translate(str.maketrans("", "", string.punctuation))
-        sl = list(set(str.split(s)))
-        sl.sort()
-        s = " ".join(sl)
-        return s
+    df = df.copy()
+
+    # we work on the unique values only, nan gets code -1
+    codes, uniques = pd.factorize(df[input_col])
+    keys = _fuzzy_keys_of(uniques, token_sort, transliterate)
+
+    # the extra "" at the end is picked by the -1 codes of the nan values
+    keys = np.array(keys + [""], dtype=object)
+    df[output_col] = keys[codes]
+    return df
+
+
+_SOUNDEX_TABLE = str.maketrans(
+    "abcdefghijklmnopqrstuvwxyz0123456789",
+    "01230120022455012623010202" + "_" * 10,
+    "hw",
+)
+_REPEATED_DIGITS = re.compile(r"(\d)\1+")
+_METAPHONE_DOUBLES = re.compile(r"([abd-z])\1+")
+_VOWELS = frozenset("aeiou")
+
+
+def _soundex_word(w):
+    """American Soundex code of a lowercase word, e.g. robert -> R163"""
+    digits = w.translate(_SOUNDEX_TABLE).replace("_", "")
+    letters = [c for c in w if c.isalpha()]
+    if not letters:
+        return w
+    first = letters[0]
+    # adjacent letters with the same code count once, h and w are removed by
+    # the table so they don't separate them, vowels (0) do
+    digits = _REPEATED_DIGITS.sub(r"\1", digits)
+    if first not in "hw":
+        digits = digits[1:]
+    return (first.upper() + digits.replace("0", "") + "000")[:4]
 
-    def _token_sort(s):
-        s = str(s)
-        s = s.translate(str.maketrans("", "", string.punctuation))
-        sl = str.split(s)
-        sl.sort()
-        s = " ".join(sl)
-        return s
+
+def _metaphone_word(w):
+    """Metaphone code of a lowercase word, after the original rules of
+    Lawrence Philips (1990), e.g. smith -> SM0, knight -> NT
+    """
+    w = "".join(c for c in w if c.isalpha())
+    if not w:
+        return ""
+    w = _METAPHONE_DOUBLES.sub(r"\1", w)
+    if w[:2] in ("kn", "gn", "pn", "ae", "wr"):
+        w = w[1:]
+    if w[0] == "x":
+        w = "s" + w[1:]
+    elif w[:2] == "wh":
+        w = "w" + w[2:]
+    n = len(w)
+    out = []
+    for i, c in enumerate(w):
+        prev = w[i - 1] if i > 0 else ""
+        nxt = w[i + 1] if i + 1 < n else ""
+        nxt2 = w[i + 2] if i + 2 < n else ""
+        if c in _VOWELS:
+            if i == 0:
+                out.append(c)
+        elif c == "b":
+            if not (prev == "m" and i == n - 1):
+                out.append("b")
+        elif c == "c":
+            if nxt == "h" or (nxt == "i" and nxt2 == "a"):
+                out.append("k" if prev == "s" and nxt == "h" else "x")
+            elif nxt in ("i", "e", "y"):
+                if prev != "s":
+                    out.append("s")
+            else:
+                out.append("k")
+        elif c == "d":
+            out.append("j" if nxt == "g" and nxt2 in ("e", "i", "y") else "t")
+        elif c == "g":
+            if nxt == "h" and nxt2 and nxt2 not in _VOWELS:
+                continue
+            if nxt == "n" and (i + 2 == n or w[i + 1 :] == "ned"):
+                continue
+            if prev == "d" and nxt in ("e", "i", "y"):
+                continue
+            out.append("j" if nxt in ("e", "i", "y") else "k")
+        elif c == "h":
+            if prev in ("c", "s", "p", "t", "g"):
+                continue
+            if prev in _VOWELS and nxt not in _VOWELS:
+                continue
+            out.append("h")
+        elif c == "k":
+            if prev != "c":
+                out.append("k")
+        elif c == "p":
+            out.append("f" if nxt == "h" else "p")
+        elif c == "q":
+            out.append("k")
+        elif c == "s":
+            if nxt == "h" or (nxt == "i" and nxt2 in ("o", "a")):
+                out.append("x")
+            else:
+                out.append("s")
+        elif c == "t":
+            if nxt == "i" and nxt2 in ("o", "a"):
+                out.append("x")
+            elif nxt == "h":
+                out.append("0")
+            elif not (nxt == "c" and nxt2 == "h"):
+                out.append("t")
+        elif c == "v":
+            out.append("f")
+        elif c in ("w", "y"):
+            if nxt in _VOWELS:
+                out.append(c)
+        elif c == "x":
+            out.append("ks")
+        elif c == "z":
+            out.append("s")
+        else:
+            out.append(c)
+    return "".join(out).upper()
+
+
+def create_phonetic_key(
+    df,
+    input_col,
+    output_col="phonetic_key",
+    method="soundex",
+    token_sort="token_set_sort",
+    transliterate=True,
+):
+    """
+    Create a phonetic key, to block or match names that sound the same.
+
+    The names are first cleaned as in create_fuzzy_key() and then each word
+    is replaced by its phonetic code, e.g. "Jon Smyth" and "John Smith" both
+    get "J500 S530" with Soundex. These keys are cheap and quite selective,
+    so they work well to block candidates before a more expensive similarity
+    score. Words that are just numbers are kept as they are.
+    The keys are computed once per unique value and each word once, and then
+    mapped back to the rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The dataframe to create the phonetic key for
+    input_col : str
+        The column to create the phonetic key from
+    output_col : str, optional
+        The column to create the phonetic key to, by default "phonetic_key"
+    method : str, optional, default "soundex"
+        "soundex" for the American Soundex (letter + 3 digits) or
+        "metaphone" for the original Metaphone, more precise for English
+    token_sort : str, optional, default "token_set_sort"
+        Sorting of the codes of the words, "token_set_sort", "token_sort" or
+        None to keep them in order.
+    transliterate : bool, optional, default True
+        Transliterate letters without ASCII decomposition, see create_fuzzy_key()
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of the dataframe with the new column
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({"name": ["John Smith", "Jon Smyth", "Smith, John"]})
+    >>> create_phonetic_key(df, "name")["phonetic_key"].tolist()
+    ['J500 S530', 'J500 S530', 'J500 S530']
+
+    """
+    if method not in ["soundex", "metaphone"]:
+        raise ValueError(f"method must be soundex or metaphone, got {method}")
+    if token_sort not in [None, "token_set_sort", "token_sort"]:
+        raise ValueError(
+            f"token_sort must be None, token_set_sort or token_sort, got {token_sort}"
+        )
+    encode = _soundex_word if method == "soundex" else _metaphone_word
 
     df = df.copy()
+    codes, uniques = pd.factorize(df[input_col])
+    words = {}
+    keys = []
+    for key in _fuzzy_keys_of(uniques, None, transliterate):
+        phonetic = []
+        for w in key.split():
+            if w not in words:
+                words[w] = w if w.isdigit() else encode(w)
+            if words[w]:
+                phonetic.append(words[w])
+        if token_sort == "token_set_sort":
+            phonetic = sorted(set(phonetic))
+        elif token_sort == "token_sort":
+            phonetic = sorted(phonetic)
+        keys.append(" ".join(phonetic))
+    logger.info("Encoded %s distinct words of %s unique values", len(words), len(keys))
 
-    # First we are going to deal with the new lines and tabs and empty strings
-    df[output_col] = (
-        df[input_col]
-        .fillna("")
-        .str.lower()
-        .replace(" (ltd|plc|inc|llp|limited)", " ", regex=True)
-        .replace(r"(mr\.?|mrs\.?|miss\.?) ", " ", regex=True)
-        .replace("o'", "o", regex=True)
-        .replace(" +", " ", regex=True)
-        .str.strip()
-        .apply(
-            lambda v: clean_string(
-                v, keep_spaces=True, space_to_underscore=False, keep_ampersand="expand"
+    keys = np.array(keys + [""], dtype=object)
+    df[output_col] = keys[codes]
+    return df
+
+
+def _gram_indices(keys, vocabulary, method, q, frozen=False):
+    """Ids of the distinct q-grams (or tokens) of each key, in CSR layout
+
+    The vocabulary dict is shared between calls so both sides of a merge use
+    the same ids. Keys are padded with a space so short keys still get grams
+    and the start and end of the words weigh more. If frozen, the grams not
+    in the vocabulary get -1 instead of a new id.
+    Returns the arrays (indices, indptr).
+    """
+    indptr = [0]
+    indices = []
+    for k in keys:
+        if method == "token":
+            grams = set(k.split())
+        else:
+            padded = f" {k} "
+            grams = {padded[i : i + q] for i in range(len(padded) - q + 1)}
+        if frozen:
+            indices.extend(vocabulary.get(g, -1) for g in grams)
+        else:
+            indices.extend(vocabulary.setdefault(g, len(vocabulary)) for g in grams)
+        indptr.append(len(indices))
+    return np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)
+
+
+def _gram_matrix(indices, indptr, n_grams):
+    """Sparse binary matrix of keys x grams, ignoring the unknown (-1) grams"""
+    from scipy import sparse as sp  # pylint: disable=import-outside-toplevel
+
+    known = indices >= 0
+    if not known.all():
+        known_before = np.concatenate([[0], np.cumsum(known)])
+        indptr = known_before[indptr]
+        indices = indices[known]
+    matrix = sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, indptr),
+        shape=(len(indptr) - 1, max(n_grams, 1)),
+    )
+    matrix.sort_indices()
+    return matrix
+
+
+def _prefix_matrix(matrix, min_overlap):
+    """Keeps only the prefix of each row needed to find pairs over a threshold
+
+    The columns of matrix must be sorted by rarity, rarest first. Two sets
+    sharing at least o items must share one of their first len - o + 1 items
+    (prefix filtering), so the candidates can be found with the prefixes only.
+    Returns the prefix matrix, the number of items left out of the prefix and
+    the last column in the prefix of each row.
+    """
+    sizes = np.diff(matrix.indptr)
+    prefix = np.clip(sizes - min_overlap + 1, 0, sizes)
+    position = np.arange(matrix.nnz) - np.repeat(matrix.indptr[:-1], sizes)
+    keep = position < np.repeat(prefix, sizes)
+    indptr = np.concatenate([[0], np.cumsum(prefix)])
+    last = np.full(len(sizes), -1, dtype=np.int64)
+    has_prefix = prefix > 0
+    last[has_prefix] = matrix.indices[
+        matrix.indptr[:-1][has_prefix] + prefix[has_prefix] - 1
+    ]
+    prefix_matrix = type(matrix)(
+        (matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape
+    )
+    return prefix_matrix, sizes - prefix, last
+
+
+def _min_overlap(sizes, threshold):
+    """Minimum grams in common to reach the threshold, whatever the other side
+
+    dice >= t implies overlap >= t * size / (2 - t) for both sides
+    """
+    return np.ceil(threshold * sizes / (2 - threshold) - 1e-9).astype(np.int64)
+
+
+def _transposed_prefix(matrix, sizes, threshold):
+    """Prefixes of the right side of _dice_pairs(), transposed for the product"""
+    prefix, rest, last = _prefix_matrix(matrix, _min_overlap(sizes, threshold))
+    return prefix.T.tocsr(), rest, last
+
+
+def _dice_pairs(
+    left, left_sizes, right, right_sizes, threshold, right_prefix=None, chunksize=10000
+):
+    """Finds the pairs of rows of two gram matrices with a Dice over threshold
+
+    The columns of the matrices must be sorted from the rarest to the most
+    common gram. The candidate pairs come from the sparse product of the
+    prefixes only (an inverted index on the rare grams), and they are then
+    scored with all their grams. The sizes are the number of grams of each row,
+    which can be more than the grams in the matrix if some are unknown.
+    right_prefix is the result of _transposed_prefix(), if already computed.
+    Returns three arrays: left position, right position and score.
+    """
+    left_prefix, left_rest, left_last = _prefix_matrix(
+        left, _min_overlap(left_sizes, threshold)
+    )
+    if right_prefix is None:
+        right_prefix = _transposed_prefix(right, right_sizes, threshold)
+    right_prefix_t, right_rest, right_last = right_prefix
+
+    lefts, rights, scores = [], [], []
+    for start in range(0, left.shape[0], chunksize):
+        candidates = (left_prefix[start : start + chunksize] @ right_prefix_t).tocoo()
+        i = candidates.row.astype(np.int64) + start
+        j = candidates.col.astype(np.int64)
+        # The shared grams up to the end of the shorter (in rank) of both
+        # prefixes are all counted in the product, any other shared gram must
+        # be after it, so this is an upper bound of the overlap. It prunes
+        # most candidates before computing the exact overlap.
+        upper = candidates.data + np.where(
+            left_last[i] <= right_last[j], left_rest[i], right_rest[j]
+        )
+        needed = threshold * (left_sizes[i] + right_sizes[j]) / 2 - 1e-9
+        plausible = upper >= needed
+        i = i[plausible]
+        j = j[plausible]
+        overlap = np.asarray(left[i].multiply(right[j]).sum(axis=1)).ravel()
+        score = 2 * overlap / (left_sizes[i] + right_sizes[j])
+        match = score >= threshold - 1e-9
+        lefts.append(i[match])
+        rights.append(j[match])
+        scores.append(score[match])
+    if not lefts:
+        return (np.array([], dtype=np.int64),) * 2 + (np.array([]),)
+    return np.concatenate(lefts), np.concatenate(rights), np.concatenate(scores)
+
+
+def _gram_ranks(indices, n_grams):
+    """New id of each gram, from the rarest (0) to the most common"""
+    frequency = np.bincount(indices, minlength=n_grams)
+    rank = np.empty(n_grams, dtype=np.int64)
+    rank[np.argsort(frequency, kind="stable")] = np.arange(n_grams)
+    return rank
+
+
+def _fuzzy_pairs(left_keys, right_keys, threshold, method, q):
+    """Finds the pairs of keys with a Dice similarity over the threshold
+
+    Returns three arrays: left position, right position and score.
+    """
+    vocabulary = {}
+    left_indices, left_indptr = _gram_indices(left_keys, vocabulary, method, q)
+    right_indices, right_indptr = _gram_indices(right_keys, vocabulary, method, q)
+    n_grams = len(vocabulary)
+    rank = _gram_ranks(np.concatenate([left_indices, right_indices]), n_grams)
+    left = _gram_matrix(rank[left_indices], left_indptr, n_grams)
+    right = _gram_matrix(rank[right_indices], right_indptr, n_grams)
+    return _dice_pairs(
+        left, np.diff(left_indptr), right, np.diff(right_indptr), threshold
+    )
+
+
+def fuzzy_merge(
+    df_left,
+    df_right,
+    left_on,
+    right_on,
+    threshold=0.8,
+    method="qgram",
+    q=3,
+    best_match=False,
+    token_sort="token_set_sort",
+    suffixes=("_left", "_right"),
+):
+    """Merge two dataframes on the similarity of a text column, e.g. names.
+
+    Both columns are converted to fuzzy keys (see create_fuzzy_key()) and the
+    pairs with a similarity over the threshold are matched. Typical use is to
+    match a vendor master against an employee master to look for conflicts
+    of interest.
+    Only plausible pairs are scored: the keys are indexed by their rarest
+    q-grams (or tokens) and only the pairs sharing them are compared, so it
+    avoids comparing all the left rows with all the right rows.
+
+    The similarity is the Dice coefficient of the sets of q-grams (or tokens)
+    of both keys: 2 * shared / (grams left + grams right), from 0 to 1.
+    To use another similarity, run fuzzy_merge() with a lower threshold and
+    score the "_fuzzy_key_left" and "_fuzzy_key_right" columns of the matches
+    with e.g. levenshtein_similarity() or jaro_winkler_similarity().
+
+    Parameters
+    ----------
+    df_left : pandas.DataFrame
+        The left dataframe
+    df_right : pandas.DataFrame
+        The right dataframe
+    left_on : str
+        The column with the text to match in the left dataframe
+    right_on : str
+        The column with the text to match in the right dataframe
+    threshold : float, optional, default 0.8
+        Minimum similarity, greater than 0 and up to 1
+    method : str, optional, default "qgram"
+        "qgram" to compare sets of characters q-grams, more tolerant to typos,
+        or "token" to compare sets of words.
+    q : int, optional, default 3
+        Length of the q-grams for method="qgram"
+    best_match : bool, optional, default False
+        If True, keeps only the best scoring match(es) for each left row
+    token_sort : str, optional, default "token_set_sort"
+        Argument passed to create_fuzzy_key()
+    suffixes : tuple, optional, default ("_left", "_right")
+        Suffixes for the columns present in both dataframes
+
+    Returns
+    -------
+    tuple
+        A tuple of dataframes, (both, left, right, left_na, right_na),
+        as per merge_outer_and_split():
+        both : the pairs of rows matched, with the columns of both
+        dataframes plus "_fuzzy_key_left", "_fuzzy_key_right" and "_score"
+        left : the rows of the left dataframe without a match
+        right : the rows of the right dataframe without a match
+        left_na : the rows with a null or empty key in the left dataframe
+        right_na : the rows with a null or empty key in the right dataframe
+
+    """
+    if not isinstance(df_left, pd.DataFrame) or not isinstance(df_right, pd.DataFrame):
+        raise TypeError("df_left and df_right must be pandas DataFrames")
+    if left_on not in df_left.columns:
+        raise ValueError(f"column {left_on} not in left dataframe")
+    if right_on not in df_right.columns:
+        raise ValueError(f"column {right_on} not in right dataframe")
+    if not 0 < threshold <= 1:
+        raise ValueError("threshold must be greater than 0 and up to 1")
+    if method not in ["qgram", "token"]:
+        raise ValueError(f"method must be qgram or token, got {method}")
+    if not isinstance(q, int) or q < 1:
+        raise ValueError("q must be a positive integer")
+
+    left_keys = create_fuzzy_key(
+        df_left[[left_on]], left_on, "_key", token_sort=token_sort
+    )["_key"].to_numpy()
+    right_keys = create_fuzzy_key(
+        df_right[[right_on]], right_on, "_key", token_sort=token_sort
+    )["_key"].to_numpy()
+    left_valid = left_keys != ""
+    right_valid = right_keys != ""
+    logger.info(
+        "Detected %s null or empty keys in the left dataframe", (~left_valid).sum()
+    )
+    logger.info(
+        "Detected %s null or empty keys in the right dataframe", (~right_valid).sum()
+    )
+
+    # we match the unique keys and then expand to the rows
+    left_codes, left_uniques = pd.factorize(left_keys[left_valid])
+    right_codes, right_uniques = pd.factorize(right_keys[right_valid])
+    i, j, score = _fuzzy_pairs(
+        list(left_uniques), list(right_uniques), threshold, method, q
+    )
+    pairs = pd.DataFrame({"_lcode": i, "_rcode": j, "_score": score})
+    if best_match and len(pairs):
+        best = pairs.groupby("_lcode")["_score"].transform("max")
+        pairs = pairs[pairs["_score"] >= best]
+    logger.info("Found %s matching pairs of unique keys", len(pairs))
+
+    left_rows = pd.DataFrame(
+        {"_lcode": left_codes, "_lrow": np.flatnonzero(left_valid)}
+    )
+    right_rows = pd.DataFrame(
+        {"_rcode": right_codes, "_rrow": np.flatnonzero(right_valid)}
+    )
+    matched = pairs.merge(left_rows, on="_lcode").merge(right_rows, on="_rcode")
+    matched = matched.sort_values(["_lrow", "_rrow"], ignore_index=True)
+    lrow = matched["_lrow"].to_numpy()
+    rrow = matched["_rrow"].to_numpy()
+
+    dfboth = (
+        df_left.iloc[lrow]
+        .reset_index(drop=True)
+        .join(
+            df_right.iloc[rrow].reset_index(drop=True),
+            lsuffix=suffixes[0],
+            rsuffix=suffixes[1],
+        )
+    )
+    dfboth["_fuzzy_key_left"] = left_keys[lrow]
+    dfboth["_fuzzy_key_right"] = right_keys[rrow]
+    dfboth["_score"] = matched["_score"].to_numpy()
+
+    left_matched = np.zeros(len(df_left), dtype=bool)
+    left_matched[lrow] = True
+    right_matched = np.zeros(len(df_right), dtype=bool)
+    right_matched[rrow] = True
+    dfleft = df_left[left_valid & ~left_matched]
+    dfright = df_right[right_valid & ~right_matched]
+    logger.info(
+        "Matched %s left rows and %s right rows",
+        left_matched.sum(),
+        right_matched.sum(),
+    )
+    return dfboth, dfleft, dfright, df_left[~left_valid], df_right[~right_valid]
+
+
+def _as_strings(values):
+    """List of str from a string or an iterable, with nan and None as ''"""
+    if isinstance(values, str):
+        return [values]
+    return [v if isinstance(v, str) else ("" if pd.isna(v) else str(v)) for v in values]
+
+
+def _align_strings(a, b):
+    """Aligns the inputs of the scorers, a single string is compared to all"""
+    a_list = _as_strings(a)
+    b_list = _as_strings(b)
+    if isinstance(a, str) and not isinstance(b, str):
+        a_list = a_list * len(b_list)
+    elif isinstance(b, str) and not isinstance(a, str):
+        b_list = b_list * len(a_list)
+    if len(a_list) != len(b_list):
+        raise ValueError("a and b must have the same length or be a single string")
+    return a_list, b_list
+
+
+def _encode_strings(strings):
+    """Unicode code points of the strings as a zero padded uint32 matrix"""
+    arr = np.array(strings, dtype=str)
+    if arr.dtype.itemsize == 0:
+        arr = arr.astype("<U1")
+    return arr.view(np.uint32).reshape(len(arr), arr.dtype.itemsize // 4)
+
+
+def _levenshtein_scalar(p, t):
+    """Levenshtein distance with Myers' bit-parallel algorithm on python ints"""
+    if not p:
+        return len(t)
+    peq = {}
+    for i, ch in enumerate(p):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask = (1 << len(p)) - 1
+    top = 1 << (len(p) - 1)
+    pv, mv, score = mask, 0, len(p)
+    for ch in t:
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & top:
+            score += 1
+        elif mh & top:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+
+def _lcs_scalar(p, t):
+    """Length of the longest common subsequence, bit-parallel on python ints"""
+    peq = {}
+    for i, ch in enumerate(p):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask = (1 << len(p)) - 1
+    v = mask
+    for ch in t:
+        u = v & peq.get(ch, 0)
+        v = ((v + u) | (v - u)) & mask
+    return (~v & mask).bit_count()
+
+
+def _pattern_masks(pat, plen):
+    """Bit of each pattern position, and the mask and top bit of each pattern"""
+    one = np.uint64(1)
+    bits = one << np.arange(pat.shape[1], dtype=np.uint64)
+    mask = np.where(
+        plen >= 64,
+        np.uint64(0xFFFFFFFFFFFFFFFF),
+        (one << np.minimum(plen, 63).astype(np.uint64)) - one,
+    )
+    top = one << np.maximum(plen - 1, 0).astype(np.uint64)
+    return bits, mask, top
+
+
+def _levenshtein_kernel(pat, plen, txt, tlen, max_dist):
+    """Myers' bit-parallel Levenshtein distance vectorised over pairs of strings
+
+    Each pattern fits in a uint64 (up to 64 characters) and the algorithm
+    advances one character of all the texts at a time. The pairs that can't
+    end up within max_dist are dropped as soon as we know, and get
+    max_dist + 1 as distance.
+    """
+    one = np.uint64(1)
+    res = np.maximum(tlen, plen).astype(np.int64)
+    # the distance is at least the difference in lengths
+    hopeless = tlen - plen > max_dist
+    res[hopeless] = max_dist[hopeless] + 1
+    idx = np.flatnonzero(~hopeless & (tlen > 0))
+    bits, mask, top = _pattern_masks(pat, plen)
+    pat, txt, tlen, max_dist = pat[idx], txt[idx], tlen[idx], max_dist[idx]
+    mask, top = mask[idx], top[idx]
+    pv = mask.copy()
+    mv = np.zeros(len(idx), dtype=np.uint64)
+    score = plen[idx].astype(np.int64)
+    k = 0
+    while len(idx):
+        c = txt[:, k]
+        eq = np.where(pat == c[:, None], bits, np.uint64(0)).sum(
+            axis=1, dtype=np.uint64
+        )
+        eq &= mask
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        score += ((ph & top) != 0).astype(np.int64) - ((mh & top) != 0)
+        ph = (ph << one) | one
+        mh = mh << one
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+        k += 1
+        finished = tlen <= k
+        # each remaining character can reduce the distance by one at most
+        hopeless = score - (tlen - k) > max_dist
+        retire = finished | hopeless
+        if retire.any():
+            res[idx[finished]] = score[finished]
+            hopeless &= ~finished
+            res[idx[hopeless]] = max_dist[hopeless] + 1
+            keep = ~retire
+            idx, pat, txt, tlen, max_dist = (
+                idx[keep],
+                pat[keep],
+                txt[keep],
+                tlen[keep],
+                max_dist[keep],
             )
+            mask, top, pv, mv, score = (
+                mask[keep],
+                top[keep],
+                pv[keep],
+                mv[keep],
+                score[keep],
+            )
+    return res
+
+
+def _lcs_kernel(pat, plen, txt, tlen, min_lcs):
+    """Bit-parallel longest common subsequence vectorised over pairs of strings
+
+    Same approach as _levenshtein_kernel(), pairs that can't reach min_lcs
+    are dropped early and get 0.
+    """
+    res = np.zeros(len(plen), dtype=np.int64)
+    idx = np.flatnonzero((plen >= min_lcs) & (plen > 0) & (tlen > 0))
+    bits, mask, _ = _pattern_masks(pat, plen)
+    pat, txt, tlen, min_lcs, plen = (
+        pat[idx],
+        txt[idx],
+        tlen[idx],
+        min_lcs[idx],
+        plen[idx],
+    )
+    v = mask[idx]
+    mask = mask[idx]
+    k = 0
+    while len(idx):
+        c = txt[:, k]
+        eq = np.where(pat == c[:, None], bits, np.uint64(0)).sum(
+            axis=1, dtype=np.uint64
         )
+        u = v & eq
+        v = ((v + u) | (v - u)) & mask
+        k += 1
+        lcs = np.bitwise_count(~v & mask).astype(np.int64)
+        finished = tlen <= k
+        # each remaining character can add one to the subsequence at most
+        hopeless = np.minimum(lcs + (tlen - k), plen) < min_lcs
+        retire = finished | hopeless
+        if retire.any():
+            res[idx[finished]] = lcs[finished]
+            keep = ~retire
+            idx, pat, txt, tlen, min_lcs, plen, v, mask = (
+                idx[keep],
+                pat[keep],
+                txt[keep],
+                tlen[keep],
+                min_lcs[keep],
+                plen[keep],
+                v[keep],
+                mask[keep],
+            )
+    return res
+
+
+def _run_bit_parallel(a_list, b_list, kernel, scalar, bound, chunksize=10000):
+    """Runs a bit-parallel kernel on all the pairs, the shorter string being
+    the pattern. Pairs are sorted by length and processed in chunks to keep
+    the padded matrices small, and patterns over 64 characters go through the
+    scalar version with python ints.
+    """
+    n = len(a_list)
+    a_len = np.fromiter(map(len, a_list), dtype=np.int64, count=n)
+    b_len = np.fromiter(map(len, b_list), dtype=np.int64, count=n)
+    swap = a_len > b_len
+    plen = np.minimum(a_len, b_len)
+    tlen = np.maximum(a_len, b_len)
+    res = np.zeros(n, dtype=np.int64)
+    for i in np.flatnonzero(plen > 64):
+        if swap[i]:
+            res[i] = scalar(b_list[i], a_list[i])
+        else:
+            res[i] = scalar(a_list[i], b_list[i])
+    rows = np.flatnonzero(plen <= 64)
+    rows = rows[np.argsort(tlen[rows], kind="stable")]
+    for start in range(0, len(rows), chunksize):
+        chunk = rows[start : start + chunksize]
+        pat = _encode_strings([b_list[i] if swap[i] else a_list[i] for i in chunk])
+        txt = _encode_strings([a_list[i] if swap[i] else b_list[i] for i in chunk])
+        res[chunk] = kernel(pat, plen[chunk], txt, tlen[chunk], bound[chunk])
+    return res
+
+
+def _apply_threshold(scores, threshold):
+    """Sets to 0 the scores under the threshold"""
+    if threshold is not None:
+        scores[scores < threshold - 1e-9] = 0.0
+    return scores
+
+
+def levenshtein_similarity(a, b, threshold=None):
+    """Normalised Levenshtein similarity of pairs of strings.
+
+    1 - edit distance / length of the longest string, so 1 for identical
+    strings and 0 for completely different ones.
+    Computed with Myers' bit-parallel algorithm, vectorised over all pairs.
+
+    Parameters
+    ----------
+    a : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with b, or a single string (a query)
+        to compare with all the strings in b. Nan and None count as "".
+    b : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with a, or a single string.
+    threshold : float, optional, default None
+        If provided, scores under it are returned as 0. Pairs stop being
+        computed as soon as they can't reach it, which is much faster.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of floats from 0 to 1, one per pair
+
+    Examples
+    --------
+    >>> levenshtein_similarity("kitten", ["sitting", "kitten"])
+    array([0.57142857, 1.        ])
+
+    """
+    a_list, b_list = _align_strings(a, b)
+    longest = np.fromiter(
+        (max(len(x), len(y)) for x, y in zip(a_list, b_list)),
+        dtype=np.int64,
+        count=len(a_list),
     )
+    if threshold is None:
+        max_dist = longest
+    else:
+        max_dist = np.floor((1 - threshold) * longest + 1e-9).astype(np.int64)
+    dist = _run_bit_parallel(
+        a_list, b_list, _levenshtein_kernel, _levenshtein_scalar, max_dist
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.where(longest > 0, 1 - dist / longest, 1.0)
+    return _apply_threshold(scores, threshold)
 
-    if token_sort == "token_set_sort":
-        df[output_col] = df[output_col].apply(_token_set_sort)
 
-    if token_sort == "token_sort":
-        df[output_col] = df[output_col].apply(_token_sort)
+def _jaro_winkler_chunk(a, a_len, b, b_len, prefix_weight):
+    """Jaro-Winkler of a chunk of pairs as padded code point matrices
 
-    return df
+    The matching of characters goes one position of a at a time for all the
+    pairs, taking the first unused character of b within the window.
+    """
+    window = np.maximum(np.maximum(a_len, b_len) // 2 - 1, 0)
+    b_pos = np.arange(b.shape[1])
+    in_window_b = b_pos[None, :] < b_len[:, None]
+    b_used = np.zeros(b.shape, dtype=bool)
+    a_used = np.zeros(a.shape, dtype=bool)
+    rows = np.arange(len(a_len))
+    for i in range(a.shape[1]):
+        candidates = (
+            (b == a[:, i, None])
+            & ~b_used
+            & in_window_b
+            & (np.abs(b_pos[None, :] - i) <= window[:, None])
+            & (i < a_len)[:, None]
+        )
+        found = candidates.any(axis=1)
+        first = candidates.argmax(axis=1)
+        b_used[rows[found], first[found]] = True
+        a_used[found, i] = True
+    matches = a_used.sum(axis=1)
+    # the matched characters in order on both sides, to count transpositions
+    width = min(a.shape[1], b.shape[1])
+    a_matched = np.take_along_axis(a, np.argsort(~a_used, axis=1, kind="stable"), 1)
+    b_matched = np.take_along_axis(b, np.argsort(~b_used, axis=1, kind="stable"), 1)
+    transpositions = (
+        (a_matched[:, :width] != b_matched[:, :width])
+        & (np.arange(width)[None, :] < matches[:, None])
+    ).sum(axis=1) // 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        jaro = np.where(
+            matches > 0,
+            (matches / a_len + matches / b_len + (matches - transpositions) / matches)
+            / 3,
+            0.0,
+        )
+    n_prefix = min(4, width)
+    same = (a[:, :n_prefix] == b[:, :n_prefix]) & (
+        np.arange(n_prefix)[None, :] < np.minimum(a_len, b_len)[:, None]
+    )
+    prefix = np.cumprod(same, axis=1).sum(axis=1)
+    return np.where(jaro > 0.7, jaro + prefix * prefix_weight * (1 - jaro), jaro)
+
+
+def jaro_winkler_similarity(a, b, threshold=None, prefix_weight=0.1, chunksize=10000):
+    """Jaro-Winkler similarity of pairs of strings.
+
+    Favours strings with a common prefix (up to 4 characters), which works
+    well for short strings like names. The prefix boost applies when the
+    Jaro similarity is over 0.7. Vectorised over all the pairs.
+
+    Parameters
+    ----------
+    a : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with b, or a single string (a query)
+        to compare with all the strings in b. Nan and None count as "".
+    b : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with a, or a single string.
+    threshold : float, optional, default None
+        If provided, scores under it are returned as 0, and pairs that can't
+        reach it given their lengths are not computed.
+    prefix_weight : float, optional, default 0.1
+        Weight of the common prefix, up to 0.25
+    chunksize : int, optional, default 10000
+        Number of pairs computed at a time
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of floats from 0 to 1, one per pair
+
+    Examples
+    --------
+    >>> jaro_winkler_similarity("martha", "marhta")
+    array([0.96111111])
+
+    """
+    if not 0 <= prefix_weight <= 0.25:
+        raise ValueError("prefix_weight must be between 0 and 0.25")
+    a_list, b_list = _align_strings(a, b)
+    n = len(a_list)
+    a_len = np.fromiter(map(len, a_list), dtype=np.int64, count=n)
+    b_len = np.fromiter(map(len, b_list), dtype=np.int64, count=n)
+    scores = np.where((a_len == 0) & (b_len == 0), 1.0, 0.0)
+    todo = (a_len > 0) & (b_len > 0)
+    if threshold is not None:
+        # best case: all the characters of the shorter string match in order
+        shorter = np.minimum(a_len, b_len)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            best = (shorter / a_len + shorter / b_len + 1) / 3
+        best = np.where(best > 0.7, best + 4 * prefix_weight * (1 - best), best)
+        todo &= best >= threshold - 1e-9
+    rows = np.flatnonzero(todo)
+    rows = rows[np.argsort(np.maximum(a_len, b_len)[rows], kind="stable")]
+    for start in range(0, len(rows), chunksize):
+        chunk = rows[start : start + chunksize]
+        scores[chunk] = _jaro_winkler_chunk(
+            _encode_strings([a_list[i] for i in chunk]),
+            a_len[chunk],
+            _encode_strings([b_list[i] for i in chunk]),
+            b_len[chunk],
+            prefix_weight,
+        )
+    return _apply_threshold(scores, threshold)
+
+
+def token_set_ratio(a, b, threshold=None):
+    """Token set ratio of pairs of strings, from 0 to 1.
+
+    Compares the words in common and the words that differ, ignoring the
+    order and the repetitions, like the token_set_ratio of fuzzywuzzy and
+    rapidfuzz. 1 when all the words of one string are in the other.
+    The similarity of the words that differ is the normalised InDel
+    similarity (from the longest common subsequence), computed bit-parallel
+    and vectorised over all the pairs.
+
+    Parameters
+    ----------
+    a : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with b, or a single string (a query)
+        to compare with all the strings in b. Nan and None count as "".
+    b : str, list, numpy.ndarray or pandas.Series
+        Strings to compare, aligned with a, or a single string.
+    threshold : float, optional, default None
+        If provided, scores under it are returned as 0. Pairs stop being
+        computed as soon as they can't reach it.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of floats from 0 to 1, one per pair
+
+    Examples
+    --------
+    >>> token_set_ratio("smith john", ["john a smith", "john brown"])
+    array([1.        , 0.57142857])
+
+    """
+    a_list, b_list = _align_strings(a, b)
+    n = len(a_list)
+    diff_ab = []
+    diff_ba = []
+    sect_len = np.zeros(n, dtype=np.int64)
+    fixed = np.full(n, np.nan)
+    for i, (x, y) in enumerate(zip(a_list, b_list)):
+        tokens_a = set(x.split())
+        tokens_b = set(y.split())
+        common = tokens_a & tokens_b
+        only_a = sorted(tokens_a - tokens_b)
+        only_b = sorted(tokens_b - tokens_a)
+        if not tokens_a or not tokens_b:
+            fixed[i] = 0.0
+        elif common and (not only_a or not only_b):
+            fixed[i] = 1.0
+        if common:
+            sect_len[i] = sum(map(len, common)) + len(common) - 1
+        diff_ab.append(" ".join(only_a))
+        diff_ba.append(" ".join(only_b))
+    ab_len = np.fromiter(map(len, diff_ab), dtype=np.int64, count=n)
+    ba_len = np.fromiter(map(len, diff_ba), dtype=np.int64, count=n)
+    # "common words + the different words" of both sides
+    sect_ab_len = sect_len + (sect_len > 0) + ab_len
+    sect_ba_len = sect_len + (sect_len > 0) + ba_len
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # the common words vs each full side, one is a prefix of the other
+        sect_scores = np.where(
+            sect_len > 0,
+            np.maximum(
+                1 - (ab_len + 1) / (sect_len + sect_ab_len),
+                1 - (ba_len + 1) / (sect_len + sect_ba_len),
+            ),
+            0.0,
+        )
+    total = sect_ab_len + sect_ba_len
+    if threshold is None:
+        min_lcs = np.zeros(n, dtype=np.int64)
+    else:
+        # lcs needed for the full sides to reach the threshold
+        min_lcs = np.ceil((ab_len + ba_len - (1 - threshold) * total) / 2 - 1e-9)
+        min_lcs = np.where(sect_scores >= threshold, 0, min_lcs).astype(np.int64)
+    min_lcs[~np.isnan(fixed)] = np.iinfo(np.int64).max
+    lcs = _run_bit_parallel(diff_ab, diff_ba, _lcs_kernel, _lcs_scalar, min_lcs)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        full_scores = 1 - (ab_len + ba_len - 2 * lcs) / total
+    scores = np.where(np.isnan(fixed), np.maximum(full_scores, sect_scores), fixed)
+    return _apply_threshold(scores, threshold)
+
+
+def _strings_to_arrays(strings):
+    """Concatenated utf-8 bytes and offsets, to keep strings in .npy files"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _strings_from_arrays(blob, offsets, positions):
+    """The strings at the positions, from the arrays of _strings_to_arrays()"""
+    return [bytes(blob[offsets[i] : offsets[i + 1]]).decode("utf-8") for i in positions]
+
+
+def _string_hashes(strings):
+    """64 bit hash of each string, stable between sessions unlike hash()"""
+    return np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest())
+            for s in strings
+        ),
+        dtype=np.uint64,
+        count=len(strings),
+    )
+
+
+def _append_strings(blob, offsets, strings):
+    """Appends strings to the arrays of _strings_to_arrays()"""
+    new_blob, new_offsets = _strings_to_arrays(strings)
+    return (
+        np.concatenate([blob, new_blob]),
+        np.concatenate([offsets, new_offsets[1:] + offsets[-1]]),
+    )
+
+
+class FuzzyIndex:
+    """Index of the fuzzy keys of a column, to match new names against it.
+
+    Builds the fuzzy keys (see create_fuzzy_key()) and an inverted index of
+    their q-grams (or tokens) once, so new names can be matched against a
+    large master file (e.g. the vendor master) without recomputing its keys.
+    The index can be saved to a folder and loaded back memory-mapped, and new
+    rows can be added to it as they come.
+    The scores are the same Dice similarity used in fuzzy_merge().
+
+    Parameters
+    ----------
+    data : DataFrame or Series, optional
+        The data to index, it can be None to start with an empty index
+    column : str, optional
+        The column with the names, needed if data is a DataFrame
+    method : str, optional, default "qgram"
+        "qgram" to compare sets of characters q-grams, or "token" for words.
+    q : int, optional, default 3
+        Length of the q-grams for method="qgram"
+    token_sort : str, optional, default "token_set_sort"
+        Argument passed to create_fuzzy_key()
+
+    Examples
+    --------
+    >>> index = FuzzyIndex(pd.DataFrame({"name": ["Acme Ltd", "John Smith"]}), "name")
+    >>> index.query("Smith, John")["match_value"].tolist()
+    ['John Smith']
+
+    """
+
+    _META_FILE = "fuzzy_index.json"
+
+    def __init__(
+        self, data=None, column=None, method="qgram", q=3, token_sort="token_set_sort"
+    ):
+        if method not in ["qgram", "token"]:
+            raise ValueError(f"method must be qgram or token, got {method}")
+        if not isinstance(q, int) or q < 1:
+            raise ValueError("q must be a positive integer")
+        self.column = column
+        self.method = method
+        self.q = q
+        self.token_sort = token_sort
+        self._vocabulary = {}
+        blob, offsets = _strings_to_arrays([])
+        self._arrays = {
+            "key_indptr": np.zeros(1, dtype=np.int64),
+            "key_indices": np.zeros(0, dtype=np.int64),
+            "key_blob": blob,
+            "key_offsets": offsets,
+            "key_hashes": np.zeros(0, dtype=np.uint64),
+            "row_keys": np.zeros(0, dtype=np.int64),
+            "row_labels": np.zeros(0, dtype=np.int64),
+            "value_blob": blob,
+            "value_offsets": offsets,
+        }
+        self._labels_as_strings = False
+        self._clear_cache()
+        if data is not None:
+            self.add(data)
+
+    def __len__(self):
+        return len(self._arrays["row_keys"])
+
+    @property
+    def n_keys(self):
+        """Number of distinct fuzzy keys in the index"""
+        return len(self._arrays["key_indptr"]) - 1
+
+    def _clear_cache(self):
+        self._matrix = None
+        self._prefixes = {}
+        self._key_rows = None
+
+    def _names(self, data):
+        """The series of names to index from a DataFrame or Series"""
+        if isinstance(data, pd.DataFrame):
+            if self.column not in data.columns:
+                raise ValueError(f"column {self.column} not in dataframe")
+            return data[self.column]
+        if isinstance(data, pd.Series):
+            return data
+        raise TypeError("data must be a pandas DataFrame or Series")
+
+    def _fuzzy_keys(self, values):
+        """Fuzzy keys of a list or array of names"""
+        df = pd.DataFrame({"name": pd.Series(values, dtype=object)})
+        return create_fuzzy_key(df, "name", "key", token_sort=self.token_sort)[
+            "key"
+        ].to_numpy()
+
+    def add(self, new_rows):
+        """Adds rows to the index, only the new keys are processed.
+
+        Parameters
+        ----------
+        new_rows : DataFrame or Series
+            The rows to add, with the same column as the index if DataFrame.
+            Their index labels are returned by query() as "match_index".
+
+        Returns
+        -------
+        FuzzyIndex
+            The index itself, to allow chaining
+
+        """
+        names = self._names(new_rows)
+        keys = self._fuzzy_keys(names.to_numpy())
+        valid = keys != ""
+        if (~valid).sum() > 0:
+            logger.info("Skipping %s rows with null or empty keys", (~valid).sum())
+        codes, uniques = pd.factorize(keys[valid])
+
+        # the keys already in the index are found by their hash, and only
+        # those are read back to confirm they are the same
+        hashes = _string_hashes(list(uniques))
+        stored_hashes = np.asarray(self._arrays["key_hashes"])
+        order = np.argsort(stored_hashes, kind="stable")
+        pos = np.searchsorted(stored_hashes[order], hashes)
+        key_ids = np.full(len(uniques), -1, dtype=np.int64)
+        found = pos < len(order)
+        found[found] = stored_hashes[order[pos[found]]] == hashes[found]
+        candidates = order[pos[found]]
+        stored = _strings_from_arrays(
+            self._arrays["key_blob"], self._arrays["key_offsets"], candidates
+        )
+        same = np.array(stored, dtype=object) == uniques[found]
+        key_ids[np.flatnonzero(found)[same]] = candidates[same]
+        is_new = key_ids < 0
+        key_ids[is_new] = self.n_keys + np.arange(is_new.sum())
+        new_keys = list(uniques[is_new])
+
+        first_build = not self._vocabulary
+        indices, indptr = _gram_indices(new_keys, self._vocabulary, self.method, self.q)
+        if first_build:
+            # the ids of the grams go from the rarest to the most common,
+            # grams added later get new ids at the end, which is still valid
+            rank = _gram_ranks(indices, len(self._vocabulary))
+            self._vocabulary = {g: int(rank[i]) for g, i in self._vocabulary.items()}
+            indices = rank[indices]
+        matrix = _gram_matrix(indices, indptr, len(self._vocabulary))
+
+        arrays = self._arrays
+        arrays["key_indices"] = np.concatenate(
+            [arrays["key_indices"], matrix.indices.astype(np.int64)]
+        )
+        arrays["key_indptr"] = np.concatenate(
+            [arrays["key_indptr"], matrix.indptr[1:] + arrays["key_indptr"][-1]]
+        )
+        arrays["key_blob"], arrays["key_offsets"] = _append_strings(
+            arrays["key_blob"], arrays["key_offsets"], new_keys
+        )
+        arrays["key_hashes"] = np.concatenate([arrays["key_hashes"], hashes[is_new]])
+        arrays["row_keys"] = np.concatenate([arrays["row_keys"], key_ids[codes]])
+        labels = names.index[valid]
+        if self._labels_as_strings or labels.dtype.kind not in "biufmM":
+            if not self._labels_as_strings:
+                self._labels_as_strings = True
+                arrays["label_blob"], arrays["label_offsets"] = _strings_to_arrays(
+                    [str(v) for v in arrays["row_labels"]]
+                )
+                arrays["row_labels"] = np.zeros(0, dtype=np.int64)
+            arrays["label_blob"], arrays["label_offsets"] = _append_strings(
+                arrays["label_blob"], arrays["label_offsets"], [str(v) for v in labels]
+            )
+        else:
+            if len(arrays["row_labels"]):
+                arrays["row_labels"] = np.concatenate(
+                    [arrays["row_labels"], labels.to_numpy()]
+                )
+            else:
+                arrays["row_labels"] = labels.to_numpy()
+        arrays["value_blob"], arrays["value_offsets"] = _append_strings(
+            arrays["value_blob"],
+            arrays["value_offsets"],
+            [str(v) for v in names.to_numpy()[valid]],
+        )
+        self._clear_cache()
+        logger.info(
+            "Indexed %s rows with %s new keys, %s keys in total",
+            valid.sum(),
+            len(new_keys),
+            self.n_keys,
+        )
+        return self
+
+    def _labels_at(self, rows):
+        """Index labels of the rows"""
+        if self._labels_as_strings:
+            return _strings_from_arrays(
+                self._arrays["label_blob"], self._arrays["label_offsets"], rows
+            )
+        return np.asarray(self._arrays["row_labels"])[rows]
+
+    def query(self, names, top_k=5, min_score=0.8):
+        """Finds the best matches of each name in the index.
+
+        Parameters
+        ----------
+        names : str, list or Series
+            The name(s) to look for
+        top_k : int, optional, default 5
+            Maximum number of matches returned per name
+        min_score : float, optional, default 0.8
+            Minimum similarity, greater than 0 and up to 1
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per match, with "query_id" (position of the name in
+            names), "query", "query_key", "match_index" (index label of the
+            matched row), "match_value", "match_key", "score" and "rank",
+            sorted by query_id and rank. Names without a match are not
+            included.
+
+        """
+        from scipy import sparse as sp  # pylint: disable=import-outside-toplevel
+
+        if not isinstance(top_k, int) or top_k < 1:
+            raise ValueError("top_k must be a positive integer")
+        if not 0 < min_score <= 1:
+            raise ValueError("min_score must be greater than 0 and up to 1")
+        names = [names] if isinstance(names, str) else list(names)
+        keys = self._fuzzy_keys(names)
+        indices, indptr = _gram_indices(
+            keys, self._vocabulary, self.method, self.q, frozen=True
+        )
+        n_grams = max(len(self._vocabulary), 1)
+        query_matrix = _gram_matrix(indices, indptr, n_grams)
+
+        key_indptr = np.asarray(self._arrays["key_indptr"])
+        key_sizes = np.diff(key_indptr)
+        if self._matrix is None:
+            self._matrix = sp.csr_matrix(
+                (
+                    np.ones(len(self._arrays["key_indices"]), dtype=np.float32),
+                    np.asarray(self._arrays["key_indices"]),
+                    key_indptr,
+                ),
+                shape=(self.n_keys, n_grams),
+            )
+            self._matrix.has_sorted_indices = True
+        if min_score not in self._prefixes:
+            self._prefixes[min_score] = _transposed_prefix(
+                self._matrix, key_sizes, min_score
+            )
+        qi, kj, score = _dice_pairs(
+            query_matrix,
+            np.diff(indptr),
+            self._matrix,
+            key_sizes,
+            min_score,
+            right_prefix=self._prefixes[min_score],
+        )
+        pairs = pd.DataFrame({"query_id": qi, "key_id": kj, "score": score})
+        pairs = pairs.sort_values(
+            ["query_id", "score", "key_id"], ascending=[True, False, True]
+        )
+        pairs = pairs.groupby("query_id").head(top_k)
+
+        # from the keys to the rows with that key
+        if self._key_rows is None:
+            row_keys = np.asarray(self._arrays["row_keys"])
+            counts = np.bincount(row_keys, minlength=self.n_keys)
+            self._key_rows = (
+                np.concatenate([[0], np.cumsum(counts)]),
+                np.argsort(row_keys, kind="stable"),
+            )
+        rows_indptr, rows_by_key = self._key_rows
+        key_id = pairs["key_id"].to_numpy()
+        counts = rows_indptr[key_id + 1] - rows_indptr[key_id]
+        repeat = np.repeat(np.arange(len(pairs)), counts)
+        offsets = np.arange(len(repeat)) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = rows_by_key[rows_indptr[key_id][repeat] + offsets]
+        res = pairs.iloc[repeat].reset_index(drop=True)
+        res["rank"] = res.groupby("query_id").cumcount() + 1
+        keep = (res["rank"] <= top_k).to_numpy()
+        res = res[keep].reset_index(drop=True)
+        rows = rows[keep]
+
+        query_id = res["query_id"].to_numpy()
+        return pd.DataFrame(
+            {
+                "query_id": query_id,
+                "query": [names[i] for i in query_id],
+                "query_key": keys[query_id],
+                "match_index": self._labels_at(rows),
+                "match_value": _strings_from_arrays(
+                    self._arrays["value_blob"], self._arrays["value_offsets"], rows
+                ),
+                "match_key": _strings_from_arrays(
+                    self._arrays["key_blob"],
+                    self._arrays["key_offsets"],
+                    res["key_id"].to_numpy(),
+                ),
+                "score": res["score"].to_numpy(),
+                "rank": res["rank"].to_numpy(),
+            }
+        )
+
+    def save(self, path):
+        """Saves the index to a folder, as .npy files plus a json file.
+
+        Parameters
+        ----------
+        path : str
+            The folder, it is created if it doesn't exist
+        """
+        os.makedirs(path, exist_ok=True)
+        # the arrays of a loaded index can be memory-mapped from these same
+        # files, so we write new files and swap them in, the mapped ones
+        # stay readable until they are released
+        for name, arr in self._arrays.items():
+            target = os.path.join(path, f"{name}.npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, arr, allow_pickle=False)
+            os.replace(target + ".tmp", target)
+        meta = {
+            "column": self.column,
+            "method": self.method,
+            "q": self.q,
+            "token_sort": self.token_sort,
+            "labels_as_strings": self._labels_as_strings,
+            "grams": sorted(self._vocabulary, key=self._vocabulary.get),
+        }
+        target = os.path.join(path, self._META_FILE)
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(target + ".tmp", target)
+        logger.info("Saved fuzzy index with %s rows to %s", len(self), path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads an index saved with save().
+
+        Parameters
+        ----------
+        path : str
+            The folder with the index
+        mmap : bool, optional, default True
+            If True the arrays are memory-mapped rather than read in memory,
+            so loading is immediate and only the parts used are read.
+
+        Returns
+        -------
+        FuzzyIndex
+            The index
+        """
+        with open(os.path.join(path, cls._META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(
+            column=meta["column"],
+            method=meta["method"],
+            q=meta["q"],
+            token_sort=meta["token_sort"],
+        )
+        index._vocabulary = {g: i for i, g in enumerate(meta["grams"])}
+        index._labels_as_strings = meta["labels_as_strings"]
+        names = list(index._arrays)
+        if index._labels_as_strings:
+            names += ["label_blob", "label_offsets"]
+        index._arrays = {
+            name: np.load(
+                os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+            )
+            for name in names
+        }
+        logger.info("Loaded fuzzy index with %s rows from %s", len(index), path)
+        return index
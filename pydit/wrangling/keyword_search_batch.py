@@ -1,21 +1,244 @@
 """Functions to sweep a dataframe for keywords and return a matrix of matches."""
 
+import hashlib
+import json
 import logging
 import math
+import os
 import re
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import lru_cache, partial
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+from .file_utils import close_output, read_batches, write_batch
+
 logger = logging.getLogger(__name__)
 
 
-def _keyword_search_re(keywords, df, case_sensitive):
+def _hit_column_names(n_keywords):
+    """Returns the sequential kw_matchNN column names for n keywords"""
+    zeroes = max(math.ceil(math.log10(n_keywords)), 2)
+    return ["kw_match" + str.zfill(str(i + 1), zeroes) for i in range(n_keywords)]
+
+
+def _compile_regex(keywords, case_sensitive):
+    """Compiles the keywords one by one, raising a ValueError if any is invalid.
+
+    We keep one pattern per keyword rather than one alternation of all of
+    them: Python's re has no multi-pattern automaton, so a big alternation
+    tries every branch at every position and loses the fast literal prefix
+    search each pattern gets on its own, which is much slower.
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    re_compiled = []
+    for re_text in keywords:
+        try:
+            re_compiled.append(re.compile(re_text, flags))
+        except Exception as e:
+            raise ValueError("Invalid regular expression: " + re_text) from e
+    return re_compiled
+
+
+def _regex_hits(text, searches):
+    """Returns the list of keyword positions that match the text"""
+    return [i for i, search in enumerate(searches) if search(text)]
+
+
+def _regex_spans(text, re_compiled):
+    """Returns a list of (keyword position, start, end) for every match"""
+    return [
+        (i, m.start(), m.end())
+        for i, p in enumerate(re_compiled)
+        for m in p.finditer(text)
+    ]
+
+
+class _AhoCorasick:
+    """Minimal Aho-Corasick automaton to find many literal keywords in one pass.
+
+    Each text is walked once, character by character, and all the keywords
+    ending at each position are emitted, including overlapping ones.
+    """
+
+    def __init__(self, keywords):
+        self._lengths = [len(kw) for kw in keywords]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for idx, kw in enumerate(keywords):
+            node = 0
+            for ch in kw:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].append(idx)
+        # Breadth first pass to set the failure links, i.e. the longest suffix
+        # of the current path that is also a prefix of some keyword
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """Yields (end position, keyword position) for every keyword found"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                yield pos + 1, idx
+
+    def find_all(self, text):
+        """Returns the set of keyword positions found in the text"""
+        found = set(self._out[0])  # empty keywords match anything
+        for _, idx in self.iter_matches(text):
+            found.add(idx)
+        return found
+
+    def find_spans(self, text, lower=False):
+        """Returns a list of (keyword position, start, end) for every match
+
+        With lower=True the text is lowercased before searching, but the
+        offsets are always of the original text, even if some characters
+        change length when lowercased, e.g. "İ".lower() has two characters.
+        """
+        original = None
+        if lower:
+            lowered = text.lower()
+            if len(lowered) != len(text):
+                # position in the original text of each lowercased character
+                original = [i for i, ch in enumerate(text) for _ in ch.lower()]
+            text = lowered
+        spans = [
+            (idx, end - self._lengths[idx], end)
+            for end, idx in self.iter_matches(text)
+            if self._lengths[idx]
+        ]
+        if original is not None:
+            spans = [(idx, original[s], original[e - 1] + 1) for idx, s, e in spans]
+        return spans
+
+
+@lru_cache(maxsize=32)
+def _compile_keywords(keywords, regexp, case_sensitive):
+    """Compiles a tuple of keywords once and returns the functions to find hits.
+
+    The result is cached, so searching the same keywords again (e.g. in many
+    tables, or in many chunks of the same table) doesn't compile them again.
+    Returns a tuple (find_hits, find_spans), the first one returns the set of
+    keywords found in a text, the second one the position of every match.
+    For case insensitive string search find_hits expects the texts already
+    lowercased by the caller (it is faster to do it vectorised).
+    """
+    if regexp:
+        re_compiled = _compile_regex(keywords, case_sensitive)
+        return (
+            partial(_regex_hits, searches=[r.search for r in re_compiled]),
+            partial(_regex_spans, re_compiled=re_compiled),
+        )
+    if not case_sensitive:
+        keywords = [x.lower() for x in keywords]
+    automaton = _AhoCorasick(keywords)
+    return automaton.find_all, partial(automaton.find_spans, lower=not case_sensitive)
+
+
+def _hit_matrix(texts, find_hits, n_keywords, sparse=False):
+    """Builds the boolean matrix rows x keywords, searching each distinct text once.
+
+    Narratives in ledgers tend to repeat a lot, so we factorize first and
+    broadcast the hits of each unique text back to the original rows.
+    If sparse is True we return a scipy CSR matrix that only stores the hits.
+    """
+    codes, uniques = pd.factorize(texts)
+    rows = []
+    cols = []
+    for u, text in enumerate(uniques):
+        for k in find_hits(text):
+            rows.append(u)
+            cols.append(k)
+    if sparse:
+        from scipy import sparse as sp  # pylint: disable=import-outside-toplevel
+
+        matrix = sp.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(len(uniques), n_keywords),
+        )
+    else:
+        matrix = np.zeros((len(uniques), n_keywords), dtype=bool)
+        matrix[rows, cols] = True
+    return matrix[codes]
+
+
+def _matrix_to_frame(matrix, keywords, index, sparse=False):
+    """Turns the hit matrix into the kw_matchNN dataframe, unless sparse"""
+    if sparse:
+        return matrix
+    return pd.DataFrame(matrix, columns=_hit_column_names(len(keywords)), index=index)
+
+
+def _span_table(texts, find_spans, context, index):
+    """Builds a long table with one row per match, searching each distinct text once.
+
+    The spans of each unique text are broadcast to all the rows with that text.
+    Columns are _row (the index of the text), _kw (keyword position), start,
+    end (offsets in the text searched) and snippet, the match plus up to
+    context characters on each side.
+    """
+    codes, uniques = pd.factorize(texts)
+    span_unique = []
+    spans = []
+    for u, text in enumerate(uniques):
+        for k, start, end in find_spans(text):
+            span_unique.append(u)
+            spans.append((k, start, end, text[max(start - context, 0) : end + context]))
+    span_unique = np.array(span_unique, dtype=np.int64)
+    # for each row we repeat the spans of its unique text, which are contiguous
+    spans_per_unique = np.bincount(span_unique, minlength=len(uniques))
+    first_span = np.cumsum(spans_per_unique) - spans_per_unique
+    row_repeat = spans_per_unique[codes]
+    row_pos = np.repeat(np.arange(len(codes)), row_repeat)
+    nth = np.arange(row_repeat.sum()) - np.repeat(
+        np.cumsum(row_repeat) - row_repeat, row_repeat
+    )
+    take = first_span[codes][row_pos] + nth
+    dfspans = pd.DataFrame(
+        spans or None, columns=["_kw", "start", "end", "snippet"]
+    ).iloc[take]
+    dfspans.insert(0, "_row", np.asarray(index)[row_pos])
+    return dfspans.reset_index(drop=True)
+
+
+def _keyword_search_re(
+    keywords, df, case_sensitive, output="frame", context=0, compiled=None
+):
     """Internal function to do keyword search with regexp (regular expressions).
 
     If you dont know what is a regexp, then you probably want to use
-    the simpler string search, but regexps are way more powerful
+    the simpler string search, but regexps are way more powerful.
+    Each distinct text is searched once per keyword, repeated texts are not
+    searched again.
 
     Arguments
     ---------
@@ -26,6 +249,14 @@ def _keyword_search_re(keywords, df, case_sensitive):
     case_sensitive : bool
         If True then the keywords are case sensitive.
         Provided by the parent function
+    output : str, default "frame"
+        "frame" for a dataframe, "sparse" for a scipy CSR matrix or "spans" for
+        a long table with the position of each match, see _span_table()
+    context : int, default 0
+        Characters to include on each side of the match when output="spans"
+    compiled : tuple, optional
+        The (find_hits, find_spans) pair from _compile_keywords(), if None we
+        get it from the cache
 
     Returns
     -------
@@ -35,37 +266,29 @@ def _keyword_search_re(keywords, df, case_sensitive):
 
     """
 
-    # We do a quick compilation pass so we can detect issues with the regex
-    re_compiled = []
-    for re_text in keywords:
-        try:
-            if case_sensitive:
-                pattern = re.compile(re_text)
-            else:
-                pattern = re.compile(re_text, re.IGNORECASE)
-            re_compiled.append(pattern)
-        except Exception as e:
-            raise ValueError("Invalid regular expression: " + re_text) from e
-    dfres = pd.DataFrame()
-    n = 1  # used for column naming
-    zeroes = max(math.ceil(math.log10(len(keywords))), 2)
-    for p in re_compiled:
-        logger.info("Searching for keyword: %s", p.pattern)
-        regmatch = np.vectorize(lambda x, pattern=p: bool(pattern.search(x)))
-        res = regmatch(df["dummy_keyword_search"].values)
-        logger.info("Found %d matches", sum(res))
-
-        dfres["kw_match" + str.zfill(str(n), zeroes)] = res
-        n = n + 1
-    return dfres
+    # We do a quick compilation pass so we can detect issues with the regex,
+    # unless the caller already did it
+    if compiled is None:
+        compiled = _compile_keywords(tuple(keywords), True, case_sensitive)
+    find_hits, find_spans = compiled
+    texts = df["dummy_keyword_search"]
+    if output == "spans":
+        return _span_table(texts, find_spans, context, df.index)
+    sparse = output == "sparse"
+    matrix = _hit_matrix(texts, find_hits, len(keywords), sparse)
+    return _matrix_to_frame(matrix, keywords, df.index, sparse)
 
 
-def _keyword_search_str(keywords, df, case_sensitive):
+def _keyword_search_str(
+    keywords, df, case_sensitive, output="frame", context=0, compiled=None
+):
     """Internal function to do a simple string search, no regular expressions used.
 
     While less powerful it could be faster if we wish to do lots of keywords on a
     large file, normally regexp are fine and can take normal keywords too, use
     this as an exception.
+    The keywords are loaded in an Aho-Corasick automaton so each text is
+    scanned once regardless of the number of keywords.
 
     Arguments
     ---------
@@ -74,6 +297,14 @@ def _keyword_search_str(keywords, df, case_sensitive):
     df : pandas.DataFrame
         The dataframe to search.
     case_sensitive : bool, default False
+    output : str, default "frame"
+        "frame" for a dataframe, "sparse" for a scipy CSR matrix or "spans" for
+        a long table with the position of each match, see _span_table()
+    context : int, default 0
+        Characters to include on each side of the match when output="spans"
+    compiled : tuple, optional
+        The (find_hits, find_spans) pair from _compile_keywords(), if None we
+        get it from the cache
 
     Returns
     -------
@@ -82,16 +313,74 @@ def _keyword_search_str(keywords, df, case_sensitive):
 
 
     """
-    if case_sensitive:
-        # We just use the values directly
-        listed = df["dummy_keyword_search"].tolist()
-    else:
-        keywords = [x.lower() for x in keywords]
-        listed = df["dummy_keyword_search"].str.lower().tolist()
-    dfres = pd.DataFrame()
-    for i, kw in enumerate(keywords):
-        dfres["kw_match" + str.zfill(str(i + 1), 2)] = [kw in n for n in listed]
-    return dfres
+    if compiled is None:
+        compiled = _compile_keywords(tuple(keywords), False, case_sensitive)
+    find_hits, find_spans = compiled
+    texts = df["dummy_keyword_search"]
+    if output == "spans":
+        # we lowercase inside, so the snippets come from the original text
+        return _span_table(texts, find_spans, context, df.index)
+    if not case_sensitive:
+        texts = texts.str.lower()
+    sparse = output == "sparse"
+    matrix = _hit_matrix(texts, find_hits, len(keywords), sparse)
+    return _matrix_to_frame(matrix, keywords, df.index, sparse)
+
+
+def _keyword_search_parallel(
+    search_func,
+    keywords,
+    df,
+    case_sensitive,
+    n_jobs,
+    chunksize,
+    output="frame",
+    context=0,
+    compiled=None,
+):
+    """Runs the search function over row chunks in a pool of processes.
+
+    Rows are independent, so we split the search text in chunks of rows, search
+    them in parallel and stitch the results back in the original order.
+    The compiled keywords are only used in this process, the workers compile
+    them once each from their own cache, as unpickling them would compile the
+    regexps again anyway.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1:
+        return search_func(keywords, df, case_sensitive, output, context, compiled)
+    if chunksize is None:
+        # a few chunks per worker so a slow chunk doesn't hold the rest
+        chunksize = max(math.ceil(len(df) / (n_jobs * 4)), 1)
+    chunks = [
+        df[["dummy_keyword_search"]].iloc[i : i + chunksize]
+        for i in range(0, len(df), chunksize)
+    ]
+    if len(chunks) <= 1:
+        return search_func(keywords, df, case_sensitive, output, context, compiled)
+    logger.info(
+        "Searching %d chunks of %d rows with %d processes",
+        len(chunks),
+        chunksize,
+        n_jobs,
+    )
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(
+            executor.map(
+                search_func,
+                repeat(keywords),
+                chunks,
+                repeat(case_sensitive),
+                repeat(output),
+                repeat(context),
+            )
+        )
+    if output == "sparse":
+        from scipy import sparse as sp  # pylint: disable=import-outside-toplevel
+
+        return sp.vstack(results, format="csr")
+    return pd.concat(results, ignore_index=output == "spans")
 
 
 def keyword_search(
@@ -103,6 +392,10 @@ def keyword_search(
     case_sensitive=False,
     labels=None,
     key_column=None,
+    n_jobs=1,
+    chunksize=None,
+    join_columns=True,
+    context=30,
 ):
     """
     Searches the keywords in a dataframe or series and returns a matrix of matches
@@ -127,6 +420,14 @@ def keyword_search(
         If "target" then the target columns and hits are returned,
         If "result" then only the boolean result columns will be returned,
         If "detail" then a dataframe with a hit per row is returned
+        If "sparse" then a tuple (hits, columns, summary) is returned, where hits
+        is a scipy CSR boolean matrix rows x columns, which only stores the hits,
+        columns the labels of the matrix columns and summary a dataframe with
+        kw_match_all and kw_match_count. Useful with thousands of keywords.
+        If "spans" then a dataframe with a row per match is returned, with
+        the key_column (if provided), keyword, labels, start and end offsets of
+        the match in the text searched and a snippet with some context, so you
+        can show reviewers where the hit is without searching again.
         If you use "full_hits", "target_hits" or "result_hits" then only hit rows are returned
     regexp : bool, default True
         If True then the keywords are treated as regular expressions, otherwise
@@ -142,53 +443,48 @@ def keyword_search(
         kw_match_NN. Labels must be the same length as the number of keywords.
         But they could be repeated and automagically will be grouped/rolled up.
     key_column : str, optional, default=None
-        If return_data="detail", this is the column to use as the key for
-        the returned dataframe
+        If return_data="detail" or "spans", this is the column to use as the
+        key for the returned dataframe
+    n_jobs : int, optional, default=1
+        Number of processes to use for the search, -1 to use all the cores.
+        Rows are split in chunks and searched in parallel, worth it only for
+        large dataframes as there is an overhead to start the processes.
+    chunksize : int, optional, default=None
+        Number of rows per chunk when n_jobs is not 1. If None, we split the
+        rows in about four chunks per process.
+    join_columns : bool, optional, default=True
+        If True the target columns are joined with a space and searched as one
+        text, so a keyword could match across two columns.
+        If False each column is searched on its own and a row is a hit if any
+        of the columns is. Faster on wide searches and keeps anchors like ^ or $
+        relative to each column. With return_data="spans" a "column" field
+        shows where the match is.
+    context : int, optional, default=30
+        With return_data="spans", number of characters to show on each side
+        of the match in the snippet.
 
     Returns
     -------
     DataFrame
         A copy of the dataframe with the new hit columns added or just
         the boolean columns for each keyword (depending on return_hit_columns_only)
-        Plus a column kw_match_all that is True if any of the other columns is True.
+        Plus a column kw_match_all that is True if any of the other columns is True,
+        and kw_match_count with the number of keywords (or labels) hit.
 
     """
 
     # Various input validation
-    if not isinstance(keywords, (list, str)):
-        raise TypeError("keywords must be a list of strings or a string")
-    if isinstance(keywords, str):
-        keywords = [keywords]
-    if isinstance(columns, str):
-        columns = [columns]
-    if columns:
-        try:
-            df = obj[columns].copy()
-            dffull = obj.copy()
-        except Exception as e:
-            raise ValueError("Columns not found in dataframe") from e
-
-    else:
-        if isinstance(obj.Series):
-            df = obj.to_frame()
-            dffull = df.copy()
-
-        elif isinstance(obj, DataFrame):
-            df = obj.copy()
-            dffull = obj.copy()
-        elif isinstance(obj, list):
-            df = pd.DataFrame(obj, columns="text_data")
-            dffull = df.copy()
-        else:
-            raise TypeError("Type not recognised")
+    # We don't mutate the input, so no need for a defensive copy of it
+    dffull, keywords, columns = _prepare_search_input(obj, keywords, columns)
 
-    if labels and (len(labels) != len(keywords)):
-        raise ValueError("Number of labels must match number of keywords")
+    return_data = _validate_search_args(
+        keywords, return_data, labels, key_column, dffull.columns, n_jobs, chunksize
+    )
     if len(keywords) < 20:
         logger.info("Searching for keywords: %s", keywords)
     else:
         logger.info("Searching for %d keywords", len(keywords))
-    logger.info("Rows to check: %s", df.shape[0])
+    logger.info("Rows to check: %s", dffull.shape[0])
     if case_sensitive:
         logger.info("Applying case sensitive search")
     if not regexp:
@@ -198,6 +494,198 @@ def keyword_search(
             logger.info(
                 "Labels provided are repeated, so they will be rolled up using OR logical operator"
             )
+
+    if return_data == "full":
+        logger.info("Returning full dataframe")
+    if return_data == "result":
+        logger.info("Returning results (boolean) columns only")
+    if return_data == "detail":
+        logger.info("Returning details")
+    if return_data == "target":
+        logger.info("Returning target and boolean columns")
+    if return_data == "sparse":
+        logger.info("Returning sparse matrix of hits")
+    if return_data == "spans":
+        logger.info("Returning position and snippet of each match")
+
+    # Here the main part of the function starts
+    return _run_search(
+        dffull,
+        columns,
+        keywords,
+        labels,
+        return_data,
+        key_column,
+        regexp,
+        case_sensitive,
+        n_jobs,
+        chunksize,
+        join_columns,
+        context,
+    )
+
+
+class KeywordSearcher:
+    """Precompiled list of keywords to search repeatedly in many dataframes.
+
+    Validates and compiles the keywords once, then .search() and
+    .search_series() can be called as many times as needed, e.g. to run the
+    same dictionary of terms against dozens of tables.
+    The compiled keywords are kept in the searcher, so other keyword lists
+    searched in between don't push them out of the small LRU cache shared
+    with keyword_search().
+
+    Parameters
+    ----------
+    keywords : list
+        The list of regular expressions or string keywords to search for.
+    labels : list, optional
+        The list of labels to use for the columns, see keyword_search()
+    case_sensitive : bool, default False
+        If True then the keywords are case sensitive.
+    regexp : bool, default True
+        If True then the keywords are treated as regular expressions, otherwise
+        a simpler string search is performed.
+
+    Examples
+    --------
+    >>> searcher = KeywordSearcher(["fee", "gift"], labels=["Fees", "Gifts"])
+    >>> searcher.search_series(pd.Series(["Gift card", "Bank fee"]))["Gifts"].tolist()
+    [True, False]
+
+    """
+
+    def __init__(self, keywords, labels=None, case_sensitive=False, regexp=True):
+        if not isinstance(keywords, (list, tuple, str)):
+            raise TypeError("keywords must be a list of strings or a string")
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        if labels and (len(labels) != len(keywords)):
+            raise ValueError("Number of labels must match number of keywords")
+        self.keywords = list(keywords)
+        self.labels = list(labels) if labels else None
+        self.case_sensitive = case_sensitive
+        self.regexp = regexp
+        # compiling here raises any invalid regexp straight away
+        self._compiled = _compile_keywords(tuple(self.keywords), regexp, case_sensitive)
+        logger.info("Compiled %d keywords for searching", len(self.keywords))
+
+    def search(
+        self,
+        obj,
+        columns=None,
+        return_data="full",
+        key_column=None,
+        n_jobs=1,
+        chunksize=None,
+        join_columns=True,
+        context=30,
+    ):
+        """Searches the keywords in a dataframe, see keyword_search() for details
+
+        Parameters
+        ----------
+        obj : pandas.DataFrame or pandas.Series
+            The dataframe or series to search
+        columns : list, optional
+            The list of columns to search in, if None all columns are searched
+        return_data : str, optional default="full"
+            Same options as keyword_search()
+        key_column : str, optional, default=None
+            Key column for return_data="detail"
+        n_jobs : int, optional, default=1
+            Number of processes to use for the search, -1 to use all the cores.
+        chunksize : int, optional, default=None
+            Number of rows per chunk when n_jobs is not 1.
+        join_columns : bool, optional, default=True
+            If False each column is searched on its own.
+        context : int, optional, default=30
+            Characters of context on each side of the match for "spans".
+
+        Returns
+        -------
+        DataFrame
+            Same as keyword_search()
+        """
+        dffull, keywords, columns = _prepare_search_input(obj, self.keywords, columns)
+        return_data = _validate_search_args(
+            keywords, return_data, None, key_column, dffull.columns, n_jobs, chunksize
+        )
+        logger.info("Rows to check: %s", dffull.shape[0])
+        return _run_search(
+            dffull,
+            columns,
+            keywords,
+            self.labels,
+            return_data,
+            key_column,
+            self.regexp,
+            self.case_sensitive,
+            n_jobs,
+            chunksize,
+            join_columns,
+            context,
+            compiled=self._compiled,
+        )
+
+    def search_series(self, s, return_data="result"):
+        """Searches the keywords in a series
+
+        Parameters
+        ----------
+        s : pandas.Series
+            The series to search
+        return_data : str, optional default="result"
+            Same options as keyword_search(), by default only the boolean
+            hit columns are returned, aligned to the index of the series.
+
+        Returns
+        -------
+        DataFrame
+            Same as keyword_search()
+        """
+        if not isinstance(s, pd.Series):
+            raise TypeError("s must be a pandas Series")
+        return self.search(s, return_data=return_data)
+
+
+def _prepare_search_input(obj, keywords, columns):
+    """Validates the data, keywords and columns to search.
+
+    Returns a tuple (dataframe, keywords list, columns list)
+    """
+    if not isinstance(keywords, (list, str)):
+        raise TypeError("keywords must be a list of strings or a string")
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    if isinstance(obj, list):
+        obj = pd.DataFrame(obj, columns=["text_data"])
+    elif isinstance(obj, pd.Series):
+        obj = obj.to_frame()
+    elif not isinstance(obj, DataFrame):
+        raise TypeError("Type not recognised")
+    if isinstance(columns, str):
+        columns = [columns]
+    if not columns:
+        columns = list(obj.columns)
+    if any(c not in obj.columns for c in columns):
+        raise ValueError("Columns not found in dataframe")
+    return obj, keywords, columns
+
+
+def _validate_search_args(
+    keywords, return_data, labels, key_column, available_columns, n_jobs, chunksize
+):
+    """Validates the arguments shared by the keyword search functions.
+
+    Returns the normalised (lowercase) return_data.
+    """
+    if not isinstance(n_jobs, int) or n_jobs == 0 or n_jobs < -1:
+        raise ValueError("n_jobs must be a positive integer or -1 for all cores")
+    if chunksize is not None and (not isinstance(chunksize, int) or chunksize < 1):
+        raise ValueError("chunksize must be a positive integer")
+    if labels and (len(labels) != len(keywords)):
+        raise ValueError("Number of labels must match number of keywords")
     return_data = return_data.lower()
     if return_data not in [
         "full",
@@ -207,49 +695,165 @@ def keyword_search(
         "full_hits",
         "target_hits",
         "result_hits",
+        "sparse",
+        "spans",
     ]:
         raise ValueError(
-            "return_data must be one of full, target, result or detail or ending with _hits"
+            "return_data must be one of full, target, result, detail, sparse, "
+            "spans or ending with _hits"
         )
-
-    if return_data == "full":
-        logger.info("Returning full dataframe")
-    if return_data == "result":
-        logger.info("Returning results (boolean) columns only")
-    if return_data == "detail":
-        logger.info("Returning details")
-    if return_data == "target":
-        logger.info("Returning target and boolean columns")
-
     if return_data == "detail":
         if key_column is None:
             raise ValueError("Must provide a key column if return_details is True")
-        if key_column not in dffull.columns:
+    if return_data in ["detail", "spans"] and key_column is not None:
+        if key_column not in available_columns:
             raise ValueError(f"Key column {key_column} not found in dataframe")
-    # Here the main part of the function starts
+    return return_data
 
-    df = df.fillna("")
-    if len(columns) > 1:
-        df["dummy_keyword_search"] = df[columns].astype(str).T.agg(" ".join)
-    else:
-        df["dummy_keyword_search"] = df[columns].astype(str)
 
+def _search_text(df, columns):
+    """Concatenates the target columns in one string per row, space separated.
+
+    Done column-wise with str.cat, no transposing or joining row by row.
+    """
+    texts = [df[c].fillna("").astype(str) for c in columns]
+    if len(texts) == 1:
+        return texts[0]
+    return texts[0].str.cat(texts[1:], sep=" ")
+
+
+def _search_frame(
+    df,
+    columns,
+    keywords,
+    regexp,
+    case_sensitive,
+    n_jobs,
+    chunksize,
+    output="frame",
+    join_columns=True,
+    context=0,
+    compiled=None,
+):
+    """Builds the search text from the target columns and runs the search.
+
+    If join_columns is False each column is searched on its own and the
+    results are combined with OR, so we never build the joined text.
+    Returns the dataframe of kw_matchNN boolean columns, aligned to df.index,
+    or a scipy CSR matrix with the same layout if output="sparse", or the
+    table of matches if output="spans", where _row is the row position in df.
+    compiled is the (find_hits, find_spans) pair from _compile_keywords(), if
+    the caller keeps it, otherwise we get it from the cache.
+    """
     if regexp:
-        dfres = _keyword_search_re(keywords, df, case_sensitive)
+        search_func = _keyword_search_re
     else:
-        dfres = _keyword_search_str(keywords, df, case_sensitive)
+        search_func = _keyword_search_str
+    if join_columns:
+        column_sets = [columns]
+    else:
+        column_sets = [[c] for c in columns]
+    result = None
+    for column_set in column_sets:
+        dftext = _search_text(df, column_set).to_frame("dummy_keyword_search")
+        # we search by position and put back the index at the end
+        dftext.index = pd.RangeIndex(len(dftext))
+        res = _keyword_search_parallel(
+            search_func,
+            keywords,
+            dftext,
+            case_sensitive,
+            n_jobs,
+            chunksize,
+            output,
+            context,
+            compiled,
+        )
+        if output == "spans":
+            if not join_columns:
+                res.insert(1, "column", column_set[0])
+            result = res if result is None else pd.concat([result, res])
+        elif result is None:
+            result = res
+        elif output == "sparse":
+            result = result.maximum(res)
+        else:
+            result = result | res
+    if output == "spans":
+        sort_by = ["_row", "_kw", "start"]
+        return result.sort_values(sort_by, kind="stable", ignore_index=True)
+    if output == "frame":
+        result.index = df.index
+    return result
 
+
+def _run_search(
+    dffull,
+    columns,
+    keywords,
+    labels,
+    return_data,
+    key_column,
+    regexp,
+    case_sensitive,
+    n_jobs,
+    chunksize,
+    join_columns,
+    context,
+    compiled=None,
+):
+    """Searches the validated input and returns the data requested.
+
+    Shared by keyword_search() and KeywordSearcher, which passes its compiled
+    keywords so they are not looked up (or compiled) again on each search.
+    """
+    if return_data in ["sparse", "spans"]:
+        output = return_data
+    else:
+        output = "frame"
+    dfres = _search_frame(
+        dffull,
+        columns,
+        keywords,
+        regexp,
+        case_sensitive,
+        n_jobs,
+        chunksize,
+        output=output,
+        join_columns=join_columns,
+        context=context,
+        compiled=compiled,
+    )
+    for kw, count in zip(keywords, _keyword_counts(dfres, len(keywords))):
+        logger.info("Found %d matches for keyword: %s", count, kw)
+
+    if output == "sparse":
+        return _sparse_results(dffull.index, dfres, keywords, labels)
+    if output == "spans":
+        return _span_results(dffull, dfres, keywords, labels, key_column)
+    return _shape_results(
+        dffull, columns, dfres, keywords, labels, return_data, key_column
+    )
+
+
+def _keyword_counts(res, n_keywords):
+    """Number of rows hit per keyword, whatever the output of the search"""
+    if isinstance(res, DataFrame) and "_kw" in res.columns:
+        kws = res.drop_duplicates(["_row", "_kw"])["_kw"].to_numpy(dtype=np.int64)
+        return np.bincount(kws, minlength=n_keywords)
+    return np.asarray(res.sum(axis=0)).ravel()
+
+
+def _shape_results(dffull, columns, dfres, keywords, labels, return_data, key_column):
+    """Rolls up labels, adds the summary columns and returns the data requested"""
     if "detail" in return_data:
-        df = dffull.join(dfres)
-        zeroes = max(math.ceil(math.log10(len(keywords))), 2)
         list_hits = []
-        for i, kw in enumerate(keywords):
-            hit_field = "kw_match" + str.zfill(str(i + 1), zeroes)
+        for i, (kw, hit_field) in enumerate(zip(keywords, dfres.columns)):
             if labels:
                 label = labels[i]
             else:
                 label = kw
-            dftemp = df[df[hit_field]][[key_column]].copy()
+            dftemp = dffull.loc[dfres[hit_field].to_numpy(), [key_column]].copy()
             dftemp["labels"] = label
             dftemp["keyword"] = kw
             list_hits.append(dftemp)
@@ -262,27 +866,28 @@ def keyword_search(
             dfres.columns = labels
         else:
             # we are dealing with multiple labels to group
-            dfresg = pd.DataFrame()
-            for label in set(labels):
+            dfresg = pd.DataFrame(index=dfres.index)
+            for label in dict.fromkeys(labels):
                 cols = []
                 for i, c in enumerate(dfres.columns):
                     if label == labels[i]:
                         cols.append(c)
                 dfresg[label] = np.logical_or.reduce(dfres[cols], axis=1)
-            dfres = dfresg.copy()
+            dfres = dfresg
 
     # we add the combined any() (ie. or) column to dfres after we processed the
     # labels because otherwise the list of labels and hits wouldnt match
-    dfres["kw_match_all"] = dfres.apply(any, axis=1)
-    # we add a hit count column for convenience
-    dfres["kw_match_count"] = dfres.apply(sum, axis=1)
+    # we also add a hit count column for convenience
+    hit_count = dfres.sum(axis=1)
+    dfres["kw_match_all"] = hit_count > 0
+    dfres["kw_match_count"] = hit_count
     logger.info("Count of all hits: %s", dfres["kw_match_count"].sum())
     if "_hits" in return_data:
-        dfres = dfres[dfres["kw_match_all"]].copy()
+        dfres = dfres[dfres["kw_match_all"]]
         logger.info("Returning just hit rows: %s", dfres.shape[0])
 
     if "full" in return_data:
-        dffull = dffull.join(dfres, how="inner").copy()
+        dffull = dffull.join(dfres, how="inner")
         logger.info("Returning all columns %s", dffull.columns)
         return dffull
 
@@ -291,6 +896,401 @@ def keyword_search(
         return dfres
 
     if "target" in return_data:
-        df = df[columns].join(dfres, how="inner").copy()
+        df = dffull[columns].join(dfres, how="inner")
         logger.info("Returning target columns: %s", df.columns)
         return df
+
+
+def _span_results(dffull, dfspans, keywords, labels, key_column):
+    """Turns the table of matches into the long format returned to the user.
+
+    One row per match with the key column (if provided), keyword, label,
+    start and end offsets in the text searched and the snippet. The index is
+    the index of the row in the input dataframe.
+    """
+    kws = dfspans["_kw"].to_numpy(dtype=np.int64)
+    rows = dfspans["_row"].to_numpy(dtype=np.int64)
+    dfres = dfspans.drop(columns=["_row", "_kw"])
+    dfres.index = dffull.index[rows]
+    dfres.insert(0, "keyword", np.array(keywords, dtype=object)[kws])
+    dfres.insert(1, "labels", np.array(labels or keywords, dtype=object)[kws])
+    if key_column is not None:
+        dfres.insert(0, key_column, dffull[key_column].to_numpy()[rows])
+    logger.info("Returning %s matches", dfres.shape[0])
+    return dfres
+
+
+def _sparse_results(index, hits, keywords, labels):
+    """Rolls up labels on the sparse hit matrix and computes the summary columns.
+
+    Returns a tuple (hits, columns, dfsummary) where hits is a scipy CSR matrix
+    rows x columns, columns the pandas.Index of labels (or kw_matchNN) for the
+    matrix columns and dfsummary a dataframe with kw_match_all and
+    kw_match_count for each row, aligned to the index of the input.
+    """
+    if labels and len(set(labels)) < len(labels):
+        from scipy import sparse as sp  # pylint: disable=import-outside-toplevel
+
+        # a keywords x labels indicator matrix rolls up the hits with a product
+        unique_labels = list(dict.fromkeys(labels))
+        label_pos = {label: i for i, label in enumerate(unique_labels)}
+        indicator = sp.csr_matrix(
+            (
+                np.ones(len(labels), dtype=np.int32),
+                (np.arange(len(labels)), [label_pos[x] for x in labels]),
+            ),
+            shape=(len(labels), len(unique_labels)),
+        )
+        hits = (hits.astype(np.int32) @ indicator) > 0
+        columns = pd.Index(unique_labels)
+    elif labels:
+        columns = pd.Index(labels)
+    else:
+        columns = pd.Index(_hit_column_names(len(keywords)))
+    hit_count = hits.getnnz(axis=1)
+    dfsummary = pd.DataFrame(
+        {"kw_match_all": hit_count > 0, "kw_match_count": hit_count}, index=index
+    )
+    logger.info("Count of all hits: %s", hits.nnz)
+    return hits.tocsr(), columns, dfsummary
+
+
+# Bump when the layout of the hit store changes, so older stores are rebuilt
+_HIT_STORE_VERSION = 2
+
+
+def _open_hit_store(conn, signature, keys):
+    """Creates the hit store tables and clears them if the keywords changed
+
+    Returns the stored hits of the keys given only, looked up with a join on
+    a temporary table, so the rest of the store is not read.
+    The hits of each row are a blob with the bits of the keyword positions
+    hit, packed with numpy.packbits(), see _pack_hits().
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS kw_meta (name TEXT PRIMARY KEY, value TEXT)"
+    )
+    stored = conn.execute(
+        "SELECT value FROM kw_meta WHERE name = 'signature'"
+    ).fetchone()
+    if stored is None or stored[0] != signature:
+        if stored is not None:
+            logger.info("Keywords or search options changed, rescanning all rows")
+        # dropped rather than emptied, as the layout may have changed too
+        conn.execute("DROP TABLE IF EXISTS kw_hits")
+        conn.execute(
+            "INSERT OR REPLACE INTO kw_meta VALUES ('signature', ?)", (signature,)
+        )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS kw_hits "
+        "(key TEXT PRIMARY KEY, row_hash INTEGER, hits BLOB)"
+    )
+    conn.commit()
+    if conn.execute("SELECT 1 FROM kw_hits LIMIT 1").fetchone() is None:
+        return pd.DataFrame({"key": [], "row_hash": [], "hits": []})
+    conn.execute("CREATE TEMP TABLE kw_keys (key TEXT PRIMARY KEY)")
+    try:
+        conn.executemany("INSERT INTO kw_keys VALUES (?)", ((k,) for k in keys))
+        return pd.read_sql_query(
+            "SELECT h.key, h.row_hash, h.hits FROM kw_keys k "
+            "JOIN kw_hits h ON h.key = k.key",
+            conn,
+        )
+    finally:
+        conn.execute("DROP TABLE kw_keys")
+
+
+def _pack_hits(matrix):
+    """Packs each row of the boolean hit matrix in a bytes blob, 8 keywords a byte"""
+    packed = np.ascontiguousarray(np.packbits(matrix, axis=1))
+    # a void view turns each row in one bytes object, keeping the zero bytes
+    return packed.view(f"V{max(packed.shape[1], 1)}").ravel().tolist()
+
+
+def _unpack_hits(blobs, n_keywords):
+    """Rebuilds the boolean hit matrix from the blobs of _pack_hits()"""
+    n_bytes = (n_keywords + 7) // 8
+    packed = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(-1, n_bytes)
+    return np.unpackbits(packed, axis=1, count=n_keywords).astype(bool)
+
+
+def keyword_search_incremental(
+    obj,
+    keywords,
+    columns,
+    key_column,
+    store_path,
+    return_data="full",
+    regexp=True,
+    case_sensitive=False,
+    labels=None,
+    n_jobs=1,
+    chunksize=None,
+    join_columns=True,
+):
+    """
+    Searches the keywords only in the rows that are new or changed since last run.
+
+    The hits of each row are kept in a SQLite file (the hit store) together
+    with the key and a hash of the content of the target columns. On the next
+    run only the rows with a new key or a different hash are searched, the
+    rest are taken from the store. If the keywords or search options change,
+    the store is cleared and all the rows are searched again.
+    Rows in the store that are not in the dataframe are left untouched, so you
+    can also pass just the new rows.
+
+    Parameters
+    ----------
+    obj : pandas.DataFrame
+        The dataframe to search
+    keywords : list
+        The list of regular expressions or string keywords to search for.
+    columns : list
+        The list of columns to search in, if None then all columns are searched
+    key_column : str
+        The column that identifies each row, must be unique and not null.
+    store_path : str
+        The SQLite file used as hit store, it is created if it doesn't exist.
+    return_data : str, optional default="full"
+        Same options as keyword_search() except "sparse" and "spans"
+    regexp : bool, default True
+        If True then the keywords are treated as regular expressions, otherwise
+        a simpler string search is performed.
+    case_sensitive : bool, default False
+        If True then the keywords are case sensitive.
+    labels : list, optional
+        The list of labels to use for the columns, see keyword_search()
+    n_jobs : int, optional, default=1
+        Number of processes to use for the search, -1 to use all the cores.
+    chunksize : int, optional, default=None
+        Number of rows per chunk when n_jobs is not 1.
+    join_columns : bool, optional, default=True
+        If False each column is searched on its own, see keyword_search()
+
+    Returns
+    -------
+    DataFrame
+        Same as keyword_search() for all the rows in obj.
+
+    """
+    dffull, keywords, columns = _prepare_search_input(obj, keywords, columns)
+    if key_column not in dffull.columns:
+        raise ValueError(f"Key column {key_column} not found in dataframe")
+    return_data = _validate_search_args(
+        keywords, return_data, labels, key_column, dffull.columns, n_jobs, chunksize
+    )
+    if return_data in ["sparse", "spans"]:
+        raise ValueError(f"return_data='{return_data}' is not supported here")
+    if dffull[key_column].isna().any() or dffull[key_column].duplicated().any():
+        raise ValueError(f"Key column {key_column} must be unique and not null")
+
+    keys = dffull[key_column].astype(str).to_numpy()
+    row_hash = (
+        pd.util.hash_pandas_object(dffull[columns], index=False)
+        .to_numpy()
+        .view(np.int64)  # SQLite integers are signed
+    )
+    signature = hashlib.sha256(
+        json.dumps(
+            [
+                _HIT_STORE_VERSION,
+                keywords,
+                regexp,
+                case_sensitive,
+                columns,
+                join_columns,
+            ],
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+
+    with closing(sqlite3.connect(store_path)) as conn:
+        dfstore = _open_hit_store(conn, signature, keys)
+        pos = pd.Index(dfstore["key"]).get_indexer(keys)
+        if len(dfstore) > 0:
+            stored_hash = dfstore["row_hash"].to_numpy(dtype=np.int64)[pos]
+            changed = (pos < 0) | (stored_hash != row_hash)
+        else:
+            changed = np.ones(len(keys), dtype=bool)
+        logger.info(
+            "Rows to check: %s, unchanged since last run: %s, to search: %s",
+            len(keys),
+            (~changed).sum(),
+            changed.sum(),
+        )
+
+        matrix = np.zeros((len(keys), len(keywords)), dtype=bool)
+        if changed.any():
+            dfnew = _search_frame(
+                dffull[changed],
+                columns,
+                keywords,
+                regexp,
+                case_sensitive,
+                n_jobs,
+                chunksize,
+                join_columns=join_columns,
+            )
+            new_matrix = dfnew.to_numpy(dtype=bool)
+            conn.executemany(
+                "INSERT OR REPLACE INTO kw_hits VALUES (?, ?, ?)",
+                zip(keys[changed], row_hash[changed].tolist(), _pack_hits(new_matrix)),
+            )
+            conn.commit()
+            matrix[changed] = new_matrix
+
+    # the hits of unchanged rows come from the store
+    unchanged_rows = np.flatnonzero(~changed)
+    if len(unchanged_rows) > 0:
+        stored_hits = dfstore["hits"].to_numpy(dtype=object)[pos[unchanged_rows]]
+        matrix[unchanged_rows] = _unpack_hits(stored_hits, len(keywords))
+
+    dfres = _matrix_to_frame(matrix, keywords, dffull.index)
+    for kw, count in zip(keywords, matrix.sum(axis=0)):
+        logger.info("Found %d matches for keyword: %s", count, kw)
+    return _shape_results(
+        dffull, columns, dfres, keywords, labels, return_data, key_column
+    )
+
+
+def keyword_search_file(
+    path,
+    keywords,
+    columns,
+    output_path,
+    return_data="full_hits",
+    regexp=True,
+    case_sensitive=False,
+    labels=None,
+    key_column=None,
+    batch_size=100000,
+    n_jobs=1,
+    join_columns=True,
+    context=30,
+    **read_kwargs,
+):
+    """
+    Searches the keywords in a CSV or Parquet file too large to fit in memory.
+
+    The file is read in batches of rows, each batch is searched with the same
+    logic as keyword_search() and the results are appended to the output file
+    as we go, so memory stays bounded by the batch size, not the file size.
+    Only the target columns (plus the key column) are read unless you ask for
+    the "full" data.
+
+    Parameters
+    ----------
+    path : str
+        The CSV or Parquet (.parquet or .pq) file to search
+        Parquet files need pyarrow installed.
+    keywords : list
+        The list of regular expressions or string keywords to search for.
+    columns : list
+        The list of columns to search in
+    output_path : str
+        The CSV or Parquet file to write the results to, it will be overwritten.
+        The row number in the source file is kept in a "source_row" column.
+    return_data : str, optional default="full_hits"
+        Same options as keyword_search() except "sparse". Typically
+        "full_hits", "detail" or "spans" as writing all the rows back defeats
+        the purpose.
+    regexp : bool, default True
+        If True then the keywords are treated as regular expressions, otherwise
+        a simpler string search is performed.
+    case_sensitive : bool, default False
+        If True then the keywords are case sensitive.
+    labels : list, optional
+        The list of labels to use for the columns, see keyword_search()
+    key_column : str, optional, default=None
+        If return_data="detail" or "spans", this is the column to use as the key
+    batch_size : int, optional, default=100000
+        Number of rows to read, search and write at a time.
+    n_jobs : int, optional, default=1
+        Number of processes to use to search each batch, -1 for all cores.
+    join_columns : bool, optional, default=True
+        If False each column is searched on its own, see keyword_search()
+    context : int, optional, default=30
+        Characters of context on each side of the match for "spans".
+    **read_kwargs :
+        Other arguments passed to pandas.read_csv() e.g. sep or encoding.
+        By default CSV columns are read as strings (dtype=str).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Summary with the number of hits per keyword across the whole file.
+
+    """
+    if not isinstance(keywords, (list, str)):
+        raise TypeError("keywords must be a list of strings or a string")
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    if isinstance(columns, str):
+        columns = [columns]
+    if not columns:
+        raise ValueError("Must provide the columns to search")
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    return_data = _validate_search_args(
+        keywords,
+        return_data,
+        labels,
+        key_column,
+        [key_column],
+        n_jobs,
+        None,
+    )
+    if return_data == "sparse":
+        raise ValueError("return_data='sparse' is not supported when writing to a file")
+    if "full" in return_data:
+        read_columns = None
+    elif key_column is not None and key_column not in columns:
+        read_columns = columns + [key_column]
+    else:
+        read_columns = columns
+
+    logger.info("Searching %d keywords in file: %s", len(keywords), path)
+    counts = np.zeros(len(keywords), dtype=np.int64)
+    rows_read = 0
+    rows_written = 0
+    state = {}
+    output = "spans" if return_data == "spans" else "frame"
+    try:
+        for df in read_batches(path, batch_size, read_kwargs, columns=read_columns):
+            dfres = _search_frame(
+                df,
+                columns,
+                keywords,
+                regexp,
+                case_sensitive,
+                n_jobs,
+                None,
+                output=output,
+                join_columns=join_columns,
+                context=context,
+            )
+            counts += _keyword_counts(dfres, len(keywords))
+            if output == "spans":
+                dfout = _span_results(df, dfres, keywords, labels, key_column)
+            else:
+                dfout = _shape_results(
+                    df, columns, dfres, keywords, labels, return_data, key_column
+                )
+            write_batch(dfout, output_path, state)
+            rows_read += len(df)
+            rows_written += len(dfout)
+            logger.debug("Processed %d rows", rows_read)
+    finally:
+        close_output(output_path, state)
+    logger.info("Rows checked: %d, rows written: %d", rows_read, rows_written)
+
+    dfsummary = pd.DataFrame(
+        {
+            "keyword": keywords,
+            "labels": labels if labels else keywords,
+            "hits": counts,
+        }
+    )
+    for kw, count in zip(keywords, counts):
+        logger.info("Found %d matches for keyword: %s", count, kw)
+    return dfsummary
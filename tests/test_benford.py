@@ -2,6 +2,7 @@
 
 import os
 import pathlib
+import pickle
 import sys
 
 import numpy as np
@@ -13,6 +14,9 @@ import pytest
 # pylint: disable=import-error disable=wrong-import-position
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from pydit import (
+    BenfordAccumulator,
+    benford_batch,
+    benford_by_group,
     benford_list_anomalies,
     benford_mad,
     benford_probability,
@@ -228,6 +232,140 @@ def test_check_benford_2():
     assert list(dfres["bf_act_count"]) == [2, 2, 1, 1, 1, 1, 1, 1, 1]
 
 
+def test_benford_numeric_digits():
+    """testing the numeric path gives the same digits as the string one"""
+    d = [0, -1, 11, 1.11, 0.1111, 4.35, -0.0345, 999.99, 123456.789, np.nan, 7]
+    for n in (1, 2, 3):
+        numeric = benford_to_dataframe(pd.Series(d, dtype="float64"), "", n)
+        text = benford_to_dataframe(pd.Series(d, dtype=object), "", n)
+        pd.testing.assert_frame_equal(numeric, text)
+
+    # the short values are padded with zeroes, 7 is 700
+    counts = benford_to_dataframe(d, "", 3).set_index("bf_digit")["bf_act_count"]
+    assert counts.loc[[111, 345, 435, 700]].tolist() == [2, 1, 1, 1]
+
+    # integers are exact even beyond the float precision
+    ints = pd.Series([7, -12, 10**18 + 5, 0, 9_007_199_254_740_993])
+    counts = benford_to_dataframe(ints, "", 2).set_index("bf_digit")["bf_act_count"]
+    assert counts.loc[[10, 12, 70, 90]].tolist() == [1, 1, 1, 1]
+    assert counts.sum() == 4
+
+    # unsigned integers above the int64 range don't wrap around
+    uints = pd.Series([2**64 - 1, 2**63, 5], dtype="uint64")
+    counts = benford_to_dataframe(uints, "", 2).set_index("bf_digit")["bf_act_count"]
+    assert counts.loc[[18, 50, 92]].tolist() == [1, 1, 1]
+    assert counts.sum() == 3
+    res = benford_batch(pd.DataFrame({"x": uints}), "x", "last2")
+    assert res.set_index("bf_digit").loc[[8, 15], "bf_act_count"].tolist() == [1, 1]
+    assert res["bf_n"].iloc[0] == 2
+
+
+def test_benford_batch():
+    """testing the batch gives the same counts as the single tests"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "amount": np.round(rng.lognormal(6, 2, 2000), 2),
+            "text": rng.integers(-(10**5), 10**5, 2000).astype(str),
+        }
+    )
+    res = benford_batch(df, ["amount", "text"])
+    assert res.groupby(["column", "test"]).size().to_dict() == {
+        ("amount", "1"): 9,
+        ("amount", "2"): 90,
+        ("amount", "3"): 900,
+        ("amount", "last2"): 100,
+        ("amount", "second"): 10,
+        ("text", "1"): 9,
+        ("text", "2"): 90,
+        ("text", "3"): 900,
+        ("text", "last2"): 100,
+        ("text", "second"): 10,
+    }
+    for col in ["amount", "text"]:
+        for n in (1, 2, 3):
+            single = benford_to_dataframe(df, col, n)
+            batch = res[(res["column"] == col) & (res["test"] == str(n))]
+            assert batch["bf_act_count"].tolist() == single["bf_act_count"].tolist()
+        second = res[(res["column"] == col) & (res["test"] == "second")]
+        assert second["bf_exp_freq"].sum() == pytest.approx(1.0)
+        assert second["bf_act_count"].sum() == 2000 - (df[col] == 0).sum()
+
+    res = benford_batch(pd.DataFrame({"x": [5, 10, 110, 1234, 99.9]}), "x", "last2")
+    assert res.set_index("bf_digit").loc[[10, 34, 99], "bf_act_count"].tolist() == [
+        2,
+        1,
+        1,
+    ]
+    assert res["bf_n"].iloc[0] == 4
+    assert res["bf_mad"].iloc[0] == pytest.approx(
+        np.abs(res["bf_act_freq"] - 0.01).mean()
+    )
+    with pytest.raises(ValueError):
+        benford_batch(df, "amount", [5])
+    with pytest.raises(ValueError):
+        benford_batch(df, "wrong_column")
+
+
+def test_benford_by_group():
+    """testing the grouped benford against the batch of each group"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "vendor": rng.choice(["a", "b", "c", None], 3000),
+            "approver": rng.integers(0, 2, 3000),
+            "amount": np.round(rng.lognormal(6, 2, 3000), 2),
+        }
+    )
+    # vendor c has uniform amounts, which don't follow Benford's Law
+    is_c = df["vendor"] == "c"
+    df.loc[is_c, "amount"] = rng.uniform(100, 999, is_c.sum())
+    df.loc[df.index[:10], "amount"] = 0
+
+    res = benford_by_group(df, "amount", ["vendor", "approver"], 1)
+    assert len(res) == 6
+    assert res["vendor"].iloc[:2].tolist() == ["c", "c"]
+    assert res["bf_mad"].is_monotonic_decreasing
+    assert (res["bf_ks"].iloc[:2] > res["bf_ks_critical"].iloc[:2]).all()
+    for _, row in res.iterrows():
+        group = df[
+            (df["vendor"] == row["vendor"]) & (df["approver"] == row["approver"])
+        ]
+        single = benford_batch(group, "amount", [1]).iloc[0]
+        assert row["bf_n"] == single["bf_n"]
+        assert row["bf_mad"] == pytest.approx(single["bf_mad"])
+        assert row["bf_chi2"] == pytest.approx(single["bf_chi2"])
+
+    res = benford_by_group(df, "amount", "vendor", 2)
+    assert res["bf_n"].sum() == (df["vendor"].notna() & (df["amount"] > 0)).sum()
+    with pytest.raises(ValueError):
+        benford_by_group(df, "amount", "vendor", 5)
+
+
+def test_benford_accumulator():
+    """testing the accumulator gives the same results as the whole column"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"amount": np.round(rng.lognormal(6, 2, 5000), 2)})
+    df.loc[df.index[:20], "amount"] = 0
+    for n in (1, 2):
+        expected = benford_to_dataframe(df, "amount", n)
+        acc = BenfordAccumulator(n, "amount")
+        for start in range(0, 3000, 700):
+            acc.update(df.iloc[start : min(start + 700, 3000)])
+        # the rest counted in another "worker" and sent pickled
+        other = BenfordAccumulator(n).update(df["amount"].iloc[3000:].to_numpy())
+        acc.merge(pickle.loads(pickle.dumps(other)))
+        assert acc.invalid_count == 20
+        pd.testing.assert_frame_equal(acc.finalize(), expected)
+
+    acc = BenfordAccumulator(1).update(df.iloc[:10].rename(columns={"amount": "x"}))
+    assert acc.counts.sum() == 0
+    with pytest.raises(ValueError):
+        BenfordAccumulator(1, "wrong").update(df)
+    with pytest.raises(ValueError):
+        BenfordAccumulator(1).merge(BenfordAccumulator(2))
+
+
 def test_benford_chart():
     """testing the benford chart"""
     d = [
@@ -365,6 +503,29 @@ def test_benford_list_anomalies():
     assert res[res["bf_exp_count"] > 0]["bf_diff_perc"].abs().sum() == 0
 
 
+def test_benford_list_anomalies_no_side_effects():
+    """testing the anomalies keep the input, its index and its nulls"""
+    df = pd.DataFrame(
+        {
+            "amount": [1, 1, 1, 1, 2, 2, 9, 9, 9, 0, np.nan],
+            "note": ["a", None, "b", "c", "d", "e", "f", "g", "h", "i", "j"],
+        },
+        index=list("abcdefghijk"),
+    )
+    original = df.copy()
+    res = benford_list_anomalies(df, "amount", top_n_digits=1)
+    pd.testing.assert_frame_equal(df, original)
+    assert res.index.equals(df.index)
+    assert res["note"].isna().sum() == 1
+    assert res["flag_bf_anomaly"].tolist() == [False] * 6 + [True] * 3 + [False] * 2
+    assert res["bf_digit"].tolist() == [1, 1, 1, 1, 2, 2, 9, 9, 9, 0, 0]
+    assert res["bf_act_count"].iloc[-2:].isna().all()
+    assert res.loc["g", "bf_act_count"] == 3
+
+    anomalies = benford_list_anomalies(df, "amount", 1, return_anomalies_only=True)
+    assert list(anomalies.index) == ["g", "h", "i"]
+
+
 if __name__ == "__main__":
     # execute only if run as a script
     pass
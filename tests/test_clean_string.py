@@ -1,13 +1,15 @@
 """test of base functions"""
 
+import itertools
 import os
 import sys
 
 import numpy as np
+import pandas as pd
 
 # pylint: disable=import-error disable=wrong-import-position
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pydit import clean_string, setup_logging
+from pydit import clean_string, clean_string_series, setup_logging
 
 # import numpy as np
 # from datetime import datetime, date, timedelta
@@ -43,6 +45,47 @@ def test_clean_string():
     )
 
 
+def test_clean_string_series():
+    """test the vectorised version gives the same results as clean_string"""
+    values = [
+        " John Smith 123  456 .  ",
+        "Fermín Puñales-Horta",
+        "O'Neil & Sons.",
+        "Iñaqui",
+        "  ",
+        "",
+        None,
+        np.nan,
+        123,
+        123.0,
+        True,
+        "123",
+        "Iñaqui",
+    ]
+    s = pd.Series(values, index=range(10, 10 + len(values)), dtype=object)
+    options = itertools.product(
+        [False, True],
+        [False, True],
+        [False, True, "expand"],
+        [False, True],
+        [False, True],
+        ["lower", "upper", None],
+    )
+    for dot, dash, amp, spaces, underscore, case in options:
+        kwargs = {
+            "keep_dot": dot,
+            "keep_dash": dash,
+            "keep_ampersand": amp,
+            "keep_spaces": spaces,
+            "space_to_underscore": underscore,
+            "to_case": case,
+        }
+        res = clean_string_series(s, **kwargs)
+        assert res.tolist() == [clean_string(v, **kwargs) for v in values]
+        assert res.index.equals(s.index)
+    assert clean_string_series([]).tolist() == []
+
+
 if __name__ == "__main__":
     # test_clean_string
     pass
@@ -11,7 +11,12 @@ import pytest
 # from datetime import datetime, date, timedelta
 # pylint: disable=import-error disable=wrong-import-position
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pydit import check_duplicates
+from pydit import (
+    check_duplicates,
+    check_duplicates_batch,
+    check_duplicates_file,
+    check_near_duplicates,
+)
 
 """Base DataFrame fixture"""
 
@@ -214,5 +219,244 @@ def test_check_duplicates_series():
     assert list(dfdupes["data"]) == ["Value 1", "Value 1"]
 
 
+def test_check_duplicates_matches_pandas():
+    """test the factorized masks match pandas duplicated() on random data"""
+    rng = np.random.default_rng(0)
+    n = 60
+    df = pd.DataFrame(
+        {
+            "a": rng.choice([1.0, 2.0, np.nan], n),
+            "b": rng.choice(["x", "y", None], n),
+            "c": rng.integers(0, 3, n),
+        },
+        index=rng.permutation(n) + 100,
+    )
+    for cols in [["a"], ["a", "b"], ["b", "c", "a"]]:
+        dfnotna = df.dropna(subset=cols, how="all")
+        for keep in [False, "first", "last"]:
+            res = check_duplicates(df, cols, keep=keep)
+            expected = dfnotna[dfnotna.duplicated(cols, keep=keep)]
+            pd.testing.assert_frame_equal(res, expected)
+
+            res = check_duplicates(
+                df, cols, keep=keep, add_indicator_column=True, dropna=False
+            )
+            expected = df[df.duplicated(cols, keep=keep)]
+            assert list(res.index) == list(expected.index)
+            assert res["_duplicates"].all()
+
+
+def test_check_duplicates_no_mutation(df):
+    """test the input is not modified"""
+    ser = pd.Series(["a", "a", "b"], name="letters")
+    check_duplicates(ser)
+    assert ser.name == "letters"
+    dfcopy = df.copy()
+    check_duplicates(df, "col5", add_indicator_column=True, ascending=False)
+    pd.testing.assert_frame_equal(df, dfcopy)
+
+
+def test_check_duplicates_file(df, tmp_path):
+    """test the out of core check gives the same rows as the in memory one"""
+    source = tmp_path / "source.csv"
+    df.to_csv(source, index=False)
+    output = tmp_path / "dupes.csv"
+    dfsource = pd.read_csv(source, dtype=str)
+    for keep in [False, "first", "last"]:
+        for also_non_dupes in [False, True]:
+            summary = check_duplicates_file(
+                source,
+                ["col4", "col5"],
+                output,
+                keep=keep,
+                add_indicator_column=True,
+                also_return_non_duplicates=also_non_dupes,
+                n_buckets=3,
+                batch_size=3,
+            )
+            expected = check_duplicates(
+                dfsource,
+                ["col4", "col5"],
+                keep=keep,
+                add_indicator_column=True,
+                also_return_non_duplicates=also_non_dupes,
+            )
+            res = pd.read_csv(output).sort_values("source_row")
+            assert list(res["source_row"]) == list(expected.index)
+            assert list(res["_duplicates"]) == list(expected["_duplicates"])
+            assert summary["population"].iloc[0] == 8
+            assert summary["duplicate_rows"].iloc[0] == 4
+            assert summary["unique_duplicate_instances"].iloc[0] == 2
+
+    summary = check_duplicates_file(source, "col1", output)
+    assert summary["duplicate_rows"].iloc[0] == 0
+    with pytest.raises(ValueError):
+        check_duplicates_file(source, "col3", output)
+
+
+def test_check_duplicates_file_parquet(df, tmp_path):
+    """test a parquet output is replaced even when there are no duplicates"""
+    pytest.importorskip("pyarrow")
+    source = tmp_path / "source.csv"
+    df.to_csv(source, index=False)
+    output = tmp_path / "dupes.parquet"
+    check_duplicates_file(source, ["col4", "col5"], output, batch_size=3)
+    assert len(pd.read_parquet(output)) == 4
+    check_duplicates_file(source, "col1", output, batch_size=3)
+    res = pd.read_parquet(output)
+    assert len(res) == 0
+    assert "col1" in res.columns
+
+
+def test_check_duplicates_batch(df):
+    """test the batch check gives the same as one check_duplicates per key set"""
+    key_sets = ["col4", ["col4", "col5"], ["col1"], ["col2", "col5"]]
+    for keep in [False, "first", "last"]:
+        for also_non_dupes in [False, True]:
+            results, indicators = check_duplicates_batch(
+                df,
+                key_sets,
+                keep=keep,
+                add_indicator_column=True,
+                also_return_non_duplicates=also_non_dupes,
+            )
+            assert list(results) == ["col4", "col4,col5", "col1", "col2,col5"]
+            assert list(indicators.columns) == list(results)
+            assert indicators.index.equals(df.index)
+            for cols, name in zip(key_sets, results):
+                expected = check_duplicates(
+                    df,
+                    cols,
+                    keep=keep,
+                    add_indicator_column=True,
+                    also_return_non_duplicates=also_non_dupes,
+                )
+                if expected is None:
+                    assert results[name] is None
+                else:
+                    pd.testing.assert_frame_equal(results[name], expected)
+    with pytest.raises(ValueError):
+        check_duplicates_batch(df, [["col1", "nope"]])
+
+
+def test_check_duplicates_group_columns():
+    """test group id, size, rank and aggregates match a pandas groupby"""
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(
+        {
+            "vendor": rng.integers(0, 5, 200),
+            "invoice": rng.integers(0, 8, 200),
+            "amount": rng.random(200).round(2),
+        }
+    )
+    df.loc[::7, "amount"] = np.nan
+    res = check_duplicates(
+        df,
+        ["vendor", "invoice"],
+        also_return_non_duplicates=True,
+        group_aggregates={"amount": "sum", "invoice": "max"},
+    )
+    grouped = df.groupby(["vendor", "invoice"])
+    assert list(res["dup_group_size"]) == list(grouped["amount"].transform("size"))
+    assert list(res["dup_rank_in_group"]) == list(grouped.cumcount() + 1)
+    assert np.allclose(res["dup_group_amount_sum"], grouped["amount"].transform("sum"))
+    assert list(res["dup_group_invoice_max"]) == list(df["invoice"])
+    assert (res["dup_group_id"] == -1).sum() == (res["dup_group_size"] == 1).sum()
+    first_ids = res.loc[res["dup_group_id"] >= 0, "dup_group_id"].drop_duplicates()
+    assert list(first_ids) == list(range(len(first_ids)))
+
+    res = check_duplicates(df, "vendor", keep="first", add_group_columns=True)
+    assert (res["dup_rank_in_group"] > 1).all()
+    with pytest.raises(TypeError):
+        check_duplicates(df.assign(txt="a"), "vendor", group_aggregates=["txt"])
+    with pytest.raises(ValueError):
+        check_duplicates(df, "vendor", group_aggregates={"amount": "median"})
+
+
+def test_check_near_duplicates():
+    """test near duplicates by supplier with amount and date tolerances"""
+    df = pd.DataFrame(
+        {
+            "supplier": ["a", "a", "a", "b", "b", "a", None],
+            "amount": [100.0, 100.01, 100.02, 100.0, 300.0, 50.0, 100.0],
+            "date": pd.to_datetime(
+                [
+                    "2024-01-01",
+                    "2024-01-03",
+                    "2024-01-20",
+                    "2024-01-01",
+                    "2024-01-01",
+                    "2024-01-01",
+                    "2024-01-02",
+                ]
+            ),
+        }
+    )
+    res = check_near_duplicates(
+        df, "supplier", ["amount", "date"], {"amount": 0.01, "date": 3}
+    )
+    assert list(res.index) == [0, 1]
+    assert list(res["_near_dup_group"]) == [0, 0]
+
+    # chained: 0-1 and 1-2 are close, so all three end up in the same group
+    pairs = check_near_duplicates(df, ["supplier"], "amount", 0.01, return_pairs=True)
+    assert list(pairs["index_left"]) == [0, 1]
+    assert list(pairs["index_right"]) == [1, 2]
+    assert list(pairs["_near_dup_group"]) == [0, 0]
+
+    res = check_near_duplicates(df, [], "amount", 0, also_return_non_duplicates=True)
+    assert list(res["_near_duplicates"]) == [1, 0, 0, 1, 0, 0, 1]
+    assert res["_near_dup_group"].isna().sum() == 4
+
+    assert check_near_duplicates(df, "supplier", "amount", 0.001) is None
+    with pytest.raises(ValueError):
+        check_near_duplicates(df, "supplier", "amount", [1, 2])
+    with pytest.raises(TypeError):
+        check_near_duplicates(df, "amount", "supplier", 1)
+
+
+def test_check_near_duplicates_brute_force():
+    """test all the pairs are found, comparing with all vs all"""
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        df = pd.DataFrame(
+            {
+                "k": rng.integers(0, 3, 50),
+                "x": rng.integers(0, 20, 50).astype(float),
+                "y": rng.integers(0, 10, 50),
+            }
+        )
+        res = check_near_duplicates(df, "k", ["x", "y"], [1, 2], return_pairs=True)
+        found = set()
+        if res is not None:
+            found = set(zip(res["index_left"], res["index_right"]))
+            found = {tuple(sorted(p)) for p in found}
+        expected = {
+            (i, j)
+            for i in range(50)
+            for j in range(i + 1, 50)
+            if df["k"][i] == df["k"][j]
+            and abs(df["x"][i] - df["x"][j]) <= 1
+            and abs(df["y"][i] - df["y"][j]) <= 2
+        }
+        assert found == expected
+
+
+def test_check_near_duplicates_mixed_magnitudes():
+    """test a large value doesn't widen the tolerance of the small ones"""
+    df = pd.DataFrame(
+        {
+            "vendor": ["a", "a", "a", "a", "b", "b"],
+            "amount": [100.0, 109.0, 5e10, 5e10 + 0.5, 0.1 + 0.2, 0.2],
+        }
+    )
+    assert check_near_duplicates(df, "vendor", "amount", 0.01) is None
+    # floating point noise: 0.1 + 0.2 - 0.2 is slightly above 0.1
+    res = check_near_duplicates(df, "vendor", "amount", 0.1, return_pairs=True)
+    assert set(zip(res["index_left"], res["index_right"])) == {(5, 4)}
+    res = check_near_duplicates(df, "vendor", "amount", 1)
+    assert list(res.index) == [2, 3, 4, 5]
+
+
 if __name__ == "__main__":
     pass
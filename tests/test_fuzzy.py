@@ -16,7 +16,15 @@ import pytest
 # pyright: reportGeneralTypeIssues=false, reportUnknownMemberType=false
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pydit import create_fuzzy_key
+from pydit import (
+    FuzzyIndex,
+    create_fuzzy_key,
+    create_phonetic_key,
+    fuzzy_merge,
+    jaro_winkler_similarity,
+    levenshtein_similarity,
+    token_set_ratio,
+)
 
 
 @pytest.fixture(name="df")
@@ -50,3 +58,233 @@ def test_fuzzy_matching(df):
     test_df = create_fuzzy_key(df, "input", "fuzzy", token_sort="token_set_sort")
     test_df["test_check"] = test_df["expected"] == test_df["fuzzy"]
     assert len(test_df[test_df["test_check"] == False]) == 0
+
+
+def test_fuzzy_key_repeated_values(df):
+    """Test the keys are the same when the values are repeated"""
+    dfbig = pd.concat([df] * 50, ignore_index=True).sample(frac=1, random_state=1)
+    test_df = create_fuzzy_key(dfbig, "input", "fuzzy", token_sort="token_set_sort")
+    assert (test_df["fuzzy"] == test_df["expected"]).all()
+    assert test_df.index.equals(dfbig.index)
+    assert "fuzzy" not in dfbig.columns
+
+    dfnum = pd.DataFrame({"input": [1, None, "Smith Ltd", 1]})
+    assert list(create_fuzzy_key(dfnum, "input")["fuzzy_key"]) == ["", "", "smith", ""]
+
+
+def test_fuzzy_merge():
+    """Test the fuzzy merge matches similar names and splits the rest"""
+    dfl = pd.DataFrame(
+        {
+            "name": ["John Smith", "Acme Ltd", "Jon Smith", None, "Peter Parker", ""],
+            "id": range(6),
+        }
+    )
+    dfr = pd.DataFrame(
+        {"vendor": ["Smith, John", "ACME Limited", "Bruce Wayne", "Jonh Smith"]}
+    )
+    both, left, right, left_na, right_na = fuzzy_merge(
+        dfl, dfr, "name", "vendor", threshold=0.7
+    )
+    assert list(zip(both["id"], both["vendor"])) == [
+        (0, "Smith, John"),
+        (1, "ACME Limited"),
+        (2, "Smith, John"),
+        (2, "Jonh Smith"),
+    ]
+    assert both["_score"].between(0.7, 1).all()
+    assert list(left["id"]) == [4]
+    assert list(right["vendor"]) == ["Bruce Wayne"]
+    assert list(left_na["id"]) == [3, 5]
+    assert len(right_na) == 0
+
+    both = fuzzy_merge(dfl, dfr, "name", "vendor", threshold=0.5, best_match=True)[0]
+    assert list(both.groupby("id")["_score"].nunique()) == [1, 1, 1]
+    both = fuzzy_merge(dfl, dfr, "name", "vendor", threshold=1, method="token")[0]
+    assert list(both["id"]) == [0, 1]
+    with pytest.raises(ValueError):
+        fuzzy_merge(dfl, dfr, "name", "vendor", threshold=0)
+
+
+def test_fuzzy_merge_all_pairs():
+    """Test the blocking finds the same pairs as comparing all vs all"""
+    rng = np.random.default_rng(0)
+    words = ["alpha", "beta", "gamma", "smith", "jones", "acme", "john", "mary"]
+    names = [" ".join(rng.choice(words, rng.integers(1, 4))) for _ in range(200)]
+    names = [n.replace("a", "e", 1) if i % 3 else n for i, n in enumerate(names)]
+    dfl = pd.DataFrame({"name": names[:100]})
+    dfr = pd.DataFrame({"name": names[100:]})
+    keys_l = create_fuzzy_key(dfl, "name", token_sort="token_set_sort")["fuzzy_key"]
+    keys_r = create_fuzzy_key(dfr, "name", token_sort="token_set_sort")["fuzzy_key"]
+
+    def grams(k):
+        k = f" {k} "
+        return {k[i : i + 3] for i in range(len(k) - 2)}
+
+    for threshold in [0.3, 0.6, 0.9]:
+        both = fuzzy_merge(dfl, dfr, "name", "name", threshold=threshold)[0]
+        expected = sum(
+            2 * len(grams(a) & grams(b)) / (len(grams(a)) + len(grams(b))) >= threshold
+            for a in keys_l
+            for b in keys_r
+        )
+        assert len(both) == expected
+
+
+def _levenshtein(a, b):
+    """Plain dynamic programming edit distance to check the fast one"""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+def test_levenshtein_similarity():
+    """Test the bit-parallel Levenshtein against the plain algorithm"""
+    rng = np.random.default_rng(0)
+    a = ["".join(rng.choice(list("abc "), rng.integers(0, 90))) for _ in range(300)]
+    b = ["".join(rng.choice(list("abc "), rng.integers(0, 90))) for _ in range(300)]
+    expected = np.array(
+        [1 - _levenshtein(x, y) / max(len(x), len(y), 1) for x, y in zip(a, b)]
+    )
+    assert np.allclose(levenshtein_similarity(a, b), expected)
+    expected[expected < 0.6] = 0
+    assert np.allclose(levenshtein_similarity(a, b, threshold=0.6), expected)
+
+    scores = levenshtein_similarity("kitten", pd.Series(["sitting", "kitten", None]))
+    assert np.allclose(scores, [1 - 3 / 7, 1, 0])
+    assert levenshtein_similarity(["", "ab"], ["", "ba"]).tolist() == [1, 0]
+    with pytest.raises(ValueError):
+        levenshtein_similarity(["a", "b"], ["a"])
+
+
+def test_jaro_winkler_similarity():
+    """Test Jaro-Winkler with the classic examples"""
+    scores = jaro_winkler_similarity(
+        ["martha", "dwayne", "dixon", "abc", "", "abc"],
+        ["marhta", "duane", "dicksonx", "xyz", "", ""],
+    )
+    assert np.allclose(scores, [0.961111, 0.84, 0.813333, 0, 1, 0], atol=1e-6)
+    scores = jaro_winkler_similarity("dixon", ["dicksonx", "dixon"], threshold=0.9)
+    assert scores.tolist() == [0, 1]
+
+
+def test_token_set_ratio():
+    """Test the token set ratio ignores order and repeated words"""
+    scores = token_set_ratio(
+        ["smith john", "john smith john", "john brown", "", "ab cd"],
+        ["john a smith", "smith john", "smith john", "john", "ab ce"],
+    )
+    assert np.allclose(scores, [1, 1, 4 / 7, 0, 0.8])
+    assert token_set_ratio("john brown", ["smith john"], threshold=0.6).tolist() == [0]
+
+
+def test_fuzzy_index(tmp_path):
+    """Test the fuzzy index query, add, save and load"""
+    dfmaster = pd.DataFrame(
+        {"name": ["Acme Ltd", "John Smith", "Jon Smith", None, "ACME limited"]},
+        index=[10, 11, 12, 13, 14],
+    )
+    index = FuzzyIndex(dfmaster, "name")
+    assert len(index) == 4
+    assert index.n_keys == 3
+    res = index.query(["Smith, John", "acme", "nobody"], top_k=2, min_score=0.6)
+    assert list(res["query_id"]) == [0, 0, 1, 1]
+    assert list(res["match_index"]) == [11, 12, 10, 14]
+    assert list(res["rank"]) == [1, 2, 1, 2]
+    assert res["score"].iloc[0] == 1
+
+    index.add(pd.DataFrame({"name": ["Jonh Smith", "john smith"]}, index=[20, 21]))
+    assert index.n_keys == 4
+    res = index.query("John Smith", top_k=10, min_score=0.5)
+    assert list(res["match_index"]) == [11, 21, 12, 20]
+
+    index.save(tmp_path / "index")
+    loaded = FuzzyIndex.load(tmp_path / "index")
+    pd.testing.assert_frame_equal(
+        loaded.query("John Smith", top_k=10, min_score=0.5), res
+    )
+    loaded.add(pd.Series(["Peter Parker"], index=[30]))
+    assert loaded.query("parker peter")["match_index"].tolist() == [30]
+
+    index = FuzzyIndex(pd.Series(["abc", "abd"], index=["x", "y"]))
+    index.add(pd.Series(["abc"], index=[5]))
+    assert index.query("abc")["match_index"].tolist() == ["x", "5"]
+    with pytest.raises(ValueError):
+        index.query("abc", min_score=0)
+
+
+def test_fuzzy_index_save_over_loaded(tmp_path):
+    """Test saving a memory-mapped index back to the folder it was loaded from"""
+    dfmaster = pd.DataFrame({"name": ["John Smith", "Acme Ltd", "Mary Jones"]})
+    FuzzyIndex(dfmaster, "name").save(tmp_path)
+    loaded = FuzzyIndex.load(tmp_path)
+    loaded.add(pd.Series(["Peter Parker"], index=[3]))
+    loaded.save(tmp_path)
+    assert loaded.query("john smith")["match_index"].tolist() == [0]
+    reloaded = FuzzyIndex.load(tmp_path)
+    assert reloaded.query("john smith")["match_index"].tolist() == [0]
+    assert reloaded.query("parker peter")["match_index"].tolist() == [3]
+    reloaded.save(tmp_path)
+    assert FuzzyIndex.load(tmp_path).query("acme")["match_index"].tolist() == [1]
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+
+def test_fuzzy_index_same_as_merge():
+    """Test the index finds the same matches as fuzzy_merge"""
+    rng = np.random.default_rng(0)
+    words = ["alpha", "beta", "gamma", "smith", "jones", "acme", "john", "mary"]
+    names = [" ".join(rng.choice(words, rng.integers(1, 4))) for _ in range(300)]
+    names = [n.replace("a", "e", 1) if i % 3 else n for i, n in enumerate(names)]
+    dfmaster = pd.DataFrame({"name": names[:200]})
+    dfnew = pd.DataFrame({"name": names[200:]})
+    both = fuzzy_merge(dfnew, dfmaster, "name", "name", threshold=0.7)[0]
+    index = FuzzyIndex(dfmaster.iloc[:100], "name").add(dfmaster.iloc[100:])
+    res = index.query(dfnew["name"], top_k=1000, min_score=0.7)
+    assert len(res) == len(both)
+    assert np.allclose(np.sort(res["score"]), np.sort(both["_score"]))
+
+
+def test_fuzzy_key_transliterate():
+    """Test the transliteration of non latin names"""
+    df = pd.DataFrame({"name": ["Jürgen Müßig", "Юрий Гагарин", "Σωκράτης", None]})
+    res = create_fuzzy_key(df, "name", transliterate=True)
+    assert res["fuzzy_key"].tolist() == [
+        "jurgen mussig",
+        "yurii gagarin",
+        "sokratis",
+        "",
+    ]
+    assert create_fuzzy_key(df, "name")["fuzzy_key"].tolist()[:2] == [
+        "jurgen muig",
+        "",
+    ]
+
+
+def test_create_phonetic_key():
+    """Test the soundex and metaphone keys"""
+    words = ["Ashcraft", "Tymczak", "Pfister", "Honeyman", "Robert", "Rupert"]
+    df = pd.DataFrame({"name": words})
+    res = create_phonetic_key(df, "name")
+    assert res["phonetic_key"].tolist() == [
+        "A261",
+        "T522",
+        "P236",
+        "H555",
+        "R163",
+        "R163",
+    ]
+    df = pd.DataFrame(
+        {"name": ["John Smith", "Jon Smyth", "Smith, John", "Knight 12", np.nan]}
+    )
+    res = create_phonetic_key(df, "name", method="metaphone")
+    assert res["phonetic_key"].tolist() == ["JN SM0", "JN SM0", "JN SM0", "12 NT", ""]
+    res = create_phonetic_key(df, "name", token_sort=None)
+    assert res["phonetic_key"].tolist()[2] == "S530 J500"
+    with pytest.raises(ValueError):
+        create_phonetic_key(df, "name", method="nysiis")
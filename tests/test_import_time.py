@@ -0,0 +1,77 @@
+"""Test that importing pydit stays fast, the heavy dependencies load on use"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# pylint: disable=import-error disable=wrong-import-position
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pydit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    """Runs the code in a fresh interpreter, returns its last printed line"""
+    res = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return res.stdout.strip().splitlines()[-1]
+
+
+def test_import_is_lazy():
+    """test that import pydit doesn't load the modules and heavy libraries"""
+    loaded = _run(
+        "import sys, pydit; from pydit import check_duplicates; "
+        "print(sorted(m for m in sys.modules "
+        "if m.startswith(('matplotlib', 'scipy', 'pydit.'))))"
+    )
+    assert loaded == str(
+        [
+            "pydit.logger",
+            "pydit.statistics",
+            "pydit.wrangling",
+            "pydit.wrangling.duplicates",
+            "pydit.wrangling.file_utils",
+        ]
+    )
+
+
+def test_lazy_export_named_as_module():
+    """test that importing a submodule doesn't hide the function of the same name"""
+    res = _run(
+        "import types, pydit.wrangling.lookup_values; import pydit; "
+        "print([isinstance(f, types.FunctionType) for f in "
+        "(pydit.lookup_values, pydit.wrangling.lookup_values)])"
+    )
+    assert res == "[True, True]"
+
+
+def test_import_time():
+    """benchmark the import, it should take a fraction of pandas' import"""
+    # relative to pandas, timed in the same interpreter, so a slow or busy
+    # machine slows down both
+    pydit_time, pandas_time = _run(
+        "import time; start = time.perf_counter(); import pydit; "
+        "mid = time.perf_counter(); import pandas; "
+        "print(mid - start, time.perf_counter() - mid)"
+    ).split()
+    # the eager imports of matplotlib and scipy took longer than pandas
+    assert float(pydit_time) < float(pandas_time)
+
+
+def test_lazy_exports():
+    """test that all the exports are still available from the root"""
+    for package in (pydit.statistics, pydit.wrangling):
+        for name in package.__all__:
+            assert getattr(pydit, name) is getattr(package, name)
+            assert name in dir(pydit)
+    assert pydit.benford_probability(1) > 0.3
+    with pytest.raises(AttributeError):
+        _ = pydit.not_a_function
@@ -2,8 +2,11 @@
 Test module for keyword_search
 """
 
+import logging
 import os
+import sqlite3
 import sys
+from contextlib import closing
 
 import numpy as np
 import pandas as pd
@@ -13,7 +16,12 @@ import pytest
 # pylint: disable=import-error
 # pylint: disable=wrong-import-position
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pydit import keyword_search
+from pydit import (
+    KeywordSearcher,
+    keyword_search,
+    keyword_search_file,
+    keyword_search_incremental,
+)
 
 
 @pytest.fixture(name="df")
@@ -144,5 +152,326 @@ def test_keyword_search_details(df):
     assert res_list == ["april", "may", "february", "june"]
 
 
+def test_keyword_search_overlapping_keywords(df):
+    """test that keywords overlapping in the same text are all flagged"""
+    for regexp in [True, False]:
+        res = keyword_search(
+            df, ["south-east", "south", "east"], columns=["col7"], regexp=regexp
+        )
+        assert list(res["kw_match01"]) == [False, False, True, False, False, False]
+        assert list(res["kw_match02"]) == [True, False, True, True, False, False]
+        assert list(res["kw_match03"]) == [False, False, True, False, False, False]
+        assert list(res["kw_match_all"]) == [True, False, True, True, False, False]
+
+
+def test_keyword_search_many_keywords(df):
+    """test column naming and results with more than 99 keywords"""
+    keywords = ["zzz" + str(i) for i in range(119)] + ["north"]
+    for regexp in [True, False]:
+        res = keyword_search(df, keywords, columns=["col7"], regexp=regexp)
+        assert "kw_match001" in res.columns
+        assert list(res["kw_match120"]) == [False, True, False, False, False, True]
+        assert res["kw_match_all"].sum() == 2
+
+
+def test_keyword_search_re_not_combinable(df):
+    """test regexps with inline flags or backreferences still work"""
+    res = keyword_search(df, ["(?i)NORTH", r"(o)\1"], columns=["col7"])
+    assert list(res["kw_match01"]) == [False, True, False, False, False, True]
+    assert list(res["kw_match02"]) == [False] * 6
+
+    res = keyword_search(df, [r"(u)\1", r"(t)h\1?"], columns=["col7"])
+    assert list(res["kw_match02"]) == [True, True, True, True, False, True]
+
+
+def test_keyword_search_parallel(df):
+    """test that the chunked parallel search returns the same as the serial one"""
+    for regexp in [True, False]:
+        expected = keyword_search(
+            df,
+            ["feb", "mar", "west"],
+            columns=["col1", "col2", "col3", "col7"],
+            regexp=regexp,
+        )
+        res = keyword_search(
+            df,
+            ["feb", "mar", "west"],
+            columns=["col1", "col2", "col3", "col7"],
+            regexp=regexp,
+            n_jobs=2,
+            chunksize=4,
+        )
+        pd.testing.assert_frame_equal(res, expected)
+
+    with pytest.raises(ValueError):
+        keyword_search(df, ["feb"], columns=["col1"], n_jobs=0)
+    with pytest.raises(ValueError):
+        keyword_search(df, ["feb"], columns=["col1"], n_jobs=2, chunksize=0)
+
+
+def test_keyword_search_join_columns(df):
+    """test searching each column on its own instead of the joined text"""
+    expected = keyword_search(df, ["feb", "mar"], columns=["col1", "col2", "col3"])
+    for sparse in [False, True]:
+        res = keyword_search(
+            df,
+            ["feb", "mar"],
+            columns=["col1", "col2", "col3"],
+            join_columns=False,
+            return_data="sparse" if sparse else "full",
+        )
+        if sparse:
+            assert (res[0].toarray() == expected[["kw_match01", "kw_match02"]]).all(
+                axis=None
+            )
+        else:
+            pd.testing.assert_frame_equal(res, expected)
+
+    # a keyword spanning two columns only matches the joined text
+    res = keyword_search(df, ["april apr"], columns=["col1", "col2", "col3"])
+    assert list(res["kw_match01"]) == [False] * 3 + [True, False, False]
+    res = keyword_search(
+        df, ["april apr"], columns=["col1", "col2", "col3"], join_columns=False
+    )
+    assert res["kw_match01"].sum() == 0
+    # and anchors are relative to each column
+    res = keyword_search(df, ["^mar"], columns=["col1", "col3"], join_columns=False)
+    assert list(res["kw_match01"]) == [False, False, True, True, False, False]
+
+
+def test_keyword_search_spans(df):
+    """test the position and snippet of each match"""
+    for regexp in [True, False]:
+        res = keyword_search(
+            df,
+            ["world", "hello"],
+            columns="col4",
+            labels=["W", "H"],
+            return_data="spans",
+            key_column="col6",
+            context=3,
+            regexp=regexp,
+        )
+        assert list(res.columns) == [
+            "col6",
+            "keyword",
+            "labels",
+            "start",
+            "end",
+            "snippet",
+        ]
+        assert len(res) == 12
+        first = res.iloc[0]
+        assert (first["col6"], first["keyword"], first["labels"]) == (1, "world", "W")
+        assert (first["start"], first["end"], first["snippet"]) == (6, 11, "lo world")
+        last = res.iloc[-1]
+        assert (last["start"], last["end"], last["snippet"]) == (5, 10, ", \nhello wo")
+
+    res = keyword_search(
+        df, ["feb"], columns=["col1", "col2"], return_data="spans", context=0
+    )
+    assert list(res.index) == [1, 1, 5]
+    assert list(res["start"]) == [0, 10, 5]
+    assert list(res["snippet"]) == ["feb", "Feb", "Feb"]
+
+    res = keyword_search(
+        df,
+        ["feb"],
+        columns=["col1", "col2"],
+        return_data="spans",
+        join_columns=False,
+        n_jobs=2,
+        chunksize=2,
+    )
+    assert list(res["column"]) == ["col1", "col2", "col2"]
+    assert list(res["start"]) == [0, 1, 0]
+
+    # "İ".lower() is two characters, the offsets are still of the original text
+    dftext = pd.DataFrame({"t": ["İİİ Fraud here"]})
+    for regexp in [True, False]:
+        res = keyword_search(
+            dftext, ["fraud"], return_data="spans", context=1, regexp=regexp
+        )
+        assert (res["start"][0], res["end"][0]) == (4, 9)
+        assert res["snippet"][0] == " Fraud "
+
+
+def test_keyword_search_sparse(df):
+    """test the sparse matrix output matches the dense one"""
+    keywords = ["south-east", "south", "north", "west"]
+    labels = ["South", "South", "North", "West"]
+    expected = keyword_search(df, keywords, columns="col7", labels=labels)
+    for regexp in [True, False]:
+        hits, columns, summary = keyword_search(
+            df,
+            keywords,
+            columns="col7",
+            labels=labels,
+            return_data="sparse",
+            regexp=regexp,
+            n_jobs=2,
+            chunksize=4,
+        )
+        assert hits.shape == (6, 3)
+        assert list(columns) == ["South", "North", "West"]
+        assert (hits.toarray() == expected[list(columns)].to_numpy()).all()
+        assert list(summary["kw_match_count"]) == [1, 1, 1, 2, 1, 1]
+        assert list(summary["kw_match_all"]) == list(expected["kw_match_all"])
+
+    hits, columns, summary = keyword_search(
+        df, ["feb", "mar"], columns=["col1", "col2"], return_data="sparse"
+    )
+    assert list(columns) == ["kw_match01", "kw_match02"]
+    assert hits.nnz == 3
+
+
+def test_keyword_search_count(df):
+    """test the hit count does not include the kw_match_all column"""
+    res = keyword_search(df, ["south", "west"], columns="col7")
+    assert list(res["kw_match_count"]) == [1, 0, 1, 2, 1, 0]
+
+
+def test_keyword_searcher(df):
+    """test the precompiled searcher gives the same results as keyword_search"""
+    searcher = KeywordSearcher(["west$", "north"], labels=["West", "North"])
+    expected = keyword_search(
+        df, ["west$", "north"], columns="col7", labels=["West", "North"]
+    )
+    pd.testing.assert_frame_equal(searcher.search(df, "col7"), expected)
+    # the searcher can be reused with other data
+    res = searcher.search_series(df["col7"])
+    assert list(res.columns) == ["West", "North", "kw_match_all", "kw_match_count"]
+    assert list(res["North"]) == [False, True, False, False, False, True]
+    res = searcher.search_series(pd.Series(["north pole", "west"], index=[10, 20]))
+    assert list(res.index) == [10, 20]
+    assert list(res["kw_match_all"]) == [True, True]
+
+    searcher = KeywordSearcher("JUNE", case_sensitive=True, regexp=False)
+    res = searcher.search(df, ["col1"], return_data="result")
+    assert res["kw_match01"].sum() == 0
+
+    with pytest.raises(ValueError):
+        KeywordSearcher(["(unclosed"])
+    with pytest.raises(ValueError):
+        KeywordSearcher(["a", "b"], labels=["a"])
+    with pytest.raises(TypeError):
+        searcher.search_series(df)
+
+
+def test_keyword_searcher_compiles_once(df, monkeypatch):
+    """test the searcher doesn't compile again, even if the cache was cleared"""
+    from pydit.wrangling import keyword_search_batch
+
+    searcher = KeywordSearcher(["west$", "north"], labels=["West", "North"])
+    expected = searcher.search(df, "col7", return_data="spans")
+
+    def fail(*args):
+        raise AssertionError("keywords compiled again")
+
+    monkeypatch.setattr(keyword_search_batch, "_compile_keywords", fail)
+    pd.testing.assert_frame_equal(
+        searcher.search(df, "col7", return_data="spans"), expected
+    )
+    res = searcher.search(df, ["col1", "col7"], join_columns=False)
+    assert list(res["North"]) == [False, True, False, False, False, True]
+
+
+def test_keyword_search_incremental(df, tmp_path, caplog):
+    """test that only new or changed rows are searched on the next run"""
+    caplog.set_level(logging.INFO)
+    store = tmp_path / "hits.sqlite"
+    keywords = ["feb", "mar"]
+    columns = ["col1", "col2", "col3"]
+    res = keyword_search_incremental(df, keywords, columns, "col6", store)
+    pd.testing.assert_frame_equal(res, keyword_search(df, keywords, columns))
+    assert "to search: 6" in caplog.text
+
+    caplog.clear()
+    df2 = pd.concat(
+        [df, pd.DataFrame({"col1": ["march"], "col6": [7], "col7": ["East"]})],
+        ignore_index=True,
+    )
+    df2.loc[0, "col1"] = "february"
+    res = keyword_search_incremental(df2, keywords, columns, "col6", store)
+    pd.testing.assert_frame_equal(res, keyword_search(df2, keywords, columns))
+    assert "unchanged since last run: 5, to search: 2" in caplog.text
+
+    # new keywords, so we search everything again
+    caplog.clear()
+    res = keyword_search_incremental(
+        df2, ["west"], "col7", "col6", store, return_data="detail"
+    )
+    assert "to search: 7" in caplog.text
+    assert list(res["col6"]) == [4, 5]
+
+    with pytest.raises(ValueError):
+        keyword_search_incremental(df2, keywords, columns, "col7", store)
+
+
+def test_keyword_search_incremental_many_keywords(df, tmp_path):
+    """test the stored hits of more than 8 keywords and a store of older layout"""
+    store = tmp_path / "hits.sqlite"
+    with closing(sqlite3.connect(store)) as conn:
+        conn.execute("CREATE TABLE kw_hits (key TEXT, row_hash INTEGER, matches TEXT)")
+        conn.commit()
+    keywords = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "jun"]
+    expected = keyword_search(df, keywords, "col1")
+    res = keyword_search_incremental(df, keywords, "col1", "col6", store)
+    pd.testing.assert_frame_equal(res, expected)
+    # all from the store this time
+    res = keyword_search_incremental(df, keywords, "col1", "col6", store)
+    pd.testing.assert_frame_equal(res, expected)
+    assert res["kw_match10"].sum() == 1
+
+
+def test_keyword_search_file(df, tmp_path):
+    """test the search in batches of a csv file gives the same as in memory"""
+    source = tmp_path / "source.csv"
+    df.to_csv(source, index=False)
+    output = tmp_path / "hits.csv"
+    summary = keyword_search_file(
+        source, ["feb", "mar"], ["col1", "col2", "col3"], output, batch_size=4
+    )
+    assert list(summary["hits"]) == [3, 2]
+    res = pd.read_csv(output)
+    assert list(res["source_row"]) == [1, 2, 3, 5]
+    assert list(res["col1"]) == ["february", "march", "april", "june"]
+    assert list(res["kw_match01"]) == [True, True, False, True]
+    assert list(res["kw_match_all"]) == [True, True, True, True]
+
+    summary = keyword_search_file(
+        source,
+        [r"west$", "north"],
+        "col7",
+        output,
+        return_data="detail",
+        labels=["West", "North"],
+        key_column="col1",
+        batch_size=2,
+    )
+    res = pd.read_csv(output)
+    assert list(res.columns) == ["source_row", "col1", "labels", "keyword"]
+    assert sorted(res["col1"]) == ["april", "february", "june", "may"]
+    assert list(summary["labels"]) == ["West", "North"]
+
+
+def test_keyword_search_file_parquet(df, tmp_path):
+    """test the search in batches of a parquet file"""
+    pytest.importorskip("pyarrow")
+    source = tmp_path / "source.parquet"
+    df[["col1", "col7"]].to_parquet(source)
+    output = tmp_path / "hits.parquet"
+    keyword_search_file(source, ["north"], "col7", output, batch_size=4)
+    res = pd.read_parquet(output)
+    assert list(res["source_row"]) == [1, 5]
+    assert list(res["col1"]) == ["february", "june"]
+
+    # a rerun without hits replaces the previous output
+    keyword_search_file(source, ["nowhere"], "col7", output, batch_size=4)
+    res = pd.read_parquet(output)
+    assert len(res) == 0
+    assert "col1" in res.columns
+
+
 if __name__ == "__main__":
     pass